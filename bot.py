@@ -10,22 +10,38 @@ from aiogram_i18n import I18nMiddleware
 
 from infrastructure.database.models import Base
 from infrastructure.database.redis_client import RedisClient
+from infrastructure.database.repo.leaderboard import LeaderboardRepo
 from infrastructure.database.setup import create_engine, create_session_pool
 from tgbot.config import load_config, Config
 from tgbot.handlers import routers_list
 from tgbot.middlewares.config import ConfigMiddleware
 from tgbot.middlewares.database import DatabaseMiddleware
+from tgbot.middlewares.flood_control import FloodControlMiddleware
 from tgbot.middlewares.redis import RedisMiddleware
 from tgbot.middlewares.translations import TgUserManager
+from tgbot.middlewares.user import UserMiddleware
 from aiogram_i18n.cores import FluentRuntimeCore
-# from tgbot.services import broadcaster
-
-
-async def on_startup(bot: Bot, admin_ids: list[int]):
-    pass
-    # await broadcaster.broadcast(bot, admin_ids, "Бот был запущен")
+from tgbot.services import broadcaster, mailing, leaderboard, notifications
+
+
+async def on_startup(bot: Bot, config: Config, session_pool, redis: RedisClient):
+    # Notifications and mailings sent from the bot share the limit with the mailing workers
+    broadcaster.rate_limiter = broadcaster.shared_rate_limiter(redis, bot.id, config.broadcast.rate_limit)
+    # Continue the mailings interrupted by the previous shutdown from their last checkpoint
+    await mailing.resume_mailings(bot, session_pool, redis, config.broadcast)
+    # Build the balance leaderboard once, later it's kept up to date on every balance change
+    async with session_pool() as session:
+        await LeaderboardRepo(session, redis).ensure_built()
+    leaderboard.start_archiving(session_pool, redis)
+    # Referrer notifications are queued by handlers and sent from here
+    notifications.start_sending(bot)
+    # Share the cache hit rates of this process, see the /metrics endpoint
+    broadcaster.run_in_background(redis.cache.report_stats())
+    # await broadcaster.broadcast(bot, config.tg_bot.admin_ids, "Бот был запущен")
 
 async def on_shutdown(redis_client: RedisClient):
+    await notifications.drain()
+    await redis_client.cache.flush_stats()
     await redis_client.close()
 
 
@@ -111,6 +127,7 @@ async def main():
     storage = get_storage(config)
 
     bot = Bot(token=config.tg_bot.token, default=DefaultBotProperties(parse_mode='HTML'))
+    bot.session.middleware(FloodControlMiddleware(config.broadcast.rate_limit))
     dp = Dispatcher(storage=storage)
 
     engine = create_engine(config.db)
@@ -122,8 +139,10 @@ async def main():
     i18n_middleware = I18nMiddleware(
         core=FluentRuntimeCore("tgbot/locales"),
         default_locale="ru",
-        manager=TgUserManager(session_pool, redis)
+        manager=TgUserManager()
     )
+    # The user has to be resolved before i18n picks the locale
+    dp.update.outer_middleware(UserMiddleware(session_pool, redis))
     i18n_middleware.setup(dp)
 
     await create_tables(engine)
@@ -132,7 +151,7 @@ async def main():
 
     register_global_middlewares(dp, config, session_pool, redis)
 
-    await on_startup(bot, config.tg_bot.admin_ids)
+    await on_startup(bot, config, session_pool, redis)
     try:
         await dp.start_polling(bot)
     finally:
@@ -4,8 +4,11 @@ import betterlogging as bl
 import fastapi
 from aiogram import Bot
 from fastapi import FastAPI
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, PlainTextResponse
 
+from infrastructure.database import cache
+from infrastructure.database.redis_client import RedisClient
+from infrastructure.database.repo.broadcasts import BroadcastsRepo
 from tgbot.config import load_config, Config
 
 app = FastAPI()
@@ -15,8 +18,73 @@ log = logging.getLogger(__name__)
 
 config: Config = load_config(".env")
 bot = Bot(token=config.tg_bot.token)
+redis = RedisClient(config.redis.dsn())
+
+
+@app.on_event("startup")
+async def on_startup():
+    await redis.connect()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await redis.close()
 
 
 @app.post("/api")
 async def webhook_endpoint(request: fastapi.Request):
     return JSONResponse(status_code=200, content={"status": "ok"})
+
+
+def _label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Exposes the progress of running broadcasts and the cache statistics in the Prometheus text format.
+    """
+    jobs = BroadcastsRepo(redis)
+    gauges = {
+        "broadcast_sent": "Messages delivered by the broadcast.",
+        "broadcast_failed": "Failed deliveries of the broadcast, excluding blocked chats.",
+        "broadcast_blocked": "Blocked, deactivated or deleted chats found by the broadcast.",
+        "broadcast_total": "Recipients of the broadcast.",
+        "broadcast_rate": "Delivery rate of the broadcast, messages per second.",
+        "broadcast_eta_seconds": "Estimated time to finish the broadcast.",
+    }
+    active_jobs = await jobs.get_active_jobs()
+
+    lines = []
+    for name, description in gauges.items():
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+        for job in active_jobs:
+            value = getattr(job, name.removeprefix("broadcast_").removesuffix("_seconds"))
+            lines.append(f'{name}{{job="{job.job_id}"}} {value}')
+
+    lines += ["# HELP broadcast_errors Delivery errors of the broadcast by description.",
+              "# TYPE broadcast_errors gauge"]
+    for job in active_jobs:
+        for error, count in (await jobs.get_errors(job.job_id)).items():
+            lines.append(f'broadcast_errors{{job="{job.job_id}",error="{_label(error)}"}} {count}')
+
+    stats = {namespace.name: await redis.redis.hgetall(f"cache:stats:{namespace.name}")
+             for namespace in cache.NAMESPACES}
+    counters = {
+        "cache_requests_total": "Cache lookups by namespace and result.",
+        "cache_early_refreshes_total": "Values reloaded before their expiry.",
+        "cache_loads_total": "Values loaded on a miss or an early refresh.",
+        "cache_load_seconds_total": "Time spent loading values.",
+    }
+    for name, description in counters.items():
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+        for namespace, values in stats.items():
+            if name == "cache_requests_total":
+                for field, result in (("local_hits", "local_hit"), ("hits", "hit"), ("misses", "miss")):
+                    lines.append(f'{name}{{namespace="{namespace}",result="{result}"}} {values.get(field, 0)}')
+            else:
+                field = name.removeprefix("cache_").removesuffix("_total")
+                lines.append(f'{name}{{namespace="{namespace}"}} {values.get(field, 0)}')
+
+    return PlainTextResponse("\n".join(lines) + "\n")
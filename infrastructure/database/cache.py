@@ -0,0 +1,390 @@
+import asyncio
+import json
+import logging
+import math
+import random
+import time
+from dataclasses import dataclass, asdict, fields
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional, Sequence, Tuple, TYPE_CHECKING
+
+from infrastructure.database.views import UserView, ReferralView
+
+if TYPE_CHECKING:
+    from infrastructure.database.redis_client import RedisClient
+
+
+@dataclass(frozen=True)
+class Codec:
+    """
+    Converts cached values to JSON-compatible objects and back.
+
+    :param encode: Converts a value to a JSON-compatible object.
+    :param decode: Converts the JSON-compatible object back to the value.
+    """
+    encode: Callable[[Any], Any]
+    decode: Callable[[Any], Any]
+
+
+JSON_CODEC = Codec(encode=lambda value: value, decode=lambda data: data)
+
+
+def dataclass_codec(cls: type) -> Codec:
+    return Codec(encode=asdict, decode=lambda data: cls(**data))
+
+
+def dataclass_list_codec(cls: type) -> Codec:
+    return Codec(encode=lambda values: [asdict(value) for value in values],
+                 decode=lambda data: [cls(**item) for item in data])
+
+
+@dataclass(frozen=True)
+class Namespace:
+    """
+    A group of cached values sharing the key prefix, the expiry policy and the codec.
+
+    :param name: The key prefix.
+    :param ttl: Seconds a value is kept in Redis.
+    :param codec: Converts the values to JSON and back.
+    :param beta: Eagerness of the early refresh, 0 disables it. With 1 the refresh usually starts
+        within a few load durations before the expiry, higher values start it earlier.
+    :param local: Whether the values are also kept in process memory.
+    """
+    name: str
+    ttl: int
+    codec: Codec = JSON_CODEC
+    beta: float = 1.0
+    local: bool = True
+
+    def key(self, *parts: Any) -> str:
+        return ":".join(("cache", self.name, *map(str, parts)))
+
+
+def version_key(key: str) -> str:
+    """
+    The counter bumped by every write of a cached key, so a load that read the database before the write
+    doesn't cache the stale value after it, see `Cache._load`.
+    """
+    return f"version:{key}"
+
+
+# Every cached value in the application, tune expiry and early refresh here
+USERS = Namespace("user", ttl=7 * 24 * 60 * 60, codec=dataclass_codec(UserView))
+TASKS = Namespace("task", ttl=24 * 60 * 60)
+TASK_LISTS = Namespace("tasks", ttl=24 * 60 * 60)
+REFERRALS = Namespace("referral", ttl=24 * 60 * 60, codec=Codec(
+    encode=lambda value: {"referral": asdict(value["referral"]), "language": value["language"]},
+    decode=lambda data: {"referral": ReferralView(**data["referral"]), "language": data["language"]},
+))
+REFERRALS_BY_USER = Namespace("referrals_by_user", ttl=24 * 60 * 60, codec=dataclass_list_codec(ReferralView))
+# Kept up to date by increments, the short expiry only bounds the drift after bulk imports
+REFERRAL_COUNTS = Namespace("referral_counts", ttl=60 * 60)
+NAMESPACES = (USERS, TASKS, TASK_LISTS, REFERRALS, REFERRALS_BY_USER, REFERRAL_COUNTS)
+
+# Adds a number to a field of a cached object, keeping its expiry. Nothing happens if the value isn't cached,
+# but the version is bumped either way, so a load in flight doesn't cache the value from before the increment
+INCREMENT_FIELD = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+local raw = redis.call('GET', KEYS[1])
+if not raw then
+    return 0
+end
+local envelope = cjson.decode(raw)
+envelope.v[ARGV[1]] = envelope.v[ARGV[1]] + tonumber(ARGV[2])
+redis.call('SET', KEYS[1], cjson.encode(envelope), 'KEEPTTL')
+return 1
+"""
+
+# Caches a loaded value unless the key was written since the load started
+SET_IF_UNCHANGED = """
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+
+@dataclass
+class CacheStats:
+    """
+    Counters of a namespace since the last flush.
+    """
+    local_hits: int = 0
+    hits: int = 0
+    misses: int = 0
+    early_refreshes: int = 0
+    loads: int = 0
+    load_seconds: float = 0.0
+
+
+@dataclass(frozen=True, slots=True)
+class _Entry:
+    value: Any
+    # Seconds the value took to load and the moment it expires, used by the early refresh
+    delta: float
+    expires_at: float
+
+
+class Cache:
+    """
+    Cache-aside layer used by every repository.
+
+    Values are stored in Redis as JSON envelopes holding the encoded value, how long it took to load
+    and when it expires, and additionally kept in process memory for namespaces with `local=True`.
+
+    `get_or_load` refreshes a value a bit before its expiry with a probability growing as the expiry
+    approaches (XFetch), so a popular key is reloaded by one caller instead of all of them at once.
+    Concurrent loads of the same key are coalesced with single-flight.
+
+    Writes drop the key from the process memory of every instance, see `RedisClient.invalidate`,
+    and bump its version, so a load that started before the write doesn't overwrite the written value.
+
+    :param redis_client: The Redis client.
+    """
+
+    def __init__(self, redis_client: "RedisClient"):
+        self.redis_client = redis_client
+        self.stats: Dict[str, CacheStats] = {namespace.name: CacheStats() for namespace in NAMESPACES}
+        self._increment_script = None
+        self._set_if_unchanged_script = None
+
+    def _stats(self, namespace: Namespace) -> CacheStats:
+        return self.stats.setdefault(namespace.name, CacheStats())
+
+    @staticmethod
+    def _is_fresh(namespace: Namespace, entry: _Entry) -> bool:
+        if namespace.beta <= 0:
+            return time.time() < entry.expires_at
+        # XFetch: recompute early with a probability growing as the expiry approaches
+        return time.time() - entry.delta * namespace.beta * math.log(1 - random.random()) < entry.expires_at
+
+    def _decode(self, namespace: Namespace, raw: Optional[str]) -> Optional[_Entry]:
+        if raw is None:
+            return None
+        envelope = json.loads(raw)
+        return _Entry(namespace.codec.decode(envelope["v"]), envelope["d"], envelope["x"])
+
+    def _encode(self, namespace: Namespace, value: Any, delta: float = 0.0) -> Tuple[str, _Entry]:
+        entry = _Entry(value, delta, time.time() + namespace.ttl)
+        raw = json.dumps({"v": namespace.codec.encode(value), "d": round(delta, 6), "x": entry.expires_at},
+                         ensure_ascii=False)
+        return raw, entry
+
+    async def _lookup(self, namespace: Namespace, key: str) -> Tuple[Optional[_Entry], bool]:
+        """
+        :return: The cached entry if any, and whether it came from process memory.
+        """
+        if namespace.local:
+            entry = self.redis_client.local.get(key)
+            if entry is not None and time.time() < entry.expires_at:
+                return entry, True
+        generation = self.redis_client.local.generation
+        entry = self._decode(namespace, await self.redis_client.redis.get(key))
+        if entry is not None and namespace.local:
+            self.redis_client.local.set(key, entry, generation)
+        return entry, False
+
+    async def get(self, namespace: Namespace, *parts: Any) -> Optional[Any]:
+        """
+        Gets a cached value.
+
+        :param namespace: The namespace of the value.
+        :param parts: The parts of the key within the namespace.
+        :return: The value, or None if it isn't cached.
+        """
+        entry, local = await self._lookup(namespace, namespace.key(*parts))
+        stats = self._stats(namespace)
+        if entry is None:
+            stats.misses += 1
+            return None
+        if local:
+            stats.local_hits += 1
+        else:
+            stats.hits += 1
+        return entry.value
+
+    async def get_or_load(self, namespace: Namespace, parts: Sequence[Any],
+                          load: Callable[[], Awaitable[Any]]) -> Optional[Any]:
+        """
+        Gets a cached value, loading and caching it on a miss. None is never cached.
+
+        :param namespace: The namespace of the value.
+        :param parts: The parts of the key within the namespace.
+        :param load: Coroutine function loading the value, e.g. from the database.
+        :return: The value.
+        """
+        key = namespace.key(*parts)
+        stats = self._stats(namespace)
+        entry, local = await self._lookup(namespace, key)
+        if entry is not None:
+            if self._is_fresh(namespace, entry):
+                if local:
+                    stats.local_hits += 1
+                else:
+                    stats.hits += 1
+                return entry.value
+            stats.early_refreshes += 1
+        else:
+            stats.misses += 1
+
+        # Concurrent misses of the same key share a single load
+        return await self.redis_client.flights.run(key, lambda: self._load(namespace, key, load))
+
+    async def _load(self, namespace: Namespace, key: str, load: Callable[[], Awaitable[Any]]) -> Optional[Any]:
+        stats = self._stats(namespace)
+        generation = self.redis_client.local.generation
+        version = await self.redis_client.redis.get(version_key(key)) or ""
+        started_at = time.perf_counter()
+        value = await load()
+        delta = time.perf_counter() - started_at
+        stats.loads += 1
+        stats.load_seconds += delta
+
+        if value is not None:
+            if self._set_if_unchanged_script is None:
+                self._set_if_unchanged_script = self.redis_client.redis.register_script(SET_IF_UNCHANGED)
+            raw, entry = self._encode(namespace, value, delta)
+            stored = await self._set_if_unchanged_script(keys=[key, version_key(key)],
+                                                         args=[version, raw, namespace.ttl])
+            if stored and namespace.local:
+                self.redis_client.local.set(key, entry, generation)
+        return value
+
+    async def get_many(self, namespace: Namespace, keys: Iterable[Hashable]) -> Dict[Hashable, Any]:
+        """
+        Gets many cached values of a namespace with a single round trip.
+
+        :param namespace: The namespace of the values.
+        :param keys: Keys within the namespace, a tuple for keys made of several parts.
+        :return: The cached values by key, missing values are left out.
+        """
+        stats = self._stats(namespace)
+        found, missing = {}, {}
+        for key in keys:
+            redis_key = namespace.key(*(key if isinstance(key, tuple) else (key,)))
+            entry = self.redis_client.local.get(redis_key) if namespace.local else None
+            if entry is not None and time.time() < entry.expires_at:
+                stats.local_hits += 1
+                found[key] = entry.value
+            else:
+                missing[key] = redis_key
+
+        if missing:
+            generation = self.redis_client.local.generation
+            raws = await self.redis_client.redis.mget(list(missing.values()))
+            for (key, redis_key), raw in zip(missing.items(), raws):
+                entry = self._decode(namespace, raw)
+                if entry is None:
+                    stats.misses += 1
+                    continue
+                stats.hits += 1
+                found[key] = entry.value
+                if namespace.local:
+                    self.redis_client.local.set(redis_key, entry, generation)
+        return found
+
+    async def set(self, namespace: Namespace, value: Any, *parts: Any) -> None:
+        """
+        Caches a changed value, every instance drops its copy from process memory.
+
+        :param namespace: The namespace of the value.
+        :param value: The value.
+        :param parts: The parts of the key within the namespace.
+        """
+        await self.set_many(namespace, {parts: value})
+
+    async def set_many(self, namespace: Namespace, values: Dict[Hashable, Any]) -> None:
+        """
+        Caches many changed values of a namespace with a single round trip.
+
+        :param namespace: The namespace of the values.
+        :param values: The values by key, a tuple for keys made of several parts.
+        """
+        if not values:
+            return
+        keys = []
+        async with self.redis_client.redis.pipeline(transaction=False) as pipe:
+            for key, value in values.items():
+                redis_key = namespace.key(*(key if isinstance(key, tuple) else (key,)))
+                raw, _ = self._encode(namespace, value)
+                pipe.set(redis_key, raw, ex=namespace.ttl)
+                pipe.incr(version_key(redis_key))
+                pipe.expire(version_key(redis_key), namespace.ttl)
+                keys.append(redis_key)
+            await pipe.execute()
+        await self.redis_client.invalidate(*keys)
+
+    async def increment(self, namespace: Namespace, field: str, delta: int, *parts: Any) -> None:
+        """
+        Atomically adds `delta` to a field of a cached object, if it is cached.
+        Concurrent increments are never lost, unlike a read-modify-write.
+
+        :param namespace: The namespace of the value.
+        :param field: The field of the encoded object.
+        :param delta: The increment, may be negative.
+        :param parts: The parts of the key within the namespace.
+        """
+        if self._increment_script is None:
+            self._increment_script = self.redis_client.redis.register_script(INCREMENT_FIELD)
+        key = namespace.key(*parts)
+        await self._increment_script(keys=[key, version_key(key)], args=[field, delta, namespace.ttl])
+        await self.redis_client.invalidate(key)
+
+    async def delete(self, namespace: Namespace, *parts: Any) -> None:
+        """
+        Drops a value from Redis and from the process memory of every instance.
+
+        :param namespace: The namespace of the value.
+        :param parts: The parts of the key within the namespace.
+        """
+        await self.delete_many(namespace, [parts])
+
+    async def delete_many(self, namespace: Namespace, keys: Iterable[Hashable]) -> None:
+        """
+        Drops many values of a namespace with a single round trip.
+
+        :param namespace: The namespace of the values.
+        :param keys: Keys within the namespace, a tuple for keys made of several parts.
+        """
+        redis_keys = [namespace.key(*(key if isinstance(key, tuple) else (key,))) for key in keys]
+        if not redis_keys:
+            return
+        async with self.redis_client.redis.pipeline(transaction=False) as pipe:
+            for redis_key in redis_keys:
+                pipe.delete(redis_key)
+                pipe.incr(version_key(redis_key))
+                pipe.expire(version_key(redis_key), namespace.ttl)
+            await pipe.execute()
+        await self.redis_client.invalidate(*redis_keys)
+
+    async def flush_stats(self) -> None:
+        """
+        Adds the counters of this process to the `cache:stats:<namespace>` hashes shared by all instances
+        and resets them, see the `/metrics` endpoint.
+        """
+        stats, self.stats = self.stats, {namespace.name: CacheStats() for namespace in NAMESPACES}
+        async with self.redis_client.redis.pipeline(transaction=False) as pipe:
+            for name, counters in stats.items():
+                for counter in fields(CacheStats):
+                    value = getattr(counters, counter.name)
+                    if not value:
+                        continue
+                    if isinstance(value, float):
+                        pipe.hincrbyfloat(f"cache:stats:{name}", counter.name, value)
+                    else:
+                        pipe.hincrby(f"cache:stats:{name}", counter.name, value)
+            await pipe.execute()
+
+    async def report_stats(self, interval: float = 60) -> None:
+        """
+        Flushes the counters every `interval` seconds.
+
+        :param interval: Seconds between two flushes.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush_stats()
+            except Exception as e:
+                logging.error(f"Error flushing cache stats: {e}")
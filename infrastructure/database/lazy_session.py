@@ -0,0 +1,41 @@
+from typing import Any, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+
+class LazySession:
+    """
+    Stand-in for an `AsyncSession` that is created by the session pool on first use.
+
+    Updates that never touch the database don't build a session at all, and a created session
+    checks out a pooled connection only when it runs its first query.
+
+    :param session_pool: The session factory.
+    """
+
+    def __init__(self, session_pool: async_sessionmaker):
+        self._session_pool = session_pool
+        self._session: Optional[AsyncSession] = None
+
+    @property
+    def created(self) -> bool:
+        return self._session is not None
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for attributes missing on the proxy itself, i.e. the session API
+        if self._session is None:
+            self._session = self._session_pool()
+        return getattr(self._session, name)
+
+    async def close(self) -> None:
+        """
+        Closes the session if it was created, the connection goes back to the pool.
+        """
+        if self._session is not None:
+            await self._session.close()
+
+    async def __aenter__(self) -> "LazySession":
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.close()
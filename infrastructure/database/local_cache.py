@@ -0,0 +1,82 @@
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Hashable
+
+
+class LocalCache:
+    """
+    Bounded in-process cache with per-entry expiry and least recently used eviction.
+
+    Every eviction bumps `generation` and remembers it for the evicted keys. A reader remembers
+    the generation before fetching a value from Redis and stores it only if its key wasn't evicted
+    meanwhile, so a value invalidated while it was being fetched is never cached, while the other
+    keys are cached as usual. Only the last `maxsize` evictions are remembered per key,
+    a read older than a forgotten eviction is dropped for every key.
+
+    :param maxsize: The maximum number of entries.
+    :param ttl: Seconds an entry is served for.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.generation = 0
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        # The generation of the last eviction by key, and the last generation forgotten or cleared
+        self._evicted: OrderedDict[Hashable, int] = OrderedDict()
+        self._evicted_before = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Returns the cached value, or None if it's missing or expired.
+
+        :param key: The key of the entry.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None) -> None:
+        """
+        Caches a value, the least recently used entry is dropped when the cache is full.
+
+        :param key: The key of the entry.
+        :param value: The value.
+        :param generation: The generation seen before the value was fetched, the value is dropped if it's outdated.
+        """
+        if generation is not None and (generation < self._evicted_before or generation < self._evicted.get(key, 0)):
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def evict(self, *keys: Hashable) -> None:
+        """
+        Drops the given entries.
+
+        :param keys: The keys of the entries.
+        """
+        self.generation += 1
+        for key in keys:
+            self._entries.pop(key, None)
+            self._evicted[key] = self.generation
+            self._evicted.move_to_end(key)
+        while len(self._evicted) > self.maxsize:
+            _, generation = self._evicted.popitem(last=False)
+            self._evicted_before = max(self._evicted_before, generation)
+
+    def clear(self) -> None:
+        """
+        Drops all entries.
+        """
+        self.generation += 1
+        self._entries.clear()
+        self._evicted.clear()
+        self._evicted_before = self.generation
@@ -3,3 +3,4 @@ from .users import User
 from .referrals import Referral
 from .tasks import Task
 from .user_tasks import UserTask
+from .leaderboard import LeaderboardArchive
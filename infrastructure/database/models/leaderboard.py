@@ -0,0 +1,27 @@
+from sqlalchemy import String, Integer, BIGINT
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base, TimestampMixin
+
+
+class LeaderboardArchive(Base, TimestampMixin):
+    """
+    This class represents a final standing of a user in a closed leaderboard window.
+
+    Attributes:
+        window (Mapped[str]): The kind of the window, `daily` or `weekly`.
+        period (Mapped[str]): The window itself, e.g. `2024-08-21` or `2024-W34`.
+        user_id (Mapped[int]): The unique identifier of the user.
+        place (Mapped[int]): The final place of the user in the window.
+        score (Mapped[int]): The points earned by the user within the window.
+    """
+    __tablename__ = "leaderboard_archive"
+
+    window: Mapped[str] = mapped_column(String(16), primary_key=True)
+    period: Mapped[str] = mapped_column(String(16), primary_key=True)
+    user_id: Mapped[int] = mapped_column(BIGINT, primary_key=True, autoincrement=False)
+    place: Mapped[int] = mapped_column(Integer)
+    score: Mapped[int] = mapped_column(BIGINT)
+
+    def __repr__(self):
+        return f"<LeaderboardArchive {self.window} {self.period} {self.user_id} {self.place} {self.score}>"
@@ -1,4 +1,4 @@
-from sqlalchemy import Integer, BIGINT
+from sqlalchemy import Integer, BIGINT, Index, text
 from sqlalchemy.orm import Mapped, mapped_column
 
 from .base import Base, TimestampMixin, TableNameMixin
@@ -24,6 +24,12 @@ class Referral(Base, TimestampMixin, TableNameMixin):
         Inherits methods from Base, TimestampMixin, and TableNameMixin classes, which provide additional functionality.
 
     """
+    __table_args__ = (
+        # Referrals are listed and counted by the referrer, the included columns make it an index-only scan
+        Index("ix_referrals_referred_by", "referred_by", postgresql_include=["referral_id", "reward_type"],
+              postgresql_where=text("referred_by IS NOT NULL")),
+    )
+
     referral_id: Mapped[int] = mapped_column(BIGINT, primary_key=True, autoincrement=False)
     referred_by: Mapped[int] = mapped_column(BIGINT, nullable=True)
     reward_type: Mapped[int] = mapped_column(Integer, default=1)
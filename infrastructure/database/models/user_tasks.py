@@ -1,9 +1,13 @@
-from sqlalchemy import ForeignKey, Boolean, BIGINT
+from sqlalchemy import ForeignKey, Boolean, BIGINT, Index
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from .base import Base, TimestampMixin, TableNameMixin
 
 class UserTask(Base, TimestampMixin, TableNameMixin):
     __tablename__ = "user_tasks"
+    __table_args__ = (
+        # Completions of a user are found by the primary key, deleting a task needs its completions by task
+        Index("ix_user_tasks_task_id", "task_id"),
+    )
 
     user_id: Mapped[int] = mapped_column(BIGINT, ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True)
     task_id: Mapped[int] = mapped_column(BIGINT, ForeignKey("tasks.task_id", ondelete="CASCADE"), primary_key=True)
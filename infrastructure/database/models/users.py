@@ -1,5 +1,5 @@
 from typing import List
-from sqlalchemy import String, Integer, text, BIGINT
+from sqlalchemy import String, Integer, text, BIGINT, Boolean, Index
 from sqlalchemy.orm import Mapped, mapped_column
 
 from .base import Base, TimestampMixin, TableNameMixin
@@ -8,9 +8,19 @@ from sqlalchemy.orm import relationship
 from infrastructure.database.models.user_tasks import UserTask  # Ensure this import is correct
 
 class User(Base, TimestampMixin, TableNameMixin):
+    __table_args__ = (
+        # Broadcasts page through reachable users only, dead chats are left out of the index
+        Index("ix_users_deliverable_user_id", "user_id", postgresql_where=text("deliverable")),
+    )
+
     user_id: Mapped[int] = mapped_column(BIGINT, primary_key=True, autoincrement=False)
     balance: Mapped[int] = mapped_column(Integer, default=1000)
     language: Mapped[str] = mapped_column(String(10), server_default=text("'en'"))
+    # False once Telegram reports the chat as blocked, deactivated or not found
+    deliverable: Mapped[bool] = mapped_column(Boolean, default=True, server_default=text("true"))
+    # Users invited by this user and by the users they invited, maintained on every new referral
+    first_referrals: Mapped[int] = mapped_column(Integer, default=0, server_default=text("0"))
+    second_referrals: Mapped[int] = mapped_column(Integer, default=0, server_default=text("0"))
 
     # Define the relationship with UserTask
     tasks: Mapped[List["UserTask"]] = relationship("UserTask", back_populates="user", cascade="all, delete-orphan")
@@ -1,16 +1,76 @@
+import asyncio
+import json
+import logging
+from typing import Optional
+
 import redis.asyncio as aioredis
 
+from infrastructure.database.cache import Cache
+from infrastructure.database.local_cache import LocalCache
+from infrastructure.database.single_flight import SingleFlight
+
+# Pub/sub channel carrying the keys every instance has to drop from its local cache
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+
 class RedisClient:
-    def __init__(self, redis_url: str):
+    """
+    Redis client holding the cache used by the repositories, see `Cache`.
+
+    Cached values are also kept in process memory for `local_cache_ttl` seconds.
+    Writers call `invalidate` after changing such a key, which drops it locally and publishes it
+    to every other instance over pub/sub. Cache misses are loaded through `flights`,
+    so concurrent misses of the same key run a single database query.
+
+    :param redis_url: The Redis URL.
+    :param local_cache_size: The maximum number of keys cached in process memory.
+    :param local_cache_ttl: Seconds a key is served from process memory.
+    """
+
+    def __init__(self, redis_url: str, local_cache_size: int = 10000, local_cache_ttl: float = 60):
         self.redis_url = redis_url
         self.redis = None
+        self.local = LocalCache(local_cache_size, local_cache_ttl)
+        self.flights = SingleFlight()
+        self.cache = Cache(self)
+        self._listener: Optional[asyncio.Task] = None
 
     async def connect(self):
         self.redis = aioredis.from_url(self.redis_url, decode_responses=True)
+        self._listener = asyncio.create_task(self._listen_invalidations())
 
     async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
         await self.redis.close()
 
+    async def _listen_invalidations(self):
+        while True:
+            try:
+                async with self.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(INVALIDATION_CHANNEL)
+                    # Invalidations sent while not subscribed are lost, so nothing cached before can be trusted
+                    self.local.clear()
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self.local.evict(*json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.local.clear()
+                logging.error(f"Cache invalidation listener failed, resubscribing: {e}")
+                await asyncio.sleep(1)
+
+    async def invalidate(self, *keys: str):
+        """
+        Drops keys from the process memory of every instance, call it after changing them in Redis.
+        :param keys: The changed keys.
+        """
+        if not keys:
+            return
+        self.local.evict(*keys)
+        await self.redis.publish(INVALIDATION_CHANNEL, json.dumps(keys))
+
     async def hset_dict(self, key: str, mapping: dict):
         """
         Sets multiple fields in a hash stored at key.
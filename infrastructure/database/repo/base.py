@@ -1,6 +1,34 @@
+from typing import Union, Iterable, AsyncIterable, AsyncIterator, Sequence, List, Any
+
+from sqlalchemy import Table, text
 from sqlalchemy.ext.asyncio import AsyncSession
 
 
+async def iter_batches(items: Union[Iterable[Any], AsyncIterable[Any]], size: int) -> AsyncIterator[List[Any]]:
+    """
+    Groups items of an iterable or async iterable into lists of at most `size` items.
+
+    :param items: The items to group.
+    :param size: The maximum number of items in a batch.
+    :return: An async iterator over the batches.
+    """
+    batch = []
+    if isinstance(items, AsyncIterable):
+        async for item in items:
+            batch.append(item)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+    else:
+        for item in items:
+            batch.append(item)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
 class BaseRepo:
     """
     A class representing a base repository for handling database operations.
@@ -12,3 +40,47 @@ class BaseRepo:
 
     def __init__(self, session):
         self.session: AsyncSession = session
+
+    async def copy_upsert(self, table: Table, columns: Sequence[str], records: Sequence[tuple],
+                          conflict_columns: Sequence[str], update_columns: Sequence[str] = (),
+                          returning: Sequence[str] = ()) -> list:
+        """
+        Bulk upserts records: they are streamed with COPY into a temporary staging table
+        and moved into the table by a single INSERT ... SELECT ... ON CONFLICT.
+
+        Runs in the session's transaction, the caller commits.
+
+        :param table: The target table.
+        :param columns: The columns of the records.
+        :param records: Tuples of values in the order of `columns`.
+        :param conflict_columns: The unique columns identifying a row, duplicates within `records` are dropped.
+        :param update_columns: The columns overwritten in existing rows, existing rows are kept as is if empty.
+        :param returning: The columns of the written rows to return.
+        :return: The written rows if `returning` is given.
+        """
+        staging = f"{table.name}_import"
+        column_list = ", ".join(columns)
+        conflict_list = ", ".join(conflict_columns)
+        if update_columns:
+            on_conflict = "DO UPDATE SET " + ", ".join(f"{column} = EXCLUDED.{column}" for column in update_columns)
+        else:
+            on_conflict = "DO NOTHING"
+
+        # Executed by SQLAlchemy, so the asyncpg transaction is begun before the raw connection is used.
+        # Otherwise the DDL autocommits and the ON COMMIT DROP table is gone before the COPY
+        await self.session.execute(text(
+            f"CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {table.name} INCLUDING DEFAULTS) ON COMMIT DROP"
+        ))
+        connection = await self.session.connection()
+        raw_connection = (await connection.get_raw_connection()).driver_connection
+        await raw_connection.copy_records_to_table(staging, records=records, columns=list(columns))
+        # DISTINCT ON keeps a single row per key, ON CONFLICT can't update the same row twice
+        query = (
+            f"INSERT INTO {table.name} ({column_list}) "
+            f"SELECT DISTINCT ON ({conflict_list}) {column_list} FROM {staging} ORDER BY {conflict_list} "
+            f"ON CONFLICT ({conflict_list}) {on_conflict}"
+        )
+        if returning:
+            return await raw_connection.fetch(f"{query} RETURNING {', '.join(returning)}")
+        await raw_connection.execute(query)
+        return []
@@ -0,0 +1,384 @@
+import json
+import logging
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Optional, List, Sequence, Tuple, Dict, Mapping, Set
+
+from redis.exceptions import ResponseError
+
+from infrastructure.database.redis_client import RedisClient
+
+# Adds the results of a chunk only if this call acknowledged it, so a chunk delivered by two workers
+# after a reclaim is counted once. Returns 1 if it was the last chunk of a completely published job,
+# 0 if it wasn't, nil if the chunk had already been acknowledged
+COMPLETE_CHUNK = """
+if redis.call('XACK', KEYS[3], ARGV[1], ARGV[2]) == 0 then
+    return false
+end
+redis.call('XDEL', KEYS[3], ARGV[2])
+redis.call('HINCRBY', KEYS[1], 'sent', ARGV[3])
+redis.call('HINCRBY', KEYS[1], 'failed', ARGV[4])
+redis.call('HINCRBY', KEYS[1], 'blocked', ARGV[5])
+for i = 6, #ARGV, 2 do
+    redis.call('HINCRBY', KEYS[2], ARGV[i], ARGV[i + 1])
+end
+local done = redis.call('HINCRBY', KEYS[1], 'chunks_done', 1)
+local state = redis.call('HMGET', KEYS[1], 'published', 'chunks_published')
+if state[1] and tonumber(state[2]) == done then
+    return 1
+end
+return 0
+"""
+
+# Resets the idle time of a chunk still owned by the consumer, so it isn't reclaimed while being delivered
+TOUCH_CHUNK = """
+if #redis.call('XPENDING', KEYS[1], ARGV[1], ARGV[2], ARGV[2], 1, ARGV[3]) == 0 then
+    return 0
+end
+redis.call('XCLAIM', KEYS[1], ARGV[1], ARGV[3], 0, ARGV[2], 'JUSTID')
+return 1
+"""
+
+
+@dataclass
+class BroadcastJob:
+    """
+    A broadcast job persisted in Redis.
+
+    Attributes:
+        job_id (int): The unique identifier of the job.
+        payload (dict): The broadcast data collected in the admin FSM.
+        chat_id (int): The admin chat the job reports to.
+        message_id (int): The admin message the job reports to.
+        cursor (int): The last `users.user_id` the job has processed or, when distributed, handed over to workers.
+        sent (int): Count of successfully delivered messages.
+        failed (int): Count of failed deliveries, excluding blocked chats.
+        blocked (int): Count of chats found blocked, deactivated or deleted.
+        total (int): Count of recipients at the start of the job.
+        status (str): One of "running", "finished" or "failed".
+        rate (float): The last measured delivery rate, messages per second.
+        eta (float): The last estimated time to finish, seconds.
+    """
+
+    job_id: int
+    payload: dict
+    chat_id: int
+    message_id: int
+    cursor: int = 0
+    sent: int = 0
+    failed: int = 0
+    blocked: int = 0
+    total: int = 0
+    status: str = "running"
+    rate: float = 0.0
+    eta: float = 0.0
+
+    @property
+    def processed(self) -> int:
+        return self.sent + self.failed + self.blocked
+
+
+@dataclass
+class BroadcastChunk:
+    """
+    A chunk of recipients of a distributed broadcast job, read from the Redis Stream.
+
+    Attributes:
+        entry_id (str): The ID of the stream entry.
+        job_id (int): The ID of the job the chunk belongs to.
+        users (List[Tuple[int, str]]): The (user_id, language) pairs to deliver to.
+    """
+
+    entry_id: str
+    job_id: int
+    users: List[Tuple[int, str]]
+
+
+class BroadcastsRepo:
+    """
+    Stores broadcast jobs in Redis so they can be resumed after a restart.
+
+    Every job lives in the `broadcast:{job_id}` hash, ids of unfinished jobs are kept in the `broadcasts:active` set.
+    Distributed jobs are split into chunks of recipients published to the `broadcast:chunks` stream,
+    which is consumed by the workers of the `mailing_workers` consumer group.
+    """
+
+    ACTIVE_KEY = "broadcasts:active"
+    CHUNKS_STREAM = "broadcast:chunks"
+    CHUNKS_GROUP = "mailing_workers"
+
+    def __init__(self, redis_client: RedisClient):
+        self.redis_client = redis_client
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def _key(job_id: int) -> str:
+        return f"broadcast:{job_id}"
+
+    @staticmethod
+    def _errors_key(job_id: int) -> str:
+        return f"broadcast:{job_id}:errors"
+
+    async def create_job(self, payload: dict, chat_id: int, message_id: int, total: int = 0) -> BroadcastJob:
+        """
+        Creates a new broadcast job and marks it as active.
+
+        :param payload: The broadcast data collected in the admin FSM.
+        :param chat_id: The admin chat the job reports to.
+        :param message_id: The admin message the job reports to.
+        :param total: Count of recipients, used for progress reporting.
+        :return: The created BroadcastJob.
+        """
+        job_id = await self.redis_client.redis.incr("broadcast:last_id")
+        job = BroadcastJob(job_id=job_id, payload=payload, chat_id=chat_id, message_id=message_id, total=total)
+
+        async with self.redis_client.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(job_id), mapping={
+                "job_id": job.job_id,
+                "payload": json.dumps(job.payload),
+                "chat_id": job.chat_id,
+                "message_id": job.message_id,
+                "cursor": job.cursor,
+                "sent": job.sent,
+                "failed": job.failed,
+                "blocked": job.blocked,
+                "total": job.total,
+                "status": job.status,
+            })
+            pipe.sadd(self.ACTIVE_KEY, job_id)
+            await pipe.execute()
+
+        return job
+
+    async def get_job(self, job_id: int) -> Optional[BroadcastJob]:
+        """
+        Retrieves a broadcast job by its ID.
+
+        :param job_id: The ID of the job.
+        :return: The BroadcastJob if found, None otherwise.
+        """
+        data = await self.redis_client.redis.hgetall(self._key(job_id))
+        if not data:
+            return None
+
+        return BroadcastJob(
+            job_id=int(data["job_id"]),
+            payload=json.loads(data["payload"]),
+            chat_id=int(data["chat_id"]),
+            message_id=int(data["message_id"]),
+            cursor=int(data["cursor"]),
+            sent=int(data["sent"]),
+            failed=int(data["failed"]),
+            blocked=int(data.get("blocked", 0)),
+            total=int(data.get("total", 0)),
+            status=data["status"],
+            rate=float(data.get("rate", 0)),
+            eta=float(data.get("eta", 0)),
+        )
+
+    async def get_errors(self, job_id: int) -> Dict[str, int]:
+        """
+        Retrieves the histogram of delivery errors of the job.
+
+        :param job_id: The ID of the job.
+        :return: A dictionary mapping error descriptions to their counts.
+        """
+        errors = await self.redis_client.redis.hgetall(self._errors_key(job_id))
+        return {error: int(count) for error, count in errors.items()}
+
+    async def set_progress(self, job: BroadcastJob, rate: float, eta: float) -> None:
+        """
+        Stores the measured delivery rate and the estimated time to finish of the job.
+
+        :param job: The BroadcastJob, updated in place.
+        :param rate: Messages per second.
+        :param eta: Seconds left.
+        """
+        await self.redis_client.redis.hset(self._key(job.job_id), mapping={"rate": rate, "eta": eta})
+        job.rate, job.eta = rate, eta
+
+    async def get_active_job_ids(self) -> Set[int]:
+        """
+        :return: The IDs of all unfinished broadcast jobs.
+        """
+        return {int(job_id) for job_id in await self.redis_client.redis.smembers(self.ACTIVE_KEY)}
+
+    async def get_active_jobs(self) -> List[BroadcastJob]:
+        """
+        Retrieves all unfinished broadcast jobs.
+
+        :return: A list of BroadcastJob objects.
+        """
+        jobs = []
+        for job_id in await self.redis_client.redis.smembers(self.ACTIVE_KEY):
+            job = await self.get_job(int(job_id))
+            if job is None:
+                self.logger.error(f"Broadcast job {job_id} is active but its data is missing")
+                await self.redis_client.redis.srem(self.ACTIVE_KEY, job_id)
+                continue
+            jobs.append(job)
+        return jobs
+
+    def _add_results(self, pipe, job_id: int, sent: int, failed: int, blocked: int,
+                     errors: Mapping[str, int]) -> None:
+        pipe.hincrby(self._key(job_id), "sent", sent)
+        pipe.hincrby(self._key(job_id), "failed", failed)
+        pipe.hincrby(self._key(job_id), "blocked", blocked)
+        for error, count in errors.items():
+            pipe.hincrby(self._errors_key(job_id), error, count)
+
+    async def checkpoint(self, job: BroadcastJob, cursor: int, sent: int, failed: int, blocked: int = 0,
+                         errors: Mapping[str, int] = MappingProxyType({})) -> None:
+        """
+        Atomically moves the job cursor forward and adds the delivery results of the processed batch.
+
+        :param job: The BroadcastJob to checkpoint, updated in place.
+        :param cursor: The last `users.user_id` processed.
+        :param sent: Count of messages delivered since the last checkpoint.
+        :param failed: Count of failed deliveries since the last checkpoint.
+        :param blocked: Count of dead chats found since the last checkpoint.
+        :param errors: Counts of errors since the last checkpoint by description.
+        """
+        async with self.redis_client.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(job.job_id), "cursor", cursor)
+            self._add_results(pipe, job.job_id, sent, failed, blocked, errors)
+            _, job.sent, job.failed, job.blocked, *_ = await pipe.execute()
+        job.cursor = cursor
+
+    async def publish_chunk(self, job: BroadcastJob, users: Sequence[Tuple[int, str]]) -> None:
+        """
+        Hands a chunk of users over to the workers and moves the job cursor past it in one transaction.
+
+        :param job: The BroadcastJob, updated in place.
+        :param users: The (user_id, language) pairs of the chunk, ordered by ID.
+        """
+        cursor = users[-1][0]
+        async with self.redis_client.redis.pipeline(transaction=True) as pipe:
+            pipe.xadd(self.CHUNKS_STREAM, {"job_id": job.job_id, "users": json.dumps([tuple(user) for user in users])})
+            pipe.hset(self._key(job.job_id), "cursor", cursor)
+            pipe.hincrby(self._key(job.job_id), "chunks_published", 1)
+            await pipe.execute()
+        job.cursor = cursor
+
+    async def create_consumer_group(self) -> None:
+        """
+        Creates the workers' consumer group of the chunks stream if it doesn't exist yet.
+        """
+        try:
+            await self.redis_client.redis.xgroup_create(self.CHUNKS_STREAM, self.CHUNKS_GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def read_chunks(self, consumer: str, count: int = 1, block: int = 5000) -> List[BroadcastChunk]:
+        """
+        Reads new chunks for the consumer, waiting up to `block` milliseconds for them to appear.
+
+        :param consumer: The name of the worker.
+        :param count: The maximum number of chunks to read.
+        :param block: Milliseconds to wait for new chunks.
+        :return: A list of BroadcastChunk objects.
+        """
+        response = await self.redis_client.redis.xreadgroup(
+            self.CHUNKS_GROUP, consumer, {self.CHUNKS_STREAM: ">"}, count=count, block=block
+        )
+        return [self._parse_chunk(*entry) for _, entries in response for entry in entries]
+
+    async def claim_stale_chunks(self, consumer: str, min_idle_time: int, count: int = 1) -> List[BroadcastChunk]:
+        """
+        Takes over chunks read by other workers but not acknowledged for `min_idle_time` milliseconds,
+        e.g. because the worker died while delivering them.
+
+        :param consumer: The name of the worker.
+        :param min_idle_time: Milliseconds a chunk must stay unacknowledged to be reclaimed.
+        :param count: The maximum number of chunks to claim.
+        :return: A list of BroadcastChunk objects.
+        """
+        _, entries, *_ = await self.redis_client.redis.xautoclaim(
+            self.CHUNKS_STREAM, self.CHUNKS_GROUP, consumer, min_idle_time, count=count
+        )
+        return [self._parse_chunk(*entry) for entry in entries if entry and entry[1]]
+
+    @staticmethod
+    def _parse_chunk(entry_id: str, fields: dict) -> BroadcastChunk:
+        return BroadcastChunk(
+            entry_id=entry_id,
+            job_id=int(fields["job_id"]),
+            users=[(int(user_id), language) for user_id, language in json.loads(fields["users"])],
+        )
+
+    async def mark_published(self, job: BroadcastJob) -> bool:
+        """
+        Marks that all chunks of the job have been published.
+
+        :param job: The BroadcastJob.
+        :return: True if all the published chunks have already been delivered.
+        """
+        async with self.redis_client.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(job.job_id), "published", 1)
+            pipe.hmget(self._key(job.job_id), "chunks_published", "chunks_done")
+            _, (published, done) = await pipe.execute()
+        return int(published or 0) == int(done or 0)
+
+    async def complete_chunk(self, chunk: BroadcastChunk, sent: int, failed: int, blocked: int = 0,
+                             errors: Mapping[str, int] = MappingProxyType({})) -> bool:
+        """
+        Acknowledges a chunk and adds its delivery results atomically.
+        Results of a chunk acknowledged before, e.g. by the worker it was reclaimed from, are dropped.
+
+        :param chunk: The delivered BroadcastChunk.
+        :param sent: Count of messages delivered in the chunk.
+        :param failed: Count of failed deliveries in the chunk.
+        :param blocked: Count of dead chats found in the chunk.
+        :param errors: Counts of errors in the chunk by description.
+        :return: True if this was the last chunk of a completely published job.
+        """
+        args = [self.CHUNKS_GROUP, chunk.entry_id, sent, failed, blocked]
+        args += [arg for error, count in errors.items() for arg in (error, count)]
+        last = await self.redis_client.redis.eval(
+            COMPLETE_CHUNK, 3, self._key(chunk.job_id), self._errors_key(chunk.job_id), self.CHUNKS_STREAM, *args
+        )
+        if last is None:
+            self.logger.warning(f"Chunk {chunk.entry_id} of broadcast {chunk.job_id} was already acknowledged")
+        return bool(last)
+
+    async def touch_chunk(self, chunk: BroadcastChunk, consumer: str) -> bool:
+        """
+        Keeps a chunk from being reclaimed by other workers while the consumer delivers it.
+
+        :param chunk: The BroadcastChunk being delivered.
+        :param consumer: The name of the worker.
+        :return: False if the chunk is no longer pending for the consumer.
+        """
+        return bool(await self.redis_client.redis.eval(
+            TOUCH_CHUNK, 1, self.CHUNKS_STREAM, self.CHUNKS_GROUP, chunk.entry_id, consumer
+        ))
+
+    async def skip_chunk(self, chunk: BroadcastChunk) -> None:
+        """
+        Acknowledges a chunk without delivering it, e.g. when its job no longer exists.
+
+        :param chunk: The BroadcastChunk.
+        """
+        async with self.redis_client.redis.pipeline(transaction=True) as pipe:
+            pipe.xack(self.CHUNKS_STREAM, self.CHUNKS_GROUP, chunk.entry_id)
+            pipe.xdel(self.CHUNKS_STREAM, chunk.entry_id)
+            await pipe.execute()
+
+    async def finish_job(self, job: BroadcastJob, ttl: int = 7 * 86400, status: str = "finished") -> bool:
+        """
+        Marks the job as finished. Finished jobs are kept for `ttl` seconds for reporting.
+
+        :param job: The BroadcastJob to finish, updated in place.
+        :param ttl: Seconds to keep the finished job.
+        :param status: The final status, "failed" for a job stopped by an error.
+        :return: True if this call finished the job, False if it was already finished.
+        """
+        async with self.redis_client.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(job.job_id), "status", status)
+            pipe.expire(self._key(job.job_id), ttl)
+            pipe.expire(self._errors_key(job.job_id), ttl)
+            pipe.srem(self.ACTIVE_KEY, job.job_id)
+            *_, removed = await pipe.execute()
+        job.status = status
+        return bool(removed)
@@ -0,0 +1,264 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional, List, Dict, Any
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from infrastructure.database.models import User, LeaderboardArchive
+from infrastructure.database.redis_client import RedisClient
+from infrastructure.database.repo.base import BaseRepo
+
+# Applies ZADD only when the leaderboard is built, so a partial leaderboard is never created
+ZADD_IF_EXISTS = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('ZADD', KEYS[1], unpack(ARGV))
+end
+return false
+"""
+
+
+class LeaderboardRepo(BaseRepo):
+    """
+    Balance leaderboard kept in a Redis sorted set with user IDs as members and balances as scores.
+
+    The sorted set is updated on every balance change and rebuilt from Postgres in bulk when it is missing,
+    so both the top of the leaderboard and any user's place are O(log N) Redis lookups.
+
+    Besides the all-time leaderboard, points credited within a day and a week are counted in sorted sets
+    named after the window (`leaderboard:daily:2024-08-21`, `leaderboard:weekly:2024-W34`). A new window
+    starts with a new key, closed windows are archived to Postgres and expire on their own.
+    """
+
+    KEY = "leaderboard:balance"
+    REBUILD_LOCK_KEY = "leaderboard:balance:rebuild"
+    REBUILD_BATCH_SIZE = 5000
+
+    ALL_TIME = "all"
+    # Window length and how many closed windows are kept in Redis until they are archived
+    WINDOWS = {
+        "daily": (timedelta(days=1), 7),
+        "weekly": (timedelta(weeks=1), 4),
+    }
+    ARCHIVE_BATCH_SIZE = 1000
+
+    def __init__(self, session, redis_client: RedisClient):
+        super().__init__(session)
+        self.redis_client = redis_client
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def _format_top(top_users: List[tuple]) -> List[Dict[str, Any]]:
+        return [
+            {
+                "user_id": int(user_id),
+                "place": idx + 1,
+                "balance": int(balance)
+            }
+            for idx, (user_id, balance) in enumerate(top_users)
+        ]
+
+    @staticmethod
+    def window_period(window: str, at: Optional[datetime] = None) -> str:
+        """
+        Names the window containing the given moment.
+
+        :param window: The kind of the window, `daily` or `weekly`.
+        :param at: The moment, defaults to now. Windows are aligned to UTC.
+        :return: The date for daily windows, the ISO week for weekly ones.
+        """
+        at = at or datetime.now(timezone.utc)
+        if window == "daily":
+            return at.strftime("%Y-%m-%d")
+        year, week, _ = at.isocalendar()
+        return f"{year}-W{week:02d}"
+
+    def window_key(self, window: str, period: Optional[str] = None) -> str:
+        if window == self.ALL_TIME:
+            return self.KEY
+        return f"leaderboard:{window}:{period or self.window_period(window)}"
+
+    async def add_user(self, user_id: int, balance: int) -> None:
+        """
+        Adds a new user to the leaderboard, the score of an existing member is kept.
+
+        :param user_id: The ID of the user.
+        :param balance: The balance of the user.
+        """
+        await self.redis_client.redis.eval(ZADD_IF_EXISTS, 1, self.KEY, "NX", balance, user_id)
+
+    async def set_scores(self, balances: Dict[int, int]) -> None:
+        """
+        Sets the scores of many users at once, e.g. after a bulk import.
+
+        :param balances: The balances by user ID.
+        """
+        if not balances:
+            return
+        args = [arg for user_id, balance in balances.items() for arg in (balance, user_id)]
+        await self.redis_client.redis.eval(ZADD_IF_EXISTS, 1, self.KEY, *args)
+
+    async def increment(self, user_id: int, delta: int) -> None:
+        """
+        Adds `delta` to the user's all-time score and to the scores of the current windows.
+        The increment is commutative, so concurrent balance changes are applied in any order without losing updates.
+
+        :param user_id: The ID of the user.
+        :param delta: The change of the balance.
+        """
+        now = datetime.now(timezone.utc)
+        async with self.redis_client.redis.pipeline(transaction=False) as pipe:
+            pipe.eval(ZADD_IF_EXISTS, 1, self.KEY, "XX", "INCR", delta, user_id)
+            for window, (length, keep) in self.WINDOWS.items():
+                key = self.window_key(window, self.window_period(window, now))
+                pipe.zincrby(key, delta, user_id)
+                # Outlives the window long enough to be archived, then expires on its own
+                pipe.expire(key, length * (keep + 1))
+            await pipe.execute()
+
+    async def rebuild(self) -> int:
+        """
+        Rebuilds the leaderboard from the users table.
+
+        Users are streamed in batches into a temporary key which then atomically replaces the leaderboard,
+        so readers never see a half-built leaderboard. Balance changes made during the rebuild
+        may be missed by it, the rebuild is meant to be run rarely.
+
+        :return: The number of users in the leaderboard.
+        """
+        temp_key = f"{self.KEY}:building"
+        after_user_id = count = 0
+
+        await self.redis_client.redis.delete(temp_key)
+        while True:
+            query = (
+                select(User.user_id, User.balance)
+                .where(User.user_id > after_user_id)
+                .order_by(User.user_id)
+                .limit(self.REBUILD_BATCH_SIZE)
+            )
+            batch = (await self.session.execute(query)).all()
+            if not batch:
+                break
+            await self.redis_client.redis.zadd(temp_key, {row.user_id: row.balance for row in batch})
+            after_user_id = batch[-1].user_id
+            count += len(batch)
+
+        if count:
+            await self.redis_client.redis.rename(temp_key, self.KEY)
+        self.logger.info(f"Leaderboard rebuilt with {count} users")
+        return count
+
+    async def ensure_built(self) -> None:
+        """
+        Rebuilds the leaderboard if it doesn't exist. Concurrent callers don't rebuild it twice.
+        """
+        if await self.redis_client.redis.exists(self.KEY):
+            return
+        if not await self.redis_client.redis.set(self.REBUILD_LOCK_KEY, 1, nx=True, ex=300):
+            return
+        try:
+            await self.rebuild()
+        finally:
+            await self.redis_client.redis.delete(self.REBUILD_LOCK_KEY)
+
+    async def get_top(self, limit: int = 5, window: str = ALL_TIME) -> List[Dict[str, Any]]:
+        """
+        Selects the users with the highest scores.
+
+        :param limit: The number of users.
+        :param window: `all` for balances, `daily` or `weekly` for points earned in the current window.
+        :return: A list of dicts with the user ID, place and balance.
+        """
+        top_users = await self.redis_client.redis.zrevrange(self.window_key(window), 0, limit - 1, withscores=True)
+        return self._format_top(top_users)
+
+    async def get_place(self, user_id: int, window: str = ALL_TIME) -> Optional[int]:
+        """
+        Selects the place of the user in the leaderboard.
+
+        :param user_id: The ID of the user.
+        :param window: `all` for balances, `daily` or `weekly` for points earned in the current window.
+        :return: The 1-based place, or None if the user isn't in the leaderboard.
+        """
+        rank = await self.redis_client.redis.zrevrank(self.window_key(window), user_id)
+        return rank + 1 if rank is not None else None
+
+    async def select_leaderboard(self, user_id: int, limit: int = 5, window: str = ALL_TIME) -> dict:
+        """
+        Selects the top of the leaderboard and the place of the user.
+
+        :param user_id: The ID of the user.
+        :param limit: The number of users in the top.
+        :param window: `all` for balances, `daily` or `weekly` for points earned in the current window.
+        :return: A dict with the `leaderboard` list and the user's `place`.
+        """
+        try:
+            if window == self.ALL_TIME:
+                await self.ensure_built()
+            key = self.window_key(window)
+            async with self.redis_client.redis.pipeline(transaction=False) as pipe:
+                pipe.zrevrange(key, 0, limit - 1, withscores=True)
+                pipe.zrevrank(key, user_id)
+                top_users, rank = await pipe.execute()
+
+            return {
+                "leaderboard": self._format_top(top_users),
+                "place": rank + 1 if rank is not None else None
+            }
+        except Exception as e:
+            self.logger.error(f"Error selecting leaderboard for user {user_id}: {e}")
+            return {"leaderboard": [], "place": None}
+
+    async def archive_window(self, window: str, period: str) -> int:
+        """
+        Copies the final standings of a closed window to Postgres.
+
+        The sorted set is read page by page, so no matter how many users took part only one page is kept in memory.
+        Archiving the same window again is a no-op.
+
+        :param window: The kind of the window, `daily` or `weekly`.
+        :param period: The closed window, see `window_period`.
+        :return: The number of archived users.
+        """
+        key = self.window_key(window, period)
+        archived_key = f"{key}:archived"
+        if await self.redis_client.redis.exists(archived_key):
+            return 0
+
+        start = 0
+        while standings := await self.redis_client.redis.zrevrange(
+                key, start, start + self.ARCHIVE_BATCH_SIZE - 1, withscores=True):
+            insert_stmt = (
+                insert(LeaderboardArchive)
+                .values([
+                    dict(window=window, period=period, user_id=int(user_id), place=start + idx + 1, score=int(score))
+                    for idx, (user_id, score) in enumerate(standings)
+                ])
+                .on_conflict_do_nothing()
+            )
+            await self.session.execute(insert_stmt)
+            start += len(standings)
+        await self.session.commit()
+
+        # The marker lives as long as the window itself
+        length, keep = self.WINDOWS[window]
+        await self.redis_client.redis.set(archived_key, start, ex=length * (keep + 1))
+        self.logger.info(f"Archived {window} leaderboard {period} with {start} users")
+        return start
+
+    async def archive_closed_windows(self, now: Optional[datetime] = None) -> None:
+        """
+        Archives every closed window still kept in Redis and not archived yet.
+
+        :param now: The current moment, defaults to now.
+        """
+        now = now or datetime.now(timezone.utc)
+        for window, (length, keep) in self.WINDOWS.items():
+            for age in range(1, keep + 1):
+                period = self.window_period(window, now - length * age)
+                try:
+                    await self.archive_window(window, period)
+                except Exception as e:
+                    await self.session.rollback()
+                    self.logger.error(f"Error archiving {window} leaderboard {period}: {e}")
@@ -1,154 +1,247 @@
 import logging
-from typing import Optional, Dict, Any, Sequence
+from typing import Optional, Dict, Any, Sequence, List, AsyncIterator, Union, Iterable, AsyncIterable
 
-from sqlalchemy import select, func, Row, RowMapping
+from sqlalchemy import select, func, update, literal_column, bindparam, Integer, Row, Select
+from sqlalchemy.orm import aliased
 
+from infrastructure.database import cache
 from infrastructure.database.models import Referral, User
 from infrastructure.database.redis_client import RedisClient
-from infrastructure.database.repo.base import BaseRepo
+from infrastructure.database.repo.base import BaseRepo, iter_batches
+from infrastructure.database.views import ReferralView
+
+SELECT_REFERRAL = (
+    select(Referral.referral_id, Referral.referred_by, Referral.reward_type, User.language)
+    .outerjoin(User, Referral.referral_id == User.user_id)
+    .where(Referral.referral_id == bindparam("user_id"))
+)
+SELECT_REFERRAL_COUNTS = (
+    select(User.first_referrals, User.second_referrals)
+    .where(User.user_id == bindparam("user_id"))
+)
+SELECT_REFERRALS_BY_USER = (
+    select(Referral.referral_id, Referral.reward_type)
+    .where(Referral.referred_by == bindparam("referred_by"))
+)
+
+
+def _referral_chain_query() -> Select:
+    # Walks up from the user one referrer at a time, a referral loop stops at the depth
+    upline = (
+        select(Referral.referred_by.label("user_id"), literal_column("1").label("level"))
+        .where(Referral.referral_id == bindparam("user_id"), Referral.referred_by.is_not(None))
+        .cte("upline", recursive=True)
+    )
+    parent = aliased(Referral)
+    upline = upline.union_all(
+        select(parent.referred_by, upline.c.level + 1)
+        .join(upline, parent.referral_id == upline.c.user_id)
+        .where(parent.referred_by.is_not(None), upline.c.level < bindparam("depth", type_=Integer))
+    )
+    return (
+        select(Referral.referral_id, Referral.referred_by, Referral.reward_type, User.language)
+        .join(upline, Referral.referral_id == upline.c.user_id)
+        .outerjoin(User, Referral.referral_id == User.user_id)
+        .order_by(upline.c.level)
+    )
+
+
+SELECT_REFERRAL_CHAIN = _referral_chain_query()
 
 
 class ReferralsRepo(BaseRepo):
     def __init__(self, session, redis_client: RedisClient):
         super().__init__(session)
         self.redis_client = redis_client
+        self.cache = redis_client.cache
         self.logger = logging.getLogger(__name__)
 
-    async def get_referrals_by_user(self, referred_by: int) -> Sequence[Row[Any] | RowMapping | Any]:
+    async def get_referrals_by_user(self, referred_by: int) -> List[ReferralView]:
         try:
-            cache_key = f"referrals_by_user:{referred_by}"
-            cached_referrals = await self.redis_client.redis.hgetall(cache_key)
-
-            if cached_referrals:
-                return [Referral(referral_id=int(cached_referrals[f"referral_id:{i}"]),
-                                 referred_by=referred_by,
-                                 reward_type=int(cached_referrals[f"reward_type:{i}"]))
-                        for i in range(len(cached_referrals) // 3)]
-
-            query = select(Referral).where(Referral.referred_by == referred_by)
-            result = await self.session.execute(query)
-            referrals = result.scalars().all()
-
-            if referrals:
-                referral_data = {}
-                for i, referral in enumerate(referrals):
-                    referral_data[f"referral_id:{i}"] = referral.referral_id
-                    referral_data[f"reward_type:{i}"] = referral.reward_type
-
-                await self.redis_client.redis.hset(cache_key, mapping=referral_data)
-                await self.redis_client.redis.expire(cache_key, 86400)
-
-            return referrals
+            return await self.cache.get_or_load(cache.REFERRALS_BY_USER, (referred_by,),
+                                                lambda: self._load_referrals_by_user(referred_by))
         except Exception as e:
             self.logger.error(f"Error retrieving referrals for user {referred_by}: {e}")
             return []
 
+    async def _load_referrals_by_user(self, referred_by: int) -> List[ReferralView]:
+        result = await self.session.execute(SELECT_REFERRALS_BY_USER, {"referred_by": referred_by})
+        return [ReferralView(referral_id=row.referral_id, referred_by=referred_by, reward_type=row.reward_type)
+                for row in result.all()]
+
     async def count_referrals_by_user(self, referred_by: int) -> Dict[str, int]:
+        """
+        Reads the referral counters of the user, maintained by `UserRepo.create_user`.
+
+        :param referred_by: The ID of the user.
+        :return: A dict with the `first_referrals` and `second_referrals` counts.
+        """
         try:
-            cache_key = f"referral_breakdown:{referred_by}"
-            cached_counts = await self.redis_client.redis.hgetall(cache_key)
+            counts = await self.cache.get_or_load(cache.REFERRAL_COUNTS, (referred_by,),
+                                                  lambda: self._load_referral_counts(referred_by))
+            if counts is not None:
+                return counts
+        except Exception as e:
+            self.logger.error(f"Error counting referrals for user {referred_by}: {e}")
+        return {
+            "first_referrals": 0,
+            "second_referrals": 0
+        }
+
+    async def _load_referral_counts(self, referred_by: int) -> Optional[Dict[str, int]]:
+        row = (await self.session.execute(SELECT_REFERRAL_COUNTS, {"user_id": referred_by})).one_or_none()
+        if row is None:
+            return None
+        return {
+            "first_referrals": row.first_referrals,
+            "second_referrals": row.second_referrals
+        }
 
-            if cached_counts:
-                return {
-                    "first_referrals": int(cached_counts.get("first_referrals", 0)),
-                    "second_referrals": int(cached_counts.get("second_referrals", 0))
-                }
+    async def recount_referrals(self) -> None:
+        """
+        Recomputes the referral counters of every user from the referrals table, e.g. after a bulk import.
+        """
+        try:
+            first_counts = (
+                select(Referral.referred_by, func.count().label("referrals"))
+                .where(Referral.referred_by.is_not(None))
+                .group_by(Referral.referred_by)
+                .subquery()
+            )
+            parent = aliased(Referral)
+            second_counts = (
+                select(parent.referred_by, func.count().label("referrals"))
+                .select_from(Referral)
+                .join(parent, parent.referral_id == Referral.referred_by)
+                .where(parent.referred_by.is_not(None))
+                .group_by(parent.referred_by)
+                .subquery()
+            )
+            # Users who lost all their referrals are reset as well
+            await self.session.execute(
+                update(User)
+                .where((User.first_referrals != 0) | (User.second_referrals != 0))
+                .values(first_referrals=0, second_referrals=0)
+            )
+            await self.session.execute(
+                update(User)
+                .where(User.user_id == first_counts.c.referred_by)
+                .values(first_referrals=first_counts.c.referrals)
+            )
+            await self.session.execute(
+                update(User)
+                .where(User.user_id == second_counts.c.referred_by)
+                .values(second_referrals=second_counts.c.referrals)
+            )
+            await self.session.commit()
+        except Exception as e:
+            await self.session.rollback()
+            self.logger.error(f"Error recounting referrals: {e}")
+
+    async def get_referral(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Retrieves a referral by the referred user's ID along with the referrer's language.
+
+        :param user_id: The ID of the referred user.
+        :return: A dictionary containing the referral view and the referrer's language, or None if not found.
+        """
+        try:
+            return await self.cache.get_or_load(cache.REFERRALS, (user_id,), lambda: self._load_referral(user_id))
+        except Exception as e:
+            self.logger.error(f"Error retrieving referral for user {user_id}: {e}")
+            return None
 
-            first_referrals_count = await self._count_direct_referrals(referred_by)
+    async def _load_referral(self, user_id: int) -> Optional[Dict[str, Any]]:
+        result = await self.session.execute(SELECT_REFERRAL, {"user_id": user_id})
+        row = result.first()
 
-            first_referrals_ids = await self._get_direct_referrals_ids(referred_by)
+        if row is None:
+            return None
 
-            if not first_referrals_ids:
-                second_referrals_count = 0
-            else:
-                second_referrals_count = await self._count_second_referrals(first_referrals_ids)
+        return {
+            "referral": ReferralView(referral_id=row.referral_id, referred_by=row.referred_by,
+                                     reward_type=row.reward_type),
+            "language": row.language or "en"  # Default to 'en' if language is None
+        }
 
-            await self.redis_client.redis.hset(cache_key, mapping={
-                "first_referrals": first_referrals_count,
-                "second_referrals": second_referrals_count
-            })
-            await self.redis_client.redis.expire(cache_key, 86400)
+    async def get_referral_chain(self, user_id: int, depth: int = 2) -> List[Dict[str, Any]]:
+        """
+        Retrieves the upline of the user, the referrer first, with a single recursive query.
 
-            return {
-                "first_referrals": first_referrals_count,
-                "second_referrals": second_referrals_count
-            }
+        :param user_id: The ID of the user.
+        :param depth: The maximum number of levels, a referral loop never goes past it.
+        :return: A list of dicts containing the referral view and the language of every referrer, nearest first.
+        """
+        try:
+            return await self.load_referral_chain(user_id, depth)
         except Exception as e:
-            self.logger.error(f"Error counting referrals for user {referred_by}: {e}")
-            return {
-                "first_referrals": 0,
-                "second_referrals": 0
+            self.logger.error(f"Error retrieving referral chain for user {user_id}: {e}")
+            return []
+
+    async def load_referral_chain(self, user_id: int, depth: int = 2) -> List[Dict[str, Any]]:
+        """
+        Same as `get_referral_chain`, but errors are raised, e.g. to roll back the surrounding transaction.
+        """
+        result = await self.session.execute(SELECT_REFERRAL_CHAIN, {"user_id": user_id, "depth": depth})
+        return [
+            {
+                "referral": ReferralView(referral_id=row.referral_id, referred_by=row.referred_by,
+                                         reward_type=row.reward_type),
+                "language": row.language or "en"
             }
+            for row in result.all()
+        ]
 
-    async def _count_direct_referrals(self, referred_by: int) -> int:
-        query = select(func.count()).where(Referral.referred_by == referred_by)
-        result = await self.session.execute(query)
-        return result.scalar()
+    async def iter_referral_batches(self, batch_size: int = 1000,
+                                    after_referral_id: int = 0) -> AsyncIterator[Sequence[Row[Any]]]:
+        """
+        Streams referrals in batches ordered by the referred user's ID, using keyset pagination.
 
-    async def _get_direct_referrals_ids(self, referred_by: int) -> Sequence[int]:
-        query = select(Referral.referral_id).where(Referral.referred_by == referred_by)
-        result = await self.session.execute(query)
-        return result.scalars().all()
+        :param batch_size: The number of referrals fetched per query.
+        :param after_referral_id: Only referrals of users with a greater ID are returned.
+        :return: An async iterator over lists of rows.
+        """
+        while True:
+            query = (
+                select(Referral.referral_id, Referral.referred_by, Referral.reward_type, Referral.created_at)
+                .where(Referral.referral_id > after_referral_id)
+                .order_by(Referral.referral_id)
+                .limit(batch_size)
+            )
+            batch = (await self.session.execute(query)).all()
+            if not batch:
+                return
 
-    async def _count_second_referrals(self, first_referrals_ids: Sequence[int]) -> int:
-        query = select(func.count()).where(Referral.referred_by.in_(first_referrals_ids))
-        result = await self.session.execute(query)
-        return result.scalar()
+            yield batch
+            after_referral_id = batch[-1].referral_id
 
-    async def get_referral(self, user_id: int) -> Optional[Dict[str, Any]]:
+    async def batch_create_referrals(self, referrals: Union[Iterable[dict], AsyncIterable[dict]],
+                                     batch_size: int = 10000) -> int:
         """
-        Retrieves a referral by the referred user's ID along with the referrer's language.
+        Bulk imports referrals with `copy_upsert`, existing referrals are kept as is.
 
-        :param user_id: The ID of the referred user.
-        :return: A dictionary containing the Referral object and the referrer's language, or None if not found.
+        :param referrals: Iterable or async iterable of dicts with `referral_id`, `referred_by` and `reward_type`.
+        :param batch_size: The number of referrals copied and committed at once.
+        :return: The number of imported referrals.
+        :raises Exception: If a batch fails to import.
         """
+        count = 0
         try:
-            cache_key = f"referral:{user_id}"
-            cached_referral = await self.redis_client.redis.hgetall(cache_key)
-
-            # Check if we have valid cached data
-            if cached_referral and all(cached_referral.get(key) not in (None, 'None', '') for key in ["referral_id", "referred_by", "reward_type", "language"]):
-                return {
-                    "referral": Referral(
-                        referral_id=int(cached_referral["referral_id"]),
-                        referred_by=int(cached_referral["referred_by"]) if cached_referral["referred_by"] else None,
-                        reward_type=int(cached_referral["reward_type"])
-                    ),
-                    "language": cached_referral["language"] or "en"  # Default to 'en' if language is None or empty
-                }
-
-            # If not cached, query the database
-            stmt = (
-                select(Referral, User.language)
-                .outerjoin(User, Referral.referral_id == User.user_id)
-                .where(Referral.referral_id == user_id)
-            )
-            compiled_stmt = stmt.compile(compile_kwargs={"literal_binds": True})
-            print(str(compiled_stmt))
-            result = await self.session.execute(stmt)
-            row = result.first()
-
-            if row:
-                print(row)
-                referral, language = row
-                referral_dict = {
-                    "referral": referral,
-                    "language": language or "en"  # Default to 'en' if language is None
-                }
-
-                # Cache the referral and language data
-                await self.redis_client.redis.hset(cache_key, mapping={
-                    "referral_id": str(referral.referral_id),
-                    "referred_by": str(referral.referred_by) if referral.referred_by is not None else '',
-                    "reward_type": str(referral.reward_type) if referral.reward_type is not None else '',
-                    "language": language or 'en'
-                })
-                await self.redis_client.redis.expire(cache_key, 86400)  # Set expiry to 24 hours
-
-                return referral_dict
-
-            return None
-
+            async for batch in iter_batches(referrals, batch_size):
+                records = [
+                    (int(referral["referral_id"]),
+                     int(referral["referred_by"]) if referral.get("referred_by") is not None else None,
+                     int(referral.get("reward_type") or 1))
+                    for referral in batch
+                ]
+                rows = await self.copy_upsert(
+                    Referral.__table__, ("referral_id", "referred_by", "reward_type"), records,
+                    conflict_columns=("referral_id",), returning=("referral_id",),
+                )
+                await self.session.commit()
+                count += len(rows)
         except Exception as e:
-            self.logger.error(f"Error retrieving referral for user {user_id}: {e}")
-            return None
+            await self.session.rollback()
+            self.logger.error(f"Error batch creating referrals after {count} referrals: {e}")
+            raise
+        return count
@@ -1,8 +1,11 @@
 from dataclasses import dataclass
+from functools import cached_property
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from infrastructure.database.redis_client import RedisClient
+from infrastructure.database.repo.broadcasts import BroadcastsRepo
+from infrastructure.database.repo.leaderboard import LeaderboardRepo
 from infrastructure.database.repo.referrals import ReferralsRepo
 from infrastructure.database.repo.tasks import TasksRepo
 from infrastructure.database.repo.user_tasks import UserTaskRepo
@@ -15,29 +18,38 @@ class RequestsRepo:
     Repository for handling database operations. This class holds all the repositories for the database models.
 
     You can add more repositories as properties to this class, so they will be easily accessible.
+    Every repository is created on first access and reused afterwards.
     """
 
     session: AsyncSession
     redis: RedisClient
 
-    @property
+    @cached_property
     def users(self) -> UserRepo:
         """
         The User repository sessions are required to manage user operations.
         """
         return UserRepo(self.session, self.redis)
 
-    @property
+    @cached_property
     def referrals(self) -> ReferralsRepo:
         """
         The User repository sessions are required to manage user operations.
         """
         return ReferralsRepo(self.session, self.redis)
 
-    @property
+    @cached_property
     def tasks(self) -> TasksRepo:
         return TasksRepo(self.session, self.redis)
 
-    @property
+    @cached_property
     def user_tasks(self) -> UserTaskRepo:
         return UserTaskRepo(self.session)
+
+    @cached_property
+    def broadcasts(self) -> BroadcastsRepo:
+        return BroadcastsRepo(self.redis)
+
+    @cached_property
+    def leaderboard(self) -> LeaderboardRepo:
+        return LeaderboardRepo(self.session, self.redis)
@@ -1,19 +1,24 @@
 import json
 import logging
-from typing import Dict, Optional, Any, Sequence
+from typing import Dict, Optional
 
-from sqlalchemy import select, update, delete
+from sqlalchemy import select, update, delete, bindparam
 from sqlalchemy.exc import SQLAlchemyError
 
+from infrastructure.database import cache
 from infrastructure.database.models import Task
 from infrastructure.database.redis_client import RedisClient
 from infrastructure.database.repo.base import BaseRepo
+from infrastructure.database.views import TaskView
+
+SELECT_TASK = select(Task).where(Task.task_id == bindparam("task_id"))
 
 
 class TasksRepo(BaseRepo):
     def __init__(self, session, redis_client: RedisClient):
         super().__init__(session)
         self.redis_client = redis_client
+        self.cache = redis_client.cache
         self.logger = logging.getLogger(__name__)
 
     async def create_task(self, task_data: Dict) -> Optional[Task]:
@@ -29,10 +34,10 @@ class TasksRepo(BaseRepo):
             await self.session.commit()
 
             # Cache the new task in Redis
-            await self._cache_task(new_task)
+            await self.cache.set(cache.TASKS, self._serialize_task(new_task), new_task.task_id)
 
             # Invalidate the tasks list cache
-            await self.redis_client.redis.delete("tasks:all")
+            await self.cache.delete(cache.TASK_LISTS, "all")
 
             return new_task
         except SQLAlchemyError as e:
@@ -40,32 +45,31 @@ class TasksRepo(BaseRepo):
             self.logger.error(f"Error creating task: {e}")
             return None
 
-    async def get_task_by_id(self, task_id: int, language: str = "en") -> Optional[Task]:
+    async def get_task_by_id(self, task_id: int, language: str = "en") -> Optional[TaskView]:
         """
         Retrieves a task by its ID and returns the title in the specified language.
 
         :param task_id: The ID of the task to retrieve.
         :param language: The preferred language for task titles.
-        :return: The Task object if found, None otherwise.
+        :return: The task view if found, None otherwise.
         """
         try:
-            # Check Redis cache first
-            cached_task = await self.redis_client.redis.hgetall(f"task:{task_id}")
-            if cached_task:
-                return self._deserialize_task(cached_task, language)
-
-            query = select(Task).where(Task.task_id == task_id)
-            result = await self.session.execute(query)
-            task = result.scalar_one_or_none()
-
-            if task:
-                await self._cache_task(task)
-
-            return task
+            # The cached task holds every language, each caller picks its own
+            task_data = await self.cache.get_or_load(cache.TASKS, (task_id,), lambda: self._load_task(task_id))
+            return self._deserialize_task(task_data, language) if task_data else None
         except SQLAlchemyError as e:
             self.logger.error(f"Error retrieving task {task_id}: {e}")
             return None
 
+    async def _load_task(self, task_id: int) -> Optional[Dict]:
+        result = await self.session.execute(SELECT_TASK, {"task_id": task_id})
+        task = result.scalar_one_or_none()
+
+        if task is None:
+            return None
+
+        return self._serialize_task(task)
+
     async def update_task(self, task_id: int, task_data: Dict) -> Optional[Task]:
         """
         Updates an existing task in the database.
@@ -83,10 +87,10 @@ class TasksRepo(BaseRepo):
                 await self.session.commit()
 
                 # Update the cache in Redis
-                await self._cache_task(updated_task)
+                await self.cache.set(cache.TASKS, self._serialize_task(updated_task), task_id)
 
                 # Invalidate the tasks list cache
-                await self.redis_client.redis.delete("tasks:all")
+                await self.cache.delete(cache.TASK_LISTS, "all")
 
             return updated_task
         except SQLAlchemyError as e:
@@ -107,10 +111,10 @@ class TasksRepo(BaseRepo):
             await self.session.commit()
 
             # Remove the task from Redis cache
-            await self.redis_client.redis.delete(f"task:{task_id}")
+            await self.cache.delete(cache.TASKS, task_id)
 
             # Invalidate the tasks list cache
-            await self.redis_client.redis.delete("tasks:all")
+            await self.cache.delete(cache.TASK_LISTS, "all")
 
             return True
         except SQLAlchemyError as e:
@@ -118,39 +122,24 @@ class TasksRepo(BaseRepo):
             self.logger.error(f"Error deleting task {task_id}: {e}")
             return False
 
-    async def list_tasks(self) -> list[Task] | Sequence[Task] | list[Any]:
+    async def list_tasks(self, language: str = "en") -> list[TaskView]:
         """
         Retrieves a list of all tasks.
 
-        :return: A list of Task objects.
+        :param language: The preferred language for task titles.
+        :return: A list of task views.
         """
         try:
-            # Check if the task list is cached
-            cache_key = "tasks:all"
-            cached_tasks = await self.redis_client.redis.get(cache_key)
-            if cached_tasks:
-                return [self._deserialize_task(task_data) for task_data in json.loads(cached_tasks)]
-
-            query = select(Task)
-            result = await self.session.execute(query)
-            tasks = result.scalars().all()
-
-            # Cache the tasks list in Redis
-            await self.redis_client.redis.setex(cache_key, 86400, json.dumps([self._serialize_task(task) for task in tasks]))
-
-            return tasks
+            tasks_data = await self.cache.get_or_load(cache.TASK_LISTS, ("all",), self._load_tasks)
+            return [self._deserialize_task(task_data, language) for task_data in tasks_data]
         except SQLAlchemyError as e:
             self.logger.error(f"Error listing tasks: {e}")
             return []
 
-    async def _cache_task(self, task: Task):
-        """
-        Caches a task in Redis.
-
-        :param task: The Task object to cache.
-        """
-        await self.redis_client.redis.hset(f"task:{task.task_id}", mapping=self._serialize_task(task))
-        await self.redis_client.redis.expire(f"task:{task.task_id}", 86400)
+    async def _load_tasks(self) -> list[Dict]:
+        query = select(Task)
+        result = await self.session.execute(query)
+        return [self._serialize_task(task) for task in result.scalars().all()]
 
     @staticmethod
     def _serialize_task(task: Task) -> Dict:
@@ -162,34 +151,39 @@ class TasksRepo(BaseRepo):
         """
         return {
             "task_id": task.task_id,
-            "titles": json.dumps(task.titles),  # Store titles as a JSON string
+            "titles": task.titles,
             "source": task.source,
             "link": task.link,
-            "cover": task.cover or '',  # Use .get() to safely handle missing keys
-            "descriptions": json.dumps(task.descriptions) if task.descriptions else None,
+            "cover": task.cover,
+            "descriptions": task.descriptions,
             "balance": task.balance
         }
 
     @staticmethod
-    def _deserialize_task(task_data: Dict, language: str = "en") -> Task:
+    def _deserialize_task(task_data: Dict, language: str = "en") -> TaskView:
         """
-        Deserializes a task dictionary to a Task object.
+        Deserializes a task dictionary to a task view in a single language.
 
         :param task_data: The task data dictionary.
         :param language: The preferred language for task titles.
-        :return: The deserialized Task object.
-        """
-        titles = json.loads(task_data["titles"])
-        descriptions = json.loads(task_data.get("descriptions")) if task_data.get("descriptions") else None
+        :return: The task view.
+        """
+        titles = task_data["titles"]
+        descriptions = task_data.get("descriptions")
+        # Older rows may hold the translations as JSON strings
+        if isinstance(titles, str):
+            titles = json.loads(titles)
+        if isinstance(descriptions, str):
+            descriptions = json.loads(descriptions)
         title = titles.get(language) or titles.get("en", "No title available")
         description = descriptions.get(language) if descriptions else None
 
-        return Task(
+        return TaskView(
             task_id=int(task_data["task_id"]),
-            titles=title,
+            title=title,
+            description=description,
             source=task_data["source"],
             link=task_data["link"],
-            cover=task_data.get("cover"),  # Use .get() to safely access the cover
-            descriptions=description,
-            balance=task_data["balance"]
+            cover=task_data.get("cover") or None,
+            balance=int(task_data["balance"])
         )
@@ -1,12 +1,19 @@
 import logging
 import json
-from typing import List, Tuple
+from typing import List, Tuple, Sequence, Any, AsyncIterator, Union, Iterable, AsyncIterable
 
-from sqlalchemy import select, insert
+from sqlalchemy import select, insert, tuple_, bindparam, Row
 from sqlalchemy.exc import SQLAlchemyError
 
 from infrastructure.database.models import UserTask, Task
-from infrastructure.database.repo.base import BaseRepo
+from infrastructure.database.repo.base import BaseRepo, iter_batches
+
+SELECT_COMPLETION = (
+    select(UserTask.task_id)
+    .where(UserTask.user_id == bindparam("user_id"), UserTask.task_id == bindparam("task_id"))
+    .limit(1)
+)
+SELECT_COMPLETED_TASK_IDS = select(UserTask.task_id).where(UserTask.user_id == bindparam("user_id"))
 
 
 class UserTaskRepo(BaseRepo):
@@ -29,8 +36,7 @@ class UserTaskRepo(BaseRepo):
             all_tasks = {row[0]: row[1] for row in result_all_tasks.all()}
 
             # Retrieve completed task IDs for the user
-            query_completed_tasks = select(UserTask.task_id).where(UserTask.user_id == user_id)
-            result_completed_tasks = await self.session.execute(query_completed_tasks)
+            result_completed_tasks = await self.session.execute(SELECT_COMPLETED_TASK_IDS, {"user_id": user_id})
             completed_task_ids = {row[0] for row in result_completed_tasks.all()}
 
             # Determine the incomplete tasks by checking against all tasks
@@ -89,10 +95,61 @@ class UserTaskRepo(BaseRepo):
         :return: True if the task is completed, False otherwise.
         """
         try:
-            query = select(UserTask).where(UserTask.user_id == user_id, UserTask.task_id == task_id)
-            result = await self.session.execute(query)
+            result = await self.session.execute(SELECT_COMPLETION, {"user_id": user_id, "task_id": task_id})
             return result.scalar_one_or_none() is not None
         except SQLAlchemyError as e:
             self.logger.error(f"Error checking task completion for user {user_id} and task {task_id}: {e}")
             return False
 
+
+    async def iter_user_task_batches(self, batch_size: int = 1000) -> AsyncIterator[Sequence[Row[Any]]]:
+        """
+        Streams task completions in batches ordered by user and task, using keyset pagination.
+
+        :param batch_size: The number of completions fetched per query.
+        :return: An async iterator over lists of rows.
+        """
+        after = (0, 0)
+        while True:
+            query = (
+                select(UserTask.user_id, UserTask.task_id, UserTask.status, UserTask.created_at)
+                .where(tuple_(UserTask.user_id, UserTask.task_id) > tuple_(*after))
+                .order_by(UserTask.user_id, UserTask.task_id)
+                .limit(batch_size)
+            )
+            batch = (await self.session.execute(query)).all()
+            if not batch:
+                return
+
+            yield batch
+            after = (batch[-1].user_id, batch[-1].task_id)
+
+    async def batch_create_user_tasks(self, user_tasks: Union[Iterable[dict], AsyncIterable[dict]],
+                                      batch_size: int = 10000) -> int:
+        """
+        Bulk imports task completions with `copy_upsert`, existing completions are kept as is.
+        The users and tasks they refer to must exist.
+
+        :param user_tasks: Iterable or async iterable of dicts with `user_id`, `task_id` and `status`.
+        :param batch_size: The number of completions copied and committed at once.
+        :return: The number of imported completions.
+        :raises Exception: If a batch fails to import.
+        """
+        count = 0
+        try:
+            async for batch in iter_batches(user_tasks, batch_size):
+                records = [
+                    (int(user_task["user_id"]), int(user_task["task_id"]), bool(user_task.get("status")))
+                    for user_task in batch
+                ]
+                rows = await self.copy_upsert(
+                    UserTask.__table__, ("user_id", "task_id", "status"), records,
+                    conflict_columns=("user_id", "task_id"), returning=("user_id",),
+                )
+                await self.session.commit()
+                count += len(rows)
+        except Exception as e:
+            await self.session.rollback()
+            self.logger.error(f"Error batch creating task completions after {count} completions: {e}")
+            raise
+        return count
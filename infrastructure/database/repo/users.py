@@ -1,33 +1,96 @@
-import json
 import logging
-from typing import Optional, List, Sequence
+from dataclasses import dataclass, field
+from typing import Optional, List, Dict, Sequence, Any, AsyncIterator, Union, Iterable, AsyncIterable, Callable
 
-from sqlalchemy import select, update, func, desc
+from sqlalchemy import select, update, func, values, column, bindparam, BIGINT, Integer, Row
 from sqlalchemy.dialects.postgresql import insert
-from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.sql.expression import literal
+from sqlalchemy.sql import Select
 
+from infrastructure.database import cache
 from infrastructure.database.models import User, Referral
 from infrastructure.database.redis_client import RedisClient
-from infrastructure.database.repo.base import BaseRepo
+from infrastructure.database.repo.base import BaseRepo, iter_batches
+from infrastructure.database.repo.leaderboard import LeaderboardRepo
+from infrastructure.database.repo.referrals import ReferralsRepo
+from infrastructure.database.views import UserView
+
+# Number of users copied into Postgres and committed at once by a bulk import
+IMPORT_BATCH_SIZE = 10000
+# Number of users cached per Redis round trip by a bulk import
+CACHE_PIPELINE_SIZE = 1000
+
+SELECT_USER = (
+    select(User.user_id, User.language, User.balance, User.deliverable)
+    .where(User.user_id == bindparam("user_id"))
+)
+
+
+def select_user_batch(batch_size: int, columns: Sequence[Any], where: Sequence[Any], after_user_id: int) -> Select:
+    """
+    The keyset pagination query of `UserRepo.iter_user_batches`.
+    """
+    return (
+        select(User.user_id, *columns)
+        .where(User.user_id > after_user_id, *where)
+        .order_by(User.user_id)
+        .limit(batch_size)
+    )
+
+
+@dataclass
+class SignUp:
+    """
+    The outcome of `UserRepo.create_user`.
+
+    :param user: The created or updated user.
+    :param created: Whether the referral row was inserted, False for a user signing up again.
+    :param referral_chain: The referrers of a new user, see `ReferralsRepo.get_referral_chain`.
+    :param credits: The rewards credited to the referrers by user ID.
+    """
+    user: User
+    created: bool
+    referral_chain: List[Dict[str, Any]] = field(default_factory=list)
+    credits: Dict[int, int] = field(default_factory=dict)
 
 
 class UserRepo(BaseRepo):
     def __init__(self, session, redis_client: RedisClient):
         super().__init__(session)
         self.redis_client = redis_client
+        self.cache = redis_client.cache
+        self.leaderboard = LeaderboardRepo(session, redis_client)
         self.logger = logging.getLogger(__name__)
 
     async def create_user(self, user_id: int, language: str, referred_by: Optional[int] = None,
-                          reward_type: Optional[int] = 1) -> Optional[User]:
+                          reward_type: Optional[int] = 1,
+                          rewards: Optional[Callable[[List[Dict[str, Any]]], Dict[int, int]]] = None,
+                          referral_depth: int = 2) -> Optional[SignUp]:
+        """
+        Creates the user and their referral, counting the new referral for the referrer and the referrer's referrer.
+        An existing user gets the new language, their referral is kept as is.
+
+        The referrers of a new user are rewarded in the same transaction as the referral row,
+        so a referral is paid exactly once or not at all.
+
+        :param user_id: The ID of the user.
+        :param language: The language of the user.
+        :param referred_by: The ID of the user who invited them, if any.
+        :param reward_type: The reward type of the referral.
+        :param rewards: Computes the rewards by user ID from the referral chain of a new user.
+        :param referral_depth: The number of referrer levels passed to `rewards`.
+        :return: The user and whether they signed up for the first time, or None on error.
+        """
         try:
+            counted = []
+            referral_chain = []
+            credited = {}
             async with self.session.begin():
                 insert_user_stmt = (
                     insert(User)
                     .values(user_id=user_id, language=language)
                     .on_conflict_do_update(
                         index_elements=[User.user_id],
-                        set_=dict(language=language),
+                        set_=dict(language=language, deliverable=True),
                     )
                     .returning(User)
                 )
@@ -37,182 +100,336 @@ class UserRepo(BaseRepo):
                 insert_referral_stmt = (
                     insert(Referral)
                     .values(referral_id=user_id, referred_by=referred_by, reward_type=reward_type)
+                    .on_conflict_do_nothing(index_elements=[Referral.referral_id])
+                    .returning(Referral.referral_id)
                 )
-                await self.session.execute(insert_referral_stmt)
-
-                # Update Redis cache directly
-                await self.redis_client.hset_dict(
-                    f"user:{user_id}",
-                    {
-                        "user_id": user.user_id,
-                        "language": user.language,
-                        "balance": user.balance
-                    }
-                )
-
-                return user
+                inserted = (await self.session.execute(insert_referral_stmt)).scalar_one_or_none()
+
+                # Only a new referral is counted, so the counters match the referrals table
+                if inserted is not None and referred_by is not None:
+                    counted = await self._count_new_referral(referred_by)
+
+                    if rewards is not None:
+                        referrals = ReferralsRepo(self.session, self.redis_client)
+                        referral_chain = await referrals.load_referral_chain(user_id, referral_depth)
+                        credits = rewards(referral_chain)
+                        balances = await self._credit(credits)
+                        credited = {referrer_id: credits[referrer_id] for referrer_id in balances}
+
+            # Update Redis cache once the transaction is committed
+            await self.cache.set(cache.USERS, UserView(user.user_id, user.language, user.balance, user.deliverable),
+                                 user_id)
+            if referred_by is not None:
+                await self.cache.delete(cache.REFERRALS_BY_USER, referred_by)
+            for counter, referrer_id in counted:
+                await self.cache.increment(cache.REFERRAL_COUNTS, counter, 1, referrer_id)
+            await self.leaderboard.add_user(user.user_id, user.balance)
+            await self._cache_credits(credited)
+
+            return SignUp(user=user, created=inserted is not None, referral_chain=referral_chain, credits=credited)
 
         except Exception as e:
             self.logger.error(f"Error creating user {user_id} and referral: {e}")
             return None
 
-    async def select_user(self, user_id: int) -> Optional[User]:
-        try:
-            cached_user = await self.redis_client.redis.hgetall(f"user:{user_id}")
-            if cached_user:
-                return User(user_id=int(cached_user["user_id"]),
-                            language=cached_user["language"],
-                            balance=int(cached_user["balance"]))
-
-            query = select(User).where(User.user_id == literal(user_id))
-            result = await self.session.execute(query)
-            user = result.scalar_one_or_none()
-
-            if user:
-                await self.redis_client.hset_dict(
-                    f"user:{user_id}",
-                    {
-                        "user_id": user.user_id,
-                        "language": user.language,
-                        "balance": user.balance
-                    }
-                )
+    async def _count_new_referral(self, referred_by: int) -> List[tuple]:
+        """
+        Increments the first-level counter of the referrer and the second-level counter of the referrer's referrer.
 
-            return user
+        :param referred_by: The ID of the referrer.
+        :return: Pairs of the incremented counter and the user it belongs to.
+        """
+        first_stmt = (
+            update(User)
+            .where(User.user_id == referred_by)
+            .values(first_referrals=User.first_referrals + 1)
+            .returning(User.user_id)
+        )
+        counted = [("first_referrals", user_id) for user_id in (await self.session.execute(first_stmt)).scalars()]
+
+        second_stmt = (
+            update(User)
+            .where(User.user_id == select(Referral.referred_by)
+                   .where(Referral.referral_id == referred_by)
+                   .scalar_subquery())
+            .values(second_referrals=User.second_referrals + 1)
+            .returning(User.user_id)
+        )
+        counted += [("second_referrals", user_id) for user_id in (await self.session.execute(second_stmt)).scalars()]
+        return counted
+
+    async def select_user(self, user_id: int) -> Optional[UserView]:
+        try:
+            return await self.cache.get_or_load(cache.USERS, (user_id,), lambda: self._load_user(user_id))
         except Exception as e:
             self.logger.error(f"Failed to select user {user_id}: {e}")
             return None
 
-    async def update_user(self, user_id: int, language: Optional[str] = None, balance: Optional[int] = None) -> \
-    Optional[User]:
-        try:
-            # Retrieve the current user details including the balance
-            user = await self.select_user(user_id)
+    async def _load_user(self, user_id: int) -> Optional[UserView]:
+        result = await self.session.execute(SELECT_USER, {"user_id": user_id})
+        row = result.one_or_none()
 
-            if user is None:
-                self.logger.error(f"User {user_id} not found when attempting to update balance.")
-                return None
+        if row is None:
+            return None
 
-            # If a new balance is provided, add it to the existing balance
-            if balance is not None:
-                balance += user.balance
+        return UserView(user_id=row.user_id, language=row.language, balance=row.balance,
+                        deliverable=row.deliverable)
+
+    async def update_user(self, user_id: int, language: Optional[str] = None, balance: Optional[int] = None) -> \
+    Optional[User]:
+        """
+        Updates the user's language and credits the balance in a single statement.
 
+        :param user_id: The ID of the user.
+        :param language: The new language.
+        :param balance: The amount added to the current balance, may be negative.
+        :return: The updated user, or None if the user doesn't exist.
+        """
+        try:
             update_stmt = update(User).where(User.user_id == user_id)
 
             if language is not None:
                 update_stmt = update_stmt.values(language=language)
             if balance is not None:
-                update_stmt = update_stmt.values(balance=balance)
+                # Added in SQL, so concurrent credits never overwrite each other
+                update_stmt = update_stmt.values(balance=User.balance + balance)
 
             result = await self.session.execute(update_stmt.returning(User))
             await self.session.commit()
 
             updated_user = result.scalar_one_or_none()
 
-            if updated_user:
-                await self.redis_client.hset_dict(
-                    f"user:{user_id}",
-                    {
-                        "user_id": updated_user.user_id,
-                        "language": updated_user.language,
-                        "balance": updated_user.balance
-                    }
+            if updated_user is None:
+                self.logger.error(f"User {user_id} not found when attempting to update.")
+                return None
+
+            if language is not None:
+                await self.cache.set(
+                    cache.USERS,
+                    UserView(updated_user.user_id, updated_user.language, updated_user.balance,
+                             updated_user.deliverable),
+                    user_id,
                 )
+            elif balance is not None:
+                await self.cache.increment(cache.USERS, "balance", balance, user_id)
+            if balance is not None:
+                await self.leaderboard.increment(user_id, balance)
 
             return updated_user
         except Exception as e:
             self.logger.error(f"Error updating user {user_id}: {e}")
             return None
 
-    async def select_leaderboard(self, user_id: int) -> dict:
+    async def increment_balance(self, user_id: int, delta: int) -> Optional[int]:
+        """
+        Atomically adds `delta` to the user's balance.
+
+        The increment is done by `UPDATE ... SET balance = balance + :delta RETURNING balance`
+        and mirrored by an atomic increment of the cached user, so concurrent credits are never lost.
+
+        :param user_id: The ID of the user.
+        :param delta: The amount added to the balance, may be negative.
+        :return: The new balance, or None if the user doesn't exist.
+        """
         try:
-            leaderboard_cache_key = "leaderboard:top5"
-            user_rank_cache_key = f"user:{user_id}:rank"
-
-            cached_leaderboard = await self.redis_client.redis.get(leaderboard_cache_key)
-            leaderboard = json.loads(cached_leaderboard) if cached_leaderboard else None
-
-            if leaderboard:
-                user_rank = next((row['place'] for row in leaderboard if row['user_id'] == user_id), None)
-            else:
-                top_users_query = (
-                    select(User.user_id, User.balance)
-                    .order_by(desc(User.balance))
-                    .limit(5)
-                )
-                top_users_result = await self.session.execute(top_users_query)
-                top_users = top_users_result.fetchall()
-
-                leaderboard = [
-                    {
-                        "user_id": row.user_id,
-                        "place": idx + 1,
-                        "balance": row.balance
-                    }
-                    for idx, row in enumerate(top_users)
-                ]
-
-                async with self.redis_client.redis.pipeline() as pipe:
-                    pipe.setex(leaderboard_cache_key, 86400, json.dumps(leaderboard))
-                    await pipe.execute()
-
-                user_rank = next((row['place'] for row in leaderboard if row['user_id'] == user_id), None)
-
-            if user_rank is None:
-                cached_user_rank = await self.redis_client.redis.get(user_rank_cache_key)
-                if cached_user_rank:
-                    user_rank = int(cached_user_rank)
-                else:
-                    rank_query = (
-                        select(func.count())
-                        .select_from(User)
-                        .where(User.balance > (select(User.balance).where(User.user_id == user_id).scalar_subquery()))
-                    )
-                    user_rank = (await self.session.execute(rank_query)).scalar() + 1
-                    await self.redis_client.redis.setex(user_rank_cache_key, 86400, user_rank)
+            update_stmt = (
+                update(User)
+                .where(User.user_id == user_id)
+                .values(balance=User.balance + delta)
+                .returning(User.balance)
+            )
+            new_balance = (await self.session.execute(update_stmt)).scalar_one_or_none()
+            await self.session.commit()
 
-            return {
-                "leaderboard": leaderboard,
-                "place": user_rank
-            }
+            if new_balance is None:
+                self.logger.error(f"User {user_id} not found when attempting to update balance.")
+                return None
+
+            await self.cache.increment(cache.USERS, "balance", delta, user_id)
+            await self.leaderboard.increment(user_id, delta)
+            return new_balance
         except Exception as e:
-            self.logger.error(f"Error selecting leaderboard for user {user_id}: {e}")
-            return {"leaderboard": [], "place": None}
+            await self.session.rollback()
+            self.logger.error(f"Error incrementing balance of user {user_id}: {e}")
+            return None
 
-    async def batch_create_users(self, users: List[dict]) -> None:
+    async def credit_balances(self, credits: Dict[int, int]) -> Optional[Dict[int, int]]:
+        """
+        Atomically adds amounts to the balances of many users in one statement and one transaction,
+        so either every user is credited or none is.
+
+        The amounts are joined as `UPDATE users ... FROM (VALUES ...)`, the cached users and the leaderboard
+        are incremented once the transaction is committed.
+
+        :param credits: The amounts added to the balances by user ID, may be negative.
+        :return: The new balances by user ID, users that don't exist are left out. None on error.
+        """
+        if not credits:
+            return {}
         try:
-            await self.session.execute(
-                insert(User),
-                users
-            )
+            balances = await self._credit(credits)
             await self.session.commit()
+        except Exception as e:
+            await self.session.rollback()
+            self.logger.error(f"Error crediting balances of users {list(credits)}: {e}")
+            return None
 
-            async with self.redis_client.redis.pipeline() as pipe:
-                for user in users:
-                    await self.redis_client.hset_dict(
-                        f"user:{user['user_id']}",
-                        {
-                            "user_id": user['user_id'],
-                            "language": user['language'],
-                            "balance": user['balance']
-                        }
-                    )
-                await pipe.execute()
+        await self._cache_credits({user_id: credits[user_id] for user_id in balances})
+        return balances
+
+    async def _credit(self, credits: Dict[int, int]) -> Dict[int, int]:
+        """
+        Adds the amounts to the balances within the current transaction.
+
+        :return: The new balances by user ID, users that don't exist are left out.
+        """
+        if not credits:
+            return {}
+        amounts = values(
+            column("user_id", BIGINT), column("delta", Integer), name="credits"
+        ).data(list(credits.items()))
+        update_stmt = (
+            update(User)
+            .where(User.user_id == amounts.c.user_id)
+            .values(balance=User.balance + amounts.c.delta)
+            .returning(User.user_id, User.balance)
+        )
+        return {row.user_id: row.balance for row in await self.session.execute(update_stmt)}
+
+    async def _cache_credits(self, credits: Dict[int, int]) -> None:
+        # Mirrors committed credits in the cached users and the leaderboard
+        for user_id, delta in credits.items():
+            try:
+                await self.cache.increment(cache.USERS, "balance", delta, user_id)
+                await self.leaderboard.increment(user_id, delta)
+            except Exception as e:
+                self.logger.error(f"Error updating cached balance of user {user_id}: {e}")
+
+    async def set_deliverable(self, user_ids: Sequence[int], deliverable: bool) -> None:
+        """
+        Updates the deliverability flag of the given users, only rows whose flag actually changes are written.
+        The changed users are dropped from the cache.
 
+        :param user_ids: The IDs of the users.
+        :param deliverable: Whether broadcasts can reach the users' chats.
+        """
+        if not user_ids:
+            return
+        try:
+            update_stmt = (
+                update(User)
+                .where(User.user_id.in_(user_ids), User.deliverable.is_not(deliverable))
+                .values(deliverable=deliverable)
+                .returning(User.user_id)
+            )
+            changed = (await self.session.execute(update_stmt)).scalars().all()
+            await self.session.commit()
+            await self.cache.delete_many(cache.USERS, changed)
         except Exception as e:
-            self.logger.error(f"Error batch creating users: {e}")
+            await self.session.rollback()
+            self.logger.error(f"Error updating deliverability of {len(user_ids)} users: {e}")
 
-    async def get_all_users(self) -> Sequence[User]:
+    async def count_deliverable_users(self) -> int:
         """
-        Retrieves a list of all users in the database.
+        Counts users reachable by broadcasts.
+
+        :return: The number of users with the deliverable flag set.
+        """
+        query = select(func.count()).select_from(User).where(User.deliverable)
+        return (await self.session.execute(query)).scalar()
+
+    async def batch_create_users(self, users: Union[Iterable[dict], AsyncIterable[dict]],
+                                 batch_size: int = IMPORT_BATCH_SIZE,
+                                 pipeline_size: int = CACHE_PIPELINE_SIZE) -> int:
+        """
+        Bulk imports users, e.g. when migrating them from another bot.
+
+        Every batch is upserted with `copy_upsert`, existing users get the imported language and balance.
+        The written rows are then cached with pipelines of `pipeline_size` commands, so the import costs
+        a few round trips per batch instead of several per user.
 
-        :return: A list of User objects.
+        :param users: Iterable or async iterable of dicts with `user_id` and optional `language` and `balance`.
+        :param batch_size: The number of users copied and committed at once.
+        :param pipeline_size: The number of users cached per Redis round trip.
+        :return: The number of imported users.
+        :raises Exception: If a batch fails, the batches committed before it are kept.
         """
+        count = 0
         try:
-            query = select(User)
-            result = await self.session.execute(query)
-            users = result.scalars().all()
-            return users
-        except SQLAlchemyError as e:
-            self.logger.error(f"Error retrieving all users: {e}")
-            return []
+            async for batch in iter_batches(users, batch_size):
+                count += await self._import_batch(batch, pipeline_size)
+        except Exception as e:
+            await self.session.rollback()
+            self.logger.error(f"Error batch creating users after {count} users: {e}")
+            raise
+        return count
+
+    async def _import_batch(self, users: List[dict], pipeline_size: int) -> int:
+        default_balance = User.balance.default.arg
+        records = [
+            (int(user["user_id"]), user.get("language") or "en", int(user.get("balance", default_balance)))
+            for user in users
+        ]
+
+        rows = await self.copy_upsert(
+            User.__table__, ("user_id", "language", "balance"), records,
+            conflict_columns=("user_id",), update_columns=("language", "balance"),
+            returning=("user_id", "language", "balance", "deliverable"),
+        )
+        await self.session.commit()
+
+        for start in range(0, len(rows), pipeline_size):
+            chunk = rows[start:start + pipeline_size]
+            await self.cache.set_many(cache.USERS, {
+                row["user_id"]: UserView(row["user_id"], row["language"], row["balance"], row["deliverable"])
+                for row in chunk
+            })
+            await self.leaderboard.set_scores({row["user_id"]: row["balance"] for row in chunk})
+
+        return len(rows)
+
+    async def iter_user_batches(self, batch_size: int = 1000, columns: Optional[Sequence[Any]] = None,
+                                where: Optional[Sequence[Any]] = None,
+                                after_user_id: int = 0) -> AsyncIterator[Sequence[Row[Any]]]:
+        """
+        Streams users in batches ordered by ID, using keyset pagination on `user_id`.
+
+        Only one batch is kept in memory at a time. When the session has no transaction of its own,
+        it is committed after every batch, so the connection goes back to the pool between batches
+        instead of holding one long-running transaction.
+
+        :param batch_size: The number of users fetched per query.
+        :param columns: The columns to select, `user_id` is always selected first. Defaults to `language`.
+        :param where: Additional filter conditions.
+        :param after_user_id: Only users with a greater ID are returned.
+        :return: An async iterator over lists of lightweight rows.
+        """
+        columns = columns if columns is not None else (User.language,)
+        owns_transaction = not self.session.in_transaction()
+
+        while True:
+            query = select_user_batch(batch_size, columns, where or (), after_user_id)
+            batch = (await self.session.execute(query)).all()
+            if owns_transaction:
+                await self.session.commit()
+            if not batch:
+                return
+
+            yield batch
+            after_user_id = batch[-1].user_id
+
+    async def iter_users(self, batch_size: int = 1000, columns: Optional[Sequence[Any]] = None,
+                         where: Optional[Sequence[Any]] = None,
+                         after_user_id: int = 0) -> AsyncIterator[Row[Any]]:
+        """
+        Streams users one by one with memory bounded by `batch_size`, see `iter_user_batches`.
+
+        :param batch_size: The number of users fetched per query.
+        :param columns: The columns to select, `user_id` is always selected first. Defaults to `language`.
+        :param where: Additional filter conditions.
+        :param after_user_id: Only users with a greater ID are returned.
+        :return: An async iterator over lightweight rows.
+        """
+        async for batch in self.iter_user_batches(batch_size, columns, where, after_user_id):
+            for row in batch:
+                yield row
@@ -1,8 +1,35 @@
+from uuid import uuid4
+
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
 from tgbot.config import DbConfig
 
 
+def connect_args(db: DbConfig) -> dict:
+    """
+    asyncpg connection arguments for the prepared statements setting.
+
+    With prepared statements on, every connection keeps up to `statement_cache_size` statements prepared,
+    so a repeated query skips parsing and planning in Postgres. PgBouncer in transaction pooling mode
+    may run the next query on another server connection, so there statements are neither cached
+    nor named twice alike.
+
+    The repositories' hot queries (`SELECT_USER`, `SELECT_TASK`, ...) are module-level statements
+    with bind parameters, so SQLAlchemy builds them and computes their cache key once, and their SQL
+    text stays identical between calls and hits the prepared statement cache.
+
+    :param db: The database configuration.
+    :return: Arguments for `create_async_engine(connect_args=...)`.
+    """
+    if db.prepared_statements:
+        return {"prepared_statement_cache_size": db.statement_cache_size}
+    return {
+        "statement_cache_size": 0,
+        "prepared_statement_cache_size": 0,
+        "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+    }
+
+
 def create_engine(db: DbConfig, echo=False):
     engine = create_async_engine(
         db.construct_sqlalchemy_url(),
@@ -11,6 +38,7 @@ def create_engine(db: DbConfig, echo=False):
         max_overflow=200,
         future=True,
         echo=echo,
+        connect_args=connect_args(db),
     )
     return engine
 
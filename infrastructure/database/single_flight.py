@@ -0,0 +1,49 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent loads of the same key: the first caller runs the load,
+    the callers arriving while it's in flight wait for its result instead of loading again.
+
+    Nothing is cached, the next call after the load finishes starts a new one.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, asyncio.Future] = {}
+
+    async def run(self, key: Hashable, load: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Runs the load unless one for the same key is already in flight.
+
+        :param key: The key identifying the loaded value.
+        :param load: Coroutine function loading the value.
+        :return: The loaded value, shared by every concurrent caller.
+        """
+        while (flight := self._flights.get(key)) is not None:
+            try:
+                # Shielded, so a cancelled follower doesn't cancel the load for everybody else
+                return await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                if not flight.cancelled():
+                    raise
+                # The caller running the load was cancelled, try again
+
+        flight = asyncio.get_running_loop().create_future()
+        self._flights[key] = flight
+        try:
+            result = await load()
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            # Retrieved here, so a load nobody else waited for isn't reported as an unhandled error
+            flight.exception()
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            del self._flights[key]
@@ -0,0 +1,222 @@
+"""
+Bulk export and import of users, referrals and task completions.
+
+Rows are streamed in batches, so memory use doesn't depend on the table size.
+Files ending with `.parquet` are columnar Parquet files (requires `pyarrow`),
+anything else is gzip-compressed NDJSON, one JSON object per line.
+
+Usage:
+    python -m infrastructure.database.transfer export users users.ndjson.gz
+    python -m infrastructure.database.transfer export referrals referrals.parquet
+    python -m infrastructure.database.transfer import users users.ndjson.gz
+
+Import users before referrals and task completions, completions also require their tasks to exist.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import sys
+import time
+from datetime import datetime
+from typing import AsyncIterator, Iterator, Sequence, Any, Dict, Callable
+
+from sqlalchemy import Row
+
+from infrastructure.database.models import User
+from infrastructure.database.redis_client import RedisClient
+from infrastructure.database.repo.requests import RequestsRepo
+from infrastructure.database.setup import create_engine, create_session_pool
+from tgbot.config import load_config
+
+TABLES = ("users", "referrals", "user_tasks")
+# Number of rows read from the database or the file at once
+TRANSFER_BATCH_SIZE = 10000
+# Seconds between two progress reports
+PROGRESS_INTERVAL = 5
+
+
+class Progress:
+    """
+    Counts transferred rows and periodically logs how many were done and how fast.
+
+    :param label: The name of the transfer in the log.
+    :param interval: Seconds between two reports.
+    """
+
+    def __init__(self, label: str, interval: float = PROGRESS_INTERVAL):
+        self.label = label
+        self.interval = interval
+        self.count = 0
+        self.started_at = self.reported_at = time.monotonic()
+
+    def add(self, count: int) -> None:
+        self.count += count
+        if time.monotonic() - self.reported_at >= self.interval:
+            self.report()
+
+    def report(self) -> None:
+        self.reported_at = time.monotonic()
+        elapsed = self.reported_at - self.started_at
+        logging.info(f"{self.label}: {self.count} rows, {self.count / elapsed if elapsed else 0:.0f} rows/s")
+
+
+def iter_table(repo: RequestsRepo, table: str) -> AsyncIterator[Sequence[Row[Any]]]:
+    if table == "users":
+        return repo.users.iter_user_batches(
+            TRANSFER_BATCH_SIZE, columns=(User.language, User.balance, User.deliverable, User.created_at)
+        )
+    if table == "referrals":
+        return repo.referrals.iter_referral_batches(TRANSFER_BATCH_SIZE)
+    return repo.user_tasks.iter_user_task_batches(TRANSFER_BATCH_SIZE)
+
+
+def import_table(repo: RequestsRepo, table: str) -> Callable:
+    if table == "users":
+        return repo.users.batch_create_users
+    if table == "referrals":
+        return repo.referrals.batch_create_referrals
+    return repo.user_tasks.batch_create_user_tasks
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class NdjsonWriter:
+    def __init__(self, path: str):
+        self.file = gzip.open(path, "wt", encoding="utf-8")
+
+    def write(self, rows: Sequence[Dict[str, Any]]) -> None:
+        self.file.writelines(json.dumps(row, default=_json_default, ensure_ascii=False) + "\n" for row in rows)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ParquetWriter:
+    def __init__(self, path: str, table: str):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit("Parquet files require pyarrow: pip install pyarrow")
+        self.pyarrow = pyarrow
+        # Explicit types, so a batch of nulls doesn't change the type of a column
+        schemas = {
+            "users": [("user_id", pyarrow.int64()), ("language", pyarrow.string()), ("balance", pyarrow.int64()),
+                      ("deliverable", pyarrow.bool_()), ("created_at", pyarrow.timestamp("us"))],
+            "referrals": [("referral_id", pyarrow.int64()), ("referred_by", pyarrow.int64()),
+                          ("reward_type", pyarrow.int32()), ("created_at", pyarrow.timestamp("us"))],
+            "user_tasks": [("user_id", pyarrow.int64()), ("task_id", pyarrow.int64()), ("status", pyarrow.bool_()),
+                           ("created_at", pyarrow.timestamp("us"))],
+        }
+        self.schema = pyarrow.schema(schemas[table])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, rows: Sequence[Dict[str, Any]]) -> None:
+        # Every batch becomes a row group
+        self.writer.write_table(self.pyarrow.Table.from_pylist(list(rows), schema=self.schema))
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+def read_ndjson(path: str) -> Iterator[Dict[str, Any]]:
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_parquet(path: str) -> Iterator[Dict[str, Any]]:
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        raise SystemExit("Parquet files require pyarrow: pip install pyarrow")
+    for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=TRANSFER_BATCH_SIZE):
+        yield from batch.to_pylist()
+
+
+async def export_table(repo: RequestsRepo, table: str, path: str) -> int:
+    """
+    Streams a table into a file.
+
+    :param repo: The repositories.
+    :param table: One of `TABLES`.
+    :param path: The output file, Parquet if it ends with `.parquet`, gzipped NDJSON otherwise.
+    :return: The number of exported rows.
+    """
+    writer = ParquetWriter(path, table) if path.endswith(".parquet") else NdjsonWriter(path)
+    progress = Progress(f"Export of {table}")
+    try:
+        async for batch in iter_table(repo, table):
+            writer.write([row._asdict() for row in batch])
+            progress.add(len(batch))
+    finally:
+        writer.close()
+    progress.report()
+    return progress.count
+
+
+async def import_file(repo: RequestsRepo, table: str, path: str) -> int:
+    """
+    Streams a file into a table, existing users are overwritten, existing referrals and completions are kept.
+
+    :param repo: The repositories.
+    :param table: One of `TABLES`.
+    :param path: The input file, Parquet if it ends with `.parquet`, gzipped NDJSON otherwise.
+    :return: The number of imported rows.
+    """
+    progress = Progress(f"Import of {table}")
+
+    def rows() -> Iterator[Dict[str, Any]]:
+        for row in read_parquet(path) if path.endswith(".parquet") else read_ndjson(path):
+            progress.add(1)
+            yield row
+
+    count = await import_table(repo, table)(rows(), batch_size=TRANSFER_BATCH_SIZE)
+    if table == "referrals" and count:
+        # Imported referrals bypass the counters maintained on sign up
+        await repo.referrals.recount_referrals()
+    progress.report()
+    logging.info(f"Import of {table}: {count} of {progress.count} rows written")
+    return count
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("export", "import"))
+    parser.add_argument("table", choices=TABLES)
+    parser.add_argument("path")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    config = load_config(".env")
+
+    engine = create_engine(config.db)
+    session_pool = create_session_pool(engine)
+    redis = RedisClient(config.redis.dsn())
+    await redis.connect()
+
+    try:
+        async with session_pool() as session:
+            repo = RequestsRepo(session, redis)
+            if args.command == "export":
+                await export_table(repo, args.table, args.path)
+            else:
+                await import_file(repo, args.table, args.path)
+    except Exception:
+        logging.exception(f"{args.command.capitalize()} of {args.table} failed")
+        return 1
+    finally:
+        await redis.close()
+        await engine.dispose()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,58 @@
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass(frozen=True, slots=True)
+class UserView:
+    """
+    Read-only snapshot of a user, returned by the repositories instead of ORM instances.
+
+    Attributes:
+        user_id (int): The unique identifier of the user.
+        language (str): The language preference of the user.
+        balance (int): The balance of the user.
+        deliverable (bool): Whether broadcasts can reach the user's chat. False for users cached
+            before the flag was, so their next /start still refreshes it.
+    """
+    user_id: int
+    language: str
+    balance: int
+    deliverable: bool = False
+
+
+@dataclass(frozen=True, slots=True)
+class TaskView:
+    """
+    Read-only snapshot of a task in a single language.
+
+    Attributes:
+        task_id (int): The unique identifier of the task.
+        title (str): The title in the requested language.
+        description (Optional[str]): The description in the requested language.
+        source (str): The source of the task, `t` for Telegram channels.
+        link (str): The link to the task.
+        cover (Optional[str]): The file ID of the cover image.
+        balance (int): The reward for completing the task.
+    """
+    task_id: int
+    title: str
+    description: Optional[str]
+    source: str
+    link: str
+    cover: Optional[str]
+    balance: int
+
+
+@dataclass(frozen=True, slots=True)
+class ReferralView:
+    """
+    Read-only snapshot of a referral.
+
+    Attributes:
+        referral_id (int): The ID of the referred user.
+        referred_by (Optional[int]): The ID of the user who invited them.
+        reward_type (int): The reward scheme of the referral.
+    """
+    referral_id: int
+    referred_by: Optional[int]
+    reward_type: int
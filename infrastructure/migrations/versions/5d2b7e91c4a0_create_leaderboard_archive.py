@@ -0,0 +1,37 @@
+"""Create leaderboard_archive table
+
+Revision ID: 5d2b7e91c4a0
+Revises: 8c1f4e2a9b37
+Create Date: 2026-10-18 12:47:05.118734
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '5d2b7e91c4a0'
+down_revision: Union[str, None] = '8c1f4e2a9b37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The bot creates missing tables on startup, it may have run before the migration
+    if sa.inspect(op.get_bind()).has_table('leaderboard_archive'):
+        return
+    op.create_table('leaderboard_archive',
+    sa.Column('window', sa.String(length=16), nullable=False),
+    sa.Column('period', sa.String(length=16), nullable=False),
+    sa.Column('user_id', sa.BIGINT(), autoincrement=False, nullable=False),
+    sa.Column('place', sa.Integer(), nullable=False),
+    sa.Column('score', sa.BIGINT(), nullable=False),
+    sa.Column('created_at', postgresql.TIMESTAMP(), server_default=sa.func.now(), nullable=False),
+    sa.PrimaryKeyConstraint('window', 'period', 'user_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('leaderboard_archive')
@@ -0,0 +1,33 @@
+"""Add users.deliverable with a partial index
+
+Revision ID: 8c1f4e2a9b37
+Revises: e6a3b8d1c274
+Create Date: 2026-10-18 10:12:41.503219
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c1f4e2a9b37'
+down_revision: Union[str, None] = 'e6a3b8d1c274'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Skipped for databases the bot created from the current models, see e6a3b8d1c274
+    inspector = sa.inspect(op.get_bind())
+    if 'deliverable' not in {column['name'] for column in inspector.get_columns('users')}:
+        op.add_column('users', sa.Column('deliverable', sa.Boolean(), server_default=sa.text('true'), nullable=False))
+    if 'ix_users_deliverable_user_id' not in {index['name'] for index in inspector.get_indexes('users')}:
+        op.create_index('ix_users_deliverable_user_id', 'users', ['user_id'], unique=False,
+                        postgresql_where=sa.text('deliverable'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_deliverable_user_id', table_name='users', postgresql_where=sa.text('deliverable'))
+    op.drop_column('users', 'deliverable')
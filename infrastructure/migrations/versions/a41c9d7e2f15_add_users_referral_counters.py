@@ -0,0 +1,53 @@
+"""Add referral counters to users
+
+Revision ID: a41c9d7e2f15
+Revises: 5d2b7e91c4a0
+Create Date: 2026-10-18 15:02:41.503817
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'a41c9d7e2f15'
+down_revision: Union[str, None] = '5d2b7e91c4a0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Skipped for databases the bot created from the current models, see e6a3b8d1c274
+    user_columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('users')}
+    for column in ('first_referrals', 'second_referrals'):
+        if column not in user_columns:
+            op.add_column('users', sa.Column(column, sa.Integer(), server_default=sa.text('0'), nullable=False))
+    # Backfill from the existing referrals, later the counters are maintained by the bot.
+    # Safe to run again, the counters are recomputed
+    op.execute("""
+        UPDATE users SET first_referrals = counts.referrals
+        FROM (
+            SELECT referred_by, count(*) AS referrals
+            FROM referrals
+            WHERE referred_by IS NOT NULL
+            GROUP BY referred_by
+        ) AS counts
+        WHERE users.user_id = counts.referred_by
+    """)
+    op.execute("""
+        UPDATE users SET second_referrals = counts.referrals
+        FROM (
+            SELECT parent.referred_by, count(*) AS referrals
+            FROM referrals AS child
+            JOIN referrals AS parent ON parent.referral_id = child.referred_by
+            WHERE parent.referred_by IS NOT NULL
+            GROUP BY parent.referred_by
+        ) AS counts
+        WHERE users.user_id = counts.referred_by
+    """)
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'second_referrals')
+    op.drop_column('users', 'first_referrals')
@@ -0,0 +1,77 @@
+"""Reconcile the schema with the models
+
+The first migration created a users table that the models never matched, while the bot created
+the remaining tables with `create_all`. Every step here and in the later migrations is skipped
+when the schema already matches, so a database built by the bot can be stamped at 343bb188ff78
+(`alembic stamp 343bb188ff78`) and upgraded to head like one built by Alembic.
+
+Revision ID: e6a3b8d1c274
+Revises: 343bb188ff78
+Create Date: 2026-10-18 16:21:37.214690
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = 'e6a3b8d1c274'
+down_revision: Union[str, None] = '343bb188ff78'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    user_columns = {column['name'] for column in inspector.get_columns('users')}
+
+    if 'balance' not in user_columns:
+        op.add_column('users', sa.Column('balance', sa.Integer(), server_default=sa.text('1000'), nullable=False))
+        op.alter_column('users', 'balance', server_default=None)
+    # Never written by the bot, full_name would even reject every new user
+    for column in ('username', 'full_name', 'active'):
+        if column in user_columns:
+            op.drop_column('users', column)
+
+    if not inspector.has_table('referrals'):
+        op.create_table('referrals',
+        sa.Column('referral_id', sa.BIGINT(), autoincrement=False, nullable=False),
+        sa.Column('referred_by', sa.BIGINT(), nullable=True),
+        sa.Column('reward_type', sa.Integer(), nullable=False),
+        sa.Column('created_at', postgresql.TIMESTAMP(), server_default=sa.func.now(), nullable=False),
+        sa.PrimaryKeyConstraint('referral_id')
+        )
+
+    if not inspector.has_table('tasks'):
+        op.create_table('tasks',
+        sa.Column('task_id', sa.BIGINT(), autoincrement=True, nullable=False),
+        sa.Column('titles', sa.JSON(), nullable=False),
+        sa.Column('descriptions', sa.JSON(), nullable=True),
+        sa.Column('source', sa.String(), nullable=False),
+        sa.Column('link', sa.String(), nullable=False),
+        sa.Column('cover', sa.String(), nullable=True),
+        sa.Column('balance', sa.Integer(), nullable=False),
+        sa.Column('created_at', postgresql.TIMESTAMP(), server_default=sa.func.now(), nullable=False),
+        sa.PrimaryKeyConstraint('task_id')
+        )
+
+    if not inspector.has_table('user_tasks'):
+        op.create_table('user_tasks',
+        sa.Column('user_id', sa.BIGINT(), nullable=False),
+        sa.Column('task_id', sa.BIGINT(), nullable=False),
+        sa.Column('status', sa.Boolean(), nullable=False),
+        sa.Column('created_at', postgresql.TIMESTAMP(), server_default=sa.func.now(), nullable=False),
+        sa.ForeignKeyConstraint(['task_id'], ['tasks.task_id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.user_id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id', 'task_id')
+        )
+
+
+def downgrade() -> None:
+    # The tables may predate this migration, so they are kept
+    op.add_column('users', sa.Column('active', sa.Boolean(), server_default=sa.text('true'), nullable=False))
+    op.add_column('users', sa.Column('full_name', sa.String(length=128), nullable=True))
+    op.add_column('users', sa.Column('username', sa.String(length=128), nullable=True))
+    op.drop_column('users', 'balance')
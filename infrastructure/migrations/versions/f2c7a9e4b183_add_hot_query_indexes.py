@@ -0,0 +1,43 @@
+"""Add indexes for the hot queries
+
+Revision ID: f2c7a9e4b183
+Revises: a41c9d7e2f15
+Create Date: 2026-10-18 16:48:12.630914
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2c7a9e4b183'
+down_revision: Union[str, None] = 'a41c9d7e2f15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Skipped for databases the bot created from the current models, see e6a3b8d1c274
+    inspector = sa.inspect(op.get_bind())
+    referral_indexes = {index['name'] for index in inspector.get_indexes('referrals')}
+    user_task_indexes = {index['name'] for index in inspector.get_indexes('user_tasks')}
+
+    # Built without locking writes, which can't run inside the migration transaction
+    with op.get_context().autocommit_block():
+        if 'ix_referrals_referred_by' not in referral_indexes:
+            op.create_index('ix_referrals_referred_by', 'referrals', ['referred_by'], unique=False,
+                            postgresql_include=['referral_id', 'reward_type'],
+                            postgresql_where=sa.text('referred_by IS NOT NULL'),
+                            postgresql_concurrently=True)
+        if 'ix_user_tasks_task_id' not in user_task_indexes:
+            op.create_index('ix_user_tasks_task_id', 'user_tasks', ['task_id'], unique=False,
+                            postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_user_tasks_task_id', table_name='user_tasks',
+                      postgresql_concurrently=True)
+        op.drop_index('ix_referrals_referred_by', table_name='referrals',
+                      postgresql_concurrently=True)
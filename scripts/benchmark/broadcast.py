@@ -0,0 +1,117 @@
+"""
+Broadcast throughput benchmark against a local fake Bot API server.
+
+Usage:
+    python -m scripts.benchmark.broadcast --users 3000 --latency 0.05 --flood-rate 0.01 --block-rate 0.2
+
+Modes:
+    simple  - `broadcaster.broadcast` of a text message to synthetic user IDs.
+    mailing - the admin mailing path: a compiled broadcast sent with `mailing.make_sender`
+              to a synthetic (user_id, language) table.
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.telegram import TelegramAPIServer
+
+from scripts.benchmark.fake_bot_api import FakeBotApi
+from tgbot.middlewares.flood_control import FloodControlMiddleware
+from tgbot.services import broadcaster
+from tgbot.services.mailing import compile_mailing, make_sender, DeliveryResults
+
+
+class LatencyRecorder(BaseRequestMiddleware):
+    """
+    Records the latency of every Bot API request, including flood control waits and retries.
+    """
+
+    def __init__(self):
+        self.latencies = []
+
+    async def __call__(self, make_request, bot, method):
+        started_at = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            self.latencies.append(time.perf_counter() - started_at)
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1] if len(values) > 1 else values[0]
+
+
+async def run(args: argparse.Namespace) -> None:
+    api = FakeBotApi(latency=args.latency, flood_rate=args.flood_rate, retry_after=args.retry_after,
+                     block_rate=args.block_rate, rate_limit=args.server_limit)
+    runner = await api.start(port=args.port)
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{args.port}"))
+    recorder = LatencyRecorder()
+    # The recorder is the outer middleware, so latencies include flood control waits
+    session.middleware(recorder)
+    session.middleware(FloodControlMiddleware(args.rate_limit))
+    bot = Bot(token="42:BENCHMARK", session=session, default=DefaultBotProperties(parse_mode="HTML"))
+    broadcaster.rate_limiter = broadcaster.TokenBucket(args.rate_limit)
+
+    user_ids = range(1, args.users + 1)
+    started_at = time.perf_counter()
+    try:
+        if args.mode == "simple":
+            sent = await broadcaster.broadcast(bot, user_ids, "Benchmark", concurrency=args.concurrency)
+            blocked = None
+        else:
+            compiled = compile_mailing({"text_ru": "Бенчмарк", "text_en": "Benchmark",
+                                        "button_text_ru": "Открыть", "button_text_en": "Open",
+                                        "button_url": "https://t.me/benchmark_bot"})
+            results = DeliveryResults()
+            users = [(user_id, "ru" if user_id % 2 else "en") for user_id in user_ids]
+            sent = await broadcaster.deliver(users, make_sender(bot, compiled, results),
+                                             concurrency=args.concurrency, cost=compiled.recipient_cost)
+            blocked = len(results.unreachable)
+        wall_time = time.perf_counter() - started_at
+    finally:
+        await bot.session.close()
+        await runner.cleanup()
+
+    print(f"mode:           {args.mode}")
+    print(f"users:          {args.users}")
+    print(f"sent:           {sent}" + (f" (blocked: {blocked})" if blocked is not None else ""))
+    print(f"wall time:      {wall_time:.2f} s")
+    print(f"throughput:     {sent / wall_time:.1f} msg/s")
+    print(f"latency p50:    {percentile(recorder.latencies, 50) * 1000:.1f} ms")
+    print(f"latency p99:    {percentile(recorder.latencies, 99) * 1000:.1f} ms")
+    print(f"server:         {api.stats.requests} requests, {api.stats.flood_errors} x 429, "
+          f"{api.stats.blocked} x 403")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["simple", "mailing"], default="mailing")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=broadcaster.DEFAULT_CONCURRENCY)
+    parser.add_argument("--rate-limit", type=float, default=broadcaster.DEFAULT_RATE_LIMIT,
+                        help="client-side messages per second")
+    parser.add_argument("--latency", type=float, default=0.05, help="mean server latency, seconds")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="share of random 429 responses")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--block-rate", type=float, default=0.0, help="share of chats answering 403")
+    parser.add_argument("--server-limit", type=float, default=None,
+                        help="server-side requests per second before answering 429")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
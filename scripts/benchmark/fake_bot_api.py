@@ -0,0 +1,99 @@
+import asyncio
+import random
+import time
+import zlib
+from dataclasses import dataclass, field
+from typing import Optional
+
+from aiohttp import web
+
+
+@dataclass
+class FakeBotApiStats:
+    requests: int = 0
+    flood_errors: int = 0
+    blocked: int = 0
+
+
+@dataclass
+class FakeBotApi:
+    """
+    A local stand-in for api.telegram.org to benchmark senders without messaging real users.
+
+    Attributes:
+        latency (float): Mean response latency, seconds. Actual latency is uniform in [0.5, 1.5] of it.
+        flood_rate (float): Share of requests randomly answered with 429 `retry_after`.
+        retry_after (int): The `retry_after` of flood errors, seconds.
+        block_rate (float): Share of chats that blocked the bot, answered with 403. Stable per chat.
+        rate_limit (Optional[float]): When set, requests above this rate per second are answered with 429,
+            like the real flood control does.
+    """
+
+    latency: float = 0.05
+    flood_rate: float = 0.0
+    retry_after: int = 1
+    block_rate: float = 0.0
+    rate_limit: Optional[float] = None
+    stats: FakeBotApiStats = field(default_factory=FakeBotApiStats)
+
+    def __post_init__(self):
+        self._window_started = time.monotonic()
+        self._window_requests = 0
+        self._message_id = 0
+
+    def _is_blocked(self, chat_id: int) -> bool:
+        return zlib.crc32(str(chat_id).encode()) % 10_000 < self.block_rate * 10_000
+
+    def _over_limit(self) -> bool:
+        if self.rate_limit is None:
+            return False
+        now = time.monotonic()
+        if now - self._window_started >= 1:
+            self._window_started, self._window_requests = now, 0
+        self._window_requests += 1
+        return self._window_requests > self.rate_limit
+
+    def _message(self, chat_id: int) -> dict:
+        self._message_id += 1
+        return {"message_id": self._message_id, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.stats.requests += 1
+        method = request.match_info["method"].lower()
+        data = await request.post()
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+
+        if method == "getme":
+            return web.json_response({"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Benchmark",
+                                                             "username": "benchmark_bot"}})
+
+        if self._over_limit() or random.random() < self.flood_rate:
+            self.stats.flood_errors += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+
+        chat_id = int(data.get("chat_id", 0))
+        if self._is_blocked(chat_id):
+            self.stats.blocked += 1
+            return web.json_response({"ok": False, "error_code": 403,
+                                      "description": "Forbidden: bot was blocked by the user"}, status=403)
+
+        if method == "sendmediagroup":
+            return web.json_response({"ok": True, "result": [self._message(chat_id)]})
+        return web.json_response({"ok": True, "result": self._message(chat_id)})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081) -> web.AppRunner:
+        """
+        Starts serving `/bot{token}/{method}` in the background.
+
+        :return: The runner, call `cleanup()` on it to stop the server.
+        """
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
@@ -0,0 +1,136 @@
+"""
+Per-call overhead of the repository hot queries, built on every call versus prebuilt with bind parameters.
+
+Usage:
+    python -m scripts.benchmark.queries --mode compile --calls 20000
+    python -m scripts.benchmark.queries --mode execute --calls 5000 --user-id 1 --task-id 1
+
+Modes:
+    compile - no database, measures what SQLAlchemy does before a query reaches the driver:
+              building the statement, computing its cache key, looking up the compiled form
+              and binding the parameters.
+    execute - runs the queries against the database from `.env` through a session, once with asyncpg
+              prepared statements cached per connection and once with them off as behind PgBouncer.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from dataclasses import replace
+from typing import Any, Callable, Dict, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import asyncpg
+from sqlalchemy.sql.elements import ClauseElement
+
+from infrastructure.database.models import User, Task, UserTask, Referral
+from infrastructure.database.repo.referrals import SELECT_REFERRAL
+from infrastructure.database.repo.tasks import SELECT_TASK
+from infrastructure.database.repo.user_tasks import SELECT_COMPLETION
+from infrastructure.database.repo.users import SELECT_USER
+from infrastructure.database.setup import create_engine, create_session_pool
+from tgbot.config import load_config
+
+Query = Tuple[Callable[[Dict[str, Any]], ClauseElement], ClauseElement]
+
+# Each hot query as it used to be built on every call, and prebuilt
+QUERIES: Dict[str, Query] = {
+    "user by id": (
+        lambda params: (
+            select(User.user_id, User.language, User.balance, User.deliverable)
+            .where(User.user_id == params["user_id"])
+        ),
+        SELECT_USER,
+    ),
+    "task by id": (
+        lambda params: select(Task).where(Task.task_id == params["task_id"]),
+        SELECT_TASK,
+    ),
+    "completion check": (
+        lambda params: select(UserTask).where(UserTask.user_id == params["user_id"],
+                                              UserTask.task_id == params["task_id"]),
+        SELECT_COMPLETION,
+    ),
+    "referral lookup": (
+        lambda params: (
+            select(Referral.referral_id, Referral.referred_by, Referral.reward_type, User.language)
+            .outerjoin(User, Referral.referral_id == User.user_id)
+            .where(Referral.referral_id == params["user_id"])
+        ),
+        SELECT_REFERRAL,
+    ),
+}
+
+
+def compile_cached(statement: ClauseElement, params: Dict[str, Any], dialect, cache: dict) -> Any:
+    """
+    Mirrors the SQLAlchemy execution path up to the driver call.
+    """
+    key = statement._generate_cache_key()
+    compiled = cache.get(key.key)
+    if compiled is None:
+        compiled = cache[key.key] = statement.compile(dialect=dialect, cache_key=key)
+    return compiled.construct_params(params, extracted_parameters=key.bindparams)
+
+
+def measure_compile(calls: int, params: Dict[str, Any]) -> None:
+    dialect = asyncpg.dialect()
+    print(f"{'query':<18} {'rebuilt, us':>12} {'prebuilt, us':>13}")
+    for name, (build, prebuilt) in QUERIES.items():
+        cache = {}
+        started_at = time.perf_counter()
+        for _ in range(calls):
+            compile_cached(build(params), {}, dialect, cache)
+        rebuilt_time = time.perf_counter() - started_at
+
+        started_at = time.perf_counter()
+        for _ in range(calls):
+            compile_cached(prebuilt, params, dialect, cache)
+        prebuilt_time = time.perf_counter() - started_at
+
+        print(f"{name:<18} {rebuilt_time / calls * 1e6:>12.1f} {prebuilt_time / calls * 1e6:>13.1f}")
+
+
+async def measure_execute(calls: int, params: Dict[str, Any]) -> None:
+    config = load_config(".env")
+    print(f"{'query':<18} {'prepared':<9} {'rebuilt, us':>12} {'prebuilt, us':>13}")
+    for prepared_statements in (True, False):
+        engine = create_engine(replace(config.db, prepared_statements=prepared_statements))
+        session_pool = create_session_pool(engine)
+        try:
+            async with session_pool() as session:
+                for name, (build, prebuilt) in QUERIES.items():
+                    timings = {}
+                    for label, run in (("rebuilt", lambda: session.execute(build(params))),
+                                       ("prebuilt", lambda: session.execute(prebuilt, params))):
+                        # Warm up the compiled cache and the connection's statement cache
+                        await run()
+                        samples = []
+                        for _ in range(calls):
+                            started_at = time.perf_counter()
+                            await run()
+                            samples.append(time.perf_counter() - started_at)
+                        timings[label] = statistics.median(samples)
+                    print(f"{name:<18} {str(prepared_statements).lower():<9} "
+                          f"{timings['rebuilt'] * 1e6:>12.1f} {timings['prebuilt'] * 1e6:>13.1f}")
+        finally:
+            await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["compile", "execute"], default="compile")
+    parser.add_argument("--calls", type=int, default=10000)
+    parser.add_argument("--user-id", type=int, default=1)
+    parser.add_argument("--task-id", type=int, default=1)
+    args = parser.parse_args()
+
+    params = {"user_id": args.user_id, "task_id": args.task_id}
+    if args.mode == "compile":
+        measure_compile(args.calls, params)
+    else:
+        asyncio.run(measure_execute(args.calls, params))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Deletes the cache keys written before the `cache:` namespaces, see `infrastructure/database/cache.py`.
+
+Nothing reads these keys anymore. Some of them, like the `user:<id>` hashes, were written without an expiry,
+so they stay in Redis until deleted. Run it once after deploying the namespaced cache:
+    python -m scripts.redis.drop_legacy_cache --dry-run
+    python -m scripts.redis.drop_legacy_cache
+"""
+import argparse
+import asyncio
+
+import redis.asyncio as aioredis
+
+from tgbot.config import load_config
+
+# Key patterns of the old cache layout, `user:*` also covers the `user:<id>:rank` strings
+LEGACY_PATTERNS = (
+    "user:*",
+    "task:*",
+    "tasks:all",
+    "referral:*",
+    "referrals_by_user:*",
+    "referral_breakdown:*",
+    "leaderboard:top5",
+)
+# Keys scanned and deleted per round trip
+SCAN_COUNT = 1000
+
+
+async def drop_legacy_keys(redis: aioredis.Redis, dry_run: bool = False) -> int:
+    """
+    :param redis: The Redis connection.
+    :param dry_run: Only count the keys.
+    :return: The number of legacy keys found.
+    """
+    found = 0
+    for pattern in LEGACY_PATTERNS:
+        batch = []
+        async for key in redis.scan_iter(match=pattern, count=SCAN_COUNT):
+            batch.append(key)
+            if len(batch) >= SCAN_COUNT:
+                found += len(batch)
+                if not dry_run:
+                    await redis.unlink(*batch)
+                batch = []
+        if batch:
+            found += len(batch)
+            if not dry_run:
+                await redis.unlink(*batch)
+    return found
+
+
+async def main(dry_run: bool) -> None:
+    config = load_config(".env")
+    redis = aioredis.from_url(config.redis.dsn(), decode_responses=True)
+    try:
+        found = await drop_legacy_keys(redis, dry_run)
+    finally:
+        await redis.aclose()
+    print(f"{found} legacy keys {'found' if dry_run else 'deleted'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="only count the keys")
+    asyncio.run(main(parser.parse_args().dry_run))
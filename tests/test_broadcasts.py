@@ -0,0 +1,117 @@
+"""
+Chunk accounting of distributed mailings, runs against fakeredis.
+"""
+import asyncio
+
+import pytest
+
+from infrastructure.database.redis_client import RedisClient
+from infrastructure.database.repo.broadcasts import BroadcastsRepo
+
+fakeredis = pytest.importorskip("fakeredis")
+
+USERS = [(1, "en"), (2, "ru"), (3, "en"), (4, "en")]
+
+
+async def _jobs() -> BroadcastsRepo:
+    redis = RedisClient("redis://localhost")
+    redis.redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    jobs = BroadcastsRepo(redis)
+    await jobs.create_consumer_group()
+    return jobs
+
+
+async def _publish(jobs: BroadcastsRepo):
+    job = await jobs.create_job({"text_en": "Hello"}, chat_id=1, message_id=1, total=len(USERS))
+    await jobs.publish_chunk(job, USERS[:2])
+    await jobs.publish_chunk(job, USERS[2:])
+    return job
+
+
+async def _last_chunk_finishes_job():
+    jobs = await _jobs()
+    job = await _publish(jobs)
+    assert not await jobs.mark_published(job)
+
+    first, second = await jobs.read_chunks("worker-1", count=2, block=10)
+    assert first.users == USERS[:2]
+    assert not await jobs.complete_chunk(first, sent=1, failed=1, errors={"Bad Request": 1})
+    assert await jobs.complete_chunk(second, sent=1, failed=0, blocked=1)
+
+    job = await jobs.get_job(job.job_id)
+    assert (job.sent, job.failed, job.blocked, job.processed) == (2, 1, 1, 4)
+    assert await jobs.get_errors(job.job_id) == {"Bad Request": 1}
+
+
+def test_last_chunk_finishes_job():
+    asyncio.run(_last_chunk_finishes_job())
+
+
+async def _job_delivered_before_published():
+    jobs = await _jobs()
+    job = await _publish(jobs)
+    for chunk in await jobs.read_chunks("worker-1", count=2, block=10):
+        # Nobody knows yet that these are all the chunks
+        assert not await jobs.complete_chunk(chunk, sent=2, failed=0)
+
+    # So the publisher finishes the job
+    assert await jobs.mark_published(job)
+
+
+def test_job_delivered_before_published():
+    asyncio.run(_job_delivered_before_published())
+
+
+async def _reclaimed_chunk_counted_once():
+    jobs = await _jobs()
+    job = await _publish(jobs)
+    await jobs.mark_published(job)
+
+    stale, other = await jobs.read_chunks("worker-1", count=2, block=10)
+    await asyncio.sleep(0.02)
+    reclaimed, = await jobs.claim_stale_chunks("worker-2", min_idle_time=10)
+    assert reclaimed.entry_id == stale.entry_id
+
+    # Both workers delivered the chunk, only the one that still owns it counts it
+    assert not await jobs.complete_chunk(reclaimed, sent=2, failed=0)
+    assert not await jobs.complete_chunk(stale, sent=2, failed=0)
+    assert await jobs.complete_chunk(other, sent=2, failed=0)
+
+    job = await jobs.get_job(job.job_id)
+    assert (job.sent, job.processed) == (4, 4)
+
+
+def test_reclaimed_chunk_counted_once():
+    asyncio.run(_reclaimed_chunk_counted_once())
+
+
+async def _touched_chunk_not_reclaimed():
+    jobs = await _jobs()
+    await _publish(jobs)
+
+    chunk, _ = await jobs.read_chunks("worker-1", count=2, block=10)
+    await asyncio.sleep(0.05)
+    assert await jobs.touch_chunk(chunk, "worker-1")
+    reclaimed = await jobs.claim_stale_chunks("worker-2", min_idle_time=40, count=2)
+    assert chunk.entry_id not in [other.entry_id for other in reclaimed]
+
+    # A worker can't renew a chunk it doesn't own
+    assert not await jobs.touch_chunk(chunk, "worker-2")
+
+
+def test_touched_chunk_not_reclaimed():
+    asyncio.run(_touched_chunk_not_reclaimed())
+
+
+async def _finish_job_once():
+    jobs = await _jobs()
+    job = await _publish(jobs)
+
+    assert await jobs.finish_job(job, status="failed")
+    assert (await jobs.get_job(job.job_id)).status == "failed"
+    assert await jobs.get_active_job_ids() == set()
+    assert not await jobs.finish_job(job)
+
+
+def test_finish_job_once():
+    asyncio.run(_finish_job_once())
@@ -0,0 +1,74 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+from aiogram.methods import SendMessage, SendPhoto, SendVideo, SendMediaGroup
+
+from tgbot.services.mailing import compile_mailing
+
+BUTTON = {"button_text_ru": "Открыть", "button_text_en": "Open", "button_url": "https://example.com"}
+
+
+def button_of(request):
+    button, = request.reply_markup.inline_keyboard[0]
+    return button.text, button.url
+
+
+def test_text_per_language():
+    compiled = compile_mailing({"text_ru": "Привет", "text_en": "Hello", **BUTTON})
+
+    ru, = compiled.for_language("ru")
+    en, = compiled.for_language("en")
+    assert isinstance(ru, SendMessage) and (ru.text, button_of(ru)) == ("Привет", ("Открыть", "https://example.com"))
+    assert isinstance(en, SendMessage) and (en.text, button_of(en)) == ("Hello", ("Open", "https://example.com"))
+
+
+def test_other_languages_get_default():
+    compiled = compile_mailing({"text_ru": "Привет", "text_en": "Hello"})
+    assert compiled.for_language("de") == compiled.for_language("en")
+
+
+def test_no_button_without_url():
+    request, = compile_mailing({"text_en": "Hello", "button_text_en": "Open"}).for_language("en")
+    assert request.reply_markup is None
+
+
+def test_photo_and_video_carry_caption():
+    photo, = compile_mailing({"photo": "photo-id", "text_en": "Hello", **BUTTON}).for_language("en")
+    video, = compile_mailing({"video": "video-id", "text_en": "Hello"}).for_language("en")
+
+    assert isinstance(photo, SendPhoto) and (photo.photo, photo.caption) == ("photo-id", "Hello")
+    assert button_of(photo) == ("Open", "https://example.com")
+    assert isinstance(video, SendVideo) and (video.video, video.caption) == ("video-id", "Hello")
+
+
+def test_media_group_with_text():
+    compiled = compile_mailing({"media_group": ["a", "b"], "text_ru": "Привет", "text_en": ""})
+
+    album, text = compiled.for_language("ru")
+    assert isinstance(album, SendMediaGroup) and [media.media for media in album.media] == ["a", "b"]
+    assert isinstance(text, SendMessage) and text.text == "Привет"
+    # Without a text the album is sent alone, each request takes a rate limiter token
+    assert compiled.request_count("ru") == 2
+    assert compiled.request_count("en") == 1
+    assert compiled.recipient_cost((1, "ru")) == 2
+
+
+def test_task_deeplink_button():
+    request, = compile_mailing({"text_en": "New task", "task_deeplink": "https://t.me/bot?start=task_1",
+                                "button_url": "https://example.com"}).for_language("en")
+    assert button_of(request) == ("Go to the task", "https://t.me/bot?start=task_1")
+
+
+async def _send_swaps_chat_id():
+    compiled = compile_mailing({"media_group": ["a"], "text_en": "Hello"})
+    bot = AsyncMock()
+
+    assert await compiled.send(bot, 42, "en")
+    assert [type(call.args[0]) for call in bot.await_args_list] == [SendMediaGroup, SendMessage]
+    assert all(call.args[0].chat_id == 42 for call in bot.await_args_list)
+    # The compiled requests are reused for the next user
+    assert all(request.chat_id == 0 for request in compiled.for_language("en"))
+
+
+def test_send_swaps_chat_id():
+    asyncio.run(_send_swaps_chat_id())
@@ -0,0 +1,150 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage, GetUpdates
+
+from infrastructure.database.redis_client import RedisClient
+from tgbot.middlewares.flood_control import FloodControlMiddleware
+from tgbot.services import broadcaster
+from tgbot.services.broadcaster import TokenBucket
+
+
+async def _elapsed(coro) -> float:
+    started_at = time.monotonic()
+    await coro
+    return time.monotonic() - started_at
+
+
+async def _bucket_allows_burst_then_rate():
+    bucket = TokenBucket(rate=50)
+
+    async def take(count):
+        for _ in range(count):
+            await bucket.acquire()
+
+    assert await _elapsed(take(50)) < 0.1
+    assert 0.15 < await _elapsed(take(10)) < 0.4
+
+
+def test_bucket_allows_burst_then_rate():
+    asyncio.run(_bucket_allows_burst_then_rate())
+
+
+async def _request_above_capacity_does_not_hang():
+    bucket = TokenBucket(rate=10)
+    bucket.set_rate(2)
+    await asyncio.wait_for(bucket.acquire(5), timeout=2)
+
+
+def test_request_above_capacity_does_not_hang():
+    asyncio.run(_request_above_capacity_does_not_hang())
+
+
+async def _deliver_takes_token_per_request():
+    sent = []
+
+    async def send(recipient):
+        sent.append(recipient)
+        return True
+
+    # 40 recipients of two requests each are 30 tokens above the burst of 50
+    limiter = TokenBucket(rate=50)
+    elapsed = await _elapsed(broadcaster.deliver(range(40), send, limiter=limiter, cost=lambda recipient: 2))
+    assert sorted(sent) == list(range(40))
+    assert elapsed > 0.5
+
+
+def test_deliver_takes_token_per_request():
+    asyncio.run(_deliver_takes_token_per_request())
+
+
+def retry_after(seconds: int) -> TelegramRetryAfter:
+    return TelegramRetryAfter(method=SendMessage(chat_id=1, text="x"), message="Too Many Requests",
+                              retry_after=seconds)
+
+
+async def _flood_halves_rate_and_success_raises_it():
+    middleware = FloodControlMiddleware(rate_limit=30, increase=1, decrease=0.5, jitter=0)
+    responses = [retry_after(0), "ok"]
+
+    async def make_request(bot, method):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert await middleware(make_request, None, SendMessage(chat_id=1, text="x")) == "ok"
+    # Halved by the flood, raised by the retried request
+    assert middleware.limiter.rate == 16
+
+
+def test_flood_halves_rate_and_success_raises_it():
+    asyncio.run(_flood_halves_rate_and_success_raises_it())
+
+
+def test_concurrent_floods_back_off_once():
+    middleware = FloodControlMiddleware(rate_limit=30, decrease=0.5)
+    middleware._on_flood(1, 10)
+    middleware._on_flood(2, 10)
+    assert middleware.limiter.rate == 15
+
+
+def test_rate_stays_within_bounds():
+    middleware = FloodControlMiddleware(rate_limit=30, min_rate=5, increase=100, decrease=0.1)
+    middleware._on_flood(None, 0)
+    assert middleware.limiter.rate == 5
+    middleware._on_success()
+    assert middleware.limiter.rate == 30
+
+
+async def _flood_raised_after_max_retries():
+    middleware = FloodControlMiddleware(max_retries=2, jitter=0)
+    calls = 0
+
+    async def make_request(bot, method):
+        nonlocal calls
+        calls += 1
+        raise retry_after(0)
+
+    with pytest.raises(TelegramRetryAfter):
+        await middleware(make_request, None, SendMessage(chat_id=1, text="x"))
+    assert calls == 3
+
+
+def test_flood_raised_after_max_retries():
+    asyncio.run(_flood_raised_after_max_retries())
+
+
+async def _long_polling_not_limited():
+    middleware = FloodControlMiddleware(jitter=0)
+    middleware._on_flood(None, 60)
+
+    async def make_request(bot, method):
+        return []
+
+    assert await asyncio.wait_for(middleware(make_request, None, GetUpdates()), timeout=1) == []
+
+
+def test_long_polling_not_limited():
+    asyncio.run(_long_polling_not_limited())
+
+
+async def _redis_bucket_shared_by_instances(fakeredis):
+    redis = RedisClient("redis://localhost")
+    redis.redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    # Two processes with their own limiter objects for the same bot
+    first = broadcaster.shared_rate_limiter(redis, 42, rate=20)
+    second = broadcaster.shared_rate_limiter(redis, 42, rate=20)
+
+    async def take(limiter, count):
+        for _ in range(count):
+            await limiter.acquire()
+
+    assert await _elapsed(take(first, 20)) < 0.1
+    assert await _elapsed(take(second, 4)) > 0.1
+
+
+def test_redis_bucket_shared_by_instances():
+    asyncio.run(_redis_bucket_shared_by_instances(pytest.importorskip("fakeredis")))
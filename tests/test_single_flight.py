@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+
+from infrastructure.database.single_flight import SingleFlight
+
+
+class GatedLoad:
+    """
+    A load that blocks until released, counting how many times it ran.
+    """
+
+    def __init__(self, result="value"):
+        self.result = result
+        self.calls = 0
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        self.started.set()
+        await self.release.wait()
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+async def _concurrent_calls_share_one_load():
+    flights = SingleFlight()
+    load = GatedLoad()
+    callers = [asyncio.create_task(flights.run("key", load)) for _ in range(5)]
+    await load.started.wait()
+    load.release.set()
+
+    assert await asyncio.gather(*callers) == ["value"] * 5
+    assert load.calls == 1
+
+
+def test_concurrent_calls_share_one_load():
+    asyncio.run(_concurrent_calls_share_one_load())
+
+
+async def _next_call_after_load_starts_new_one():
+    flights = SingleFlight()
+    load = GatedLoad()
+    load.release.set()
+
+    await flights.run("key", load)
+    await flights.run("key", load)
+    assert load.calls == 2
+
+
+def test_next_call_after_load_starts_new_one():
+    asyncio.run(_next_call_after_load_starts_new_one())
+
+
+async def _different_keys_load_separately():
+    flights = SingleFlight()
+    load = GatedLoad()
+    load.release.set()
+
+    assert await asyncio.gather(flights.run("a", load), flights.run("b", load)) == ["value", "value"]
+    assert load.calls == 2
+
+
+def test_different_keys_load_separately():
+    asyncio.run(_different_keys_load_separately())
+
+
+async def _error_reaches_every_caller():
+    flights = SingleFlight()
+    load = GatedLoad(result=RuntimeError("database is down"))
+    callers = [asyncio.create_task(flights.run("key", load)) for _ in range(3)]
+    await load.started.wait()
+    load.release.set()
+
+    results = await asyncio.gather(*callers, return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert load.calls == 1
+
+
+def test_error_reaches_every_caller():
+    asyncio.run(_error_reaches_every_caller())
+
+
+async def _cancelled_follower_does_not_cancel_load():
+    flights = SingleFlight()
+    load = GatedLoad()
+    leader = asyncio.create_task(flights.run("key", load))
+    await load.started.wait()
+    follower = asyncio.create_task(flights.run("key", load))
+    await asyncio.sleep(0)
+
+    follower.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await follower
+    load.release.set()
+
+    assert await leader == "value"
+    assert load.calls == 1
+
+
+def test_cancelled_follower_does_not_cancel_load():
+    asyncio.run(_cancelled_follower_does_not_cancel_load())
+
+
+async def _follower_retries_when_leader_is_cancelled():
+    flights = SingleFlight()
+    load = GatedLoad()
+    leader = asyncio.create_task(flights.run("key", load))
+    await load.started.wait()
+    follower = asyncio.create_task(flights.run("key", load))
+    await asyncio.sleep(0)
+
+    leader.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+    load.release.set()
+
+    # The follower isn't cancelled with the leader, it runs the load itself
+    assert await follower == "value"
+    assert load.calls == 2
+
+
+def test_follower_retries_when_leader_is_cancelled():
+    asyncio.run(_follower_retries_when_leader_is_cancelled())
@@ -22,6 +22,11 @@ class DbConfig:
         The name of the database.
     port : int
         The port where the database server is listening.
+    prepared_statements : bool
+        Whether queries are run as named prepared statements cached per connection.
+        Turn it off behind PgBouncer in transaction pooling mode.
+    statement_cache_size : int
+        The number of prepared statements cached per connection.
     """
 
     host: str
@@ -29,6 +34,8 @@ class DbConfig:
     user: str
     database: str
     port: int = 5432
+    prepared_statements: bool = True
+    statement_cache_size: int = 500
 
     # For SQLAlchemy
     def construct_sqlalchemy_url(self, driver="asyncpg", host=None, port=None) -> str:
@@ -62,8 +69,11 @@ class DbConfig:
         user = env.str("POSTGRES_USER")
         database = env.str("POSTGRES_DB")
         port = env.int("DB_PORT", 5432)
+        prepared_statements = env.bool("DB_PREPARED_STATEMENTS", True)
+        statement_cache_size = env.int("DB_STATEMENT_CACHE_SIZE", 500)
         return DbConfig(
-            host=host, password=password, user=user, database=database, port=port
+            host=host, password=password, user=user, database=database, port=port,
+            prepared_statements=prepared_statements, statement_cache_size=statement_cache_size,
         )
 
 
@@ -130,6 +140,33 @@ class RedisConfig:
         )
 
 
+@dataclass
+class BroadcastConfig:
+    """
+    Broadcast delivery configuration class.
+
+    Attributes
+    ----------
+    distributed : bool
+        Whether mailings are published to a Redis Stream and delivered by `worker.py` processes
+        instead of being sent by the bot process itself.
+    rate_limit : int
+        Messages per second allowed for the bot across all senders.
+    """
+
+    distributed: bool = False
+    rate_limit: int = 30
+
+    @staticmethod
+    def from_env(env: Env):
+        """
+        Creates the BroadcastConfig object from environment variables.
+        """
+        distributed = env.bool("BROADCAST_DISTRIBUTED", False)
+        rate_limit = env.int("BROADCAST_RATE_LIMIT", 30)
+        return BroadcastConfig(distributed=distributed, rate_limit=rate_limit)
+
+
 @dataclass
 class Miscellaneous:
     """
@@ -169,6 +206,8 @@ class Config:
         Holds the settings specific to the database (default is None).
     redis : Optional[RedisConfig]
         Holds the settings specific to Redis (default is None).
+    broadcast : Optional[BroadcastConfig]
+        Holds the settings specific to broadcast delivery (default is None).
     images : Optional[ImageConfig]
         Holds the settings specific to image IDs (default is None).
     """
@@ -177,6 +216,7 @@ class Config:
     misc: Miscellaneous
     db: Optional[DbConfig] = None
     redis: Optional[RedisConfig] = None
+    broadcast: Optional[BroadcastConfig] = None
 
 
 def load_config(path: str = None) -> Config:
@@ -195,4 +235,5 @@ def load_config(path: str = None) -> Config:
         db=DbConfig.from_env(env),
         redis=RedisConfig.from_env(env),
         misc=Miscellaneous.from_env(env),
+        broadcast=BroadcastConfig.from_env(env),
     )
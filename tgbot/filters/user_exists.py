@@ -1,7 +1,9 @@
+from typing import Optional
+
 from aiogram.filters import BaseFilter
 from aiogram.types import Message
 
-from infrastructure.database.repo.requests import RequestsRepo
+from infrastructure.database.views import UserView
 
 
 class UserExistsFilter(BaseFilter):
@@ -15,22 +17,17 @@ class UserExistsFilter(BaseFilter):
 
     does_user_exist: bool = False
 
-    async def __call__(self, message: Message, session, redis) -> bool:
+    async def __call__(self, message: Message, user: Optional[UserView]) -> bool:
         """
-        Checks if the user exists in the database using the provided session.
+        Checks if the user exists in the database using the user resolved by UserMiddleware.
 
         Args:
             message (Message): The incoming message object containing user and chat data.
-            session: The database session used to interact with the database.
+            user (Optional[UserView]): The user sending the message, None if they aren't registered.
 
         Returns:
             bool: True if the user's existence status matches `does_user_exist`,
                   otherwise False.
         """
-        # Create an instance of the RequestsRepo using the provided session
-        repo = RequestsRepo(session, redis)
-
-        # Check if the user exists in the database by selecting the user by chat ID
-        user_exists = await repo.users.select_user(message.chat.id) is not None
         # Return True if the existence status matches the does_user_exist attribute
-        return user_exists == self.does_user_exist
+        return (user is not None) == self.does_user_exist
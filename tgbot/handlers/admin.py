@@ -1,16 +1,16 @@
-import time
-
 from aiogram import Router, F, Bot
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
-from aiogram.types import Message, CallbackQuery, InputMediaPhoto
+from aiogram.types import Message, CallbackQuery
 
 from funcs import get_link_source, is_valid_url
 from infrastructure.database.repo.requests import RequestsRepo
+from tgbot.config import Config
 from tgbot.filters.admin import AdminFilter
 from tgbot.keyboards.inline import admin_keyboard, task_creation_keyboard, admin_back_keyboard, BackCallbackData, \
-    broadcast_creation_keyboard, mailing_keyboard, mailing_tasks_choice
+    broadcast_creation_keyboard, mailing_tasks_choice
 from tgbot.misc.states import TaskCreation, BroadcastCreation
+from tgbot.services.mailing import start_mailing
 
 # Create a router specifically for admin-related commands
 admin_router = Router()
@@ -212,64 +212,18 @@ async def enter_button_url(message: Message, state: FSMContext, bot: Bot):
     )
 
 @admin_router.callback_query(F.data == "save_broadcast")
-async def save_broadcast(call: CallbackQuery, state: FSMContext, session, redis, bot: Bot):
+async def save_broadcast(call: CallbackQuery, state: FSMContext, session, session_pool, redis, bot: Bot,
+                         config: Config):
     repo = RequestsRepo(session, redis)
     broadcast_data = await state.get_data()
-
-    users = await repo.users.get_all_users()
-    button = None
-    button_text_ru = broadcast_data.get("button_text_ru")
-    button_text_en = broadcast_data.get("button_text_en")
-    button_url = broadcast_data.get("button_url")
-
-    # Check for task deeplink and set button text accordingly
-    if broadcast_data.get("task_deeplink"):
-        button_text_ru = broadcast_data.get("button_text_ru", "Перейти к заданию")
-        button_text_en = broadcast_data.get("button_text_en", "Go to the task")
-        button_url = broadcast_data.get("task_deeplink")
-
-    for user in users:
-        try:
-            # Determine which text and button to send based on the user's language preference
-            if user.language == "ru":
-                text_to_send = broadcast_data.get("text_ru", '')
-                button_text = button_text_ru
-            else:
-                text_to_send = broadcast_data.get("text_en", '')
-                button_text = button_text_en
-
-            # Create the button if the text and URL are provided
-            if button_text and button_url:
-                button = mailing_keyboard(button_text, button_url)
-
-            if broadcast_data.get("photo"):
-                await bot.send_photo(
-                    chat_id=user.user_id,
-                    photo=broadcast_data['photo'],
-                    caption=text_to_send,
-                    reply_markup=button
-                )
-            elif broadcast_data.get("video"):
-                await bot.send_video(
-                    chat_id=user.user_id,
-                    video=broadcast_data['video'],
-                    caption=text_to_send,
-                    reply_markup=button
-                )
-            elif broadcast_data.get("media_group"):
-                media = [InputMediaPhoto(media=media_id) for media_id in broadcast_data["media_group"]]
-                await bot.send_media_group(chat_id=user.user_id, media=media)
-                if text_to_send:
-                    await bot.send_message(chat_id=user.user_id, text=text_to_send, reply_markup=button)
-            else:
-                await bot.send_message(chat_id=user.user_id, text=text_to_send, reply_markup=button)
-            time.sleep(0.25)
-        except Exception as e:
-            await call.message.answer(f"Ошибка отправки сообщения пользователю {user.user_id}: {e}")
-
-    await call.message.edit_text("Рассылка успешно завершена!")
     await state.clear()
 
+    m = await call.message.edit_text("Рассылка запущена...")
+    total = await repo.users.count_deliverable_users()
+    job = await repo.broadcasts.create_job(broadcast_data, chat_id=m.chat.id, message_id=m.message_id, total=total)
+
+    # The mailing runs in the background, so the bot keeps handling updates meanwhile
+    start_mailing(bot, session_pool, redis, job, config.broadcast)
 
 
 @admin_router.callback_query(F.data == "cancel_broadcast_creation")
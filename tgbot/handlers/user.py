@@ -1,5 +1,5 @@
 import re
-from typing import Optional
+from typing import Optional, Dict
 
 from aiogram import Router, F, Bot
 from aiogram.filters import CommandStart, CommandObject
@@ -9,10 +9,12 @@ from aiogram_i18n.context import I18nContext
 
 from funcs import check_user_membership
 from infrastructure.database.repo.requests import RequestsRepo
+from infrastructure.database.views import UserView
 from tgbot.config import Config
 from tgbot.filters.user_exists import UserExistsFilter
 from tgbot.keyboards.inline import language_keyboard, Language, main_keyboard, back_keyboard, referral_keyboard, \
-    tasks_list_keyboard, Tasks, task_keyboard
+    tasks_list_keyboard, Tasks, task_keyboard, Leaders, leaders_keyboard
+from tgbot.services import notifications
 
 user_router = Router()
 
@@ -49,19 +51,19 @@ async def task_deeplink(message: Message, session, redis, i18n: I18nContext, sta
         return
 
     # Prepare the text and media to be sent
-    task_text = f"<b>{task.titles}</b>\n\n{task.descriptions or ''}\n\n<i>{i18n.info.reward(reward=str(task.balance))}</i>"
+    task_text = f"<b>{task.title}</b>\n\n{task.description or ''}\n\n<i>{i18n.info.reward(reward=str(task.balance))}</i>"
 
     # Check if the task has a cover
     if task.cover:
         await message.answer_photo(
             photo=task.cover,
             caption=task_text,
-            reply_markup=task_keyboard(i18n, task.link, task.titles) # Add any relevant buttons or keyboard here if needed
+            reply_markup=task_keyboard(i18n, task.link, task.title) # Add any relevant buttons or keyboard here if needed
         )
     else:
         await message.answer(
             text=task_text,
-            reply_markup=task_keyboard(i18n, task.link, task.titles)  # Add any relevant buttons or keyboard here if needed
+            reply_markup=task_keyboard(i18n, task.link, task.title)  # Add any relevant buttons or keyboard here if needed
         )
 
 @user_router.message(UserExistsFilter(), CommandStart())
@@ -69,38 +71,50 @@ async def first_start(message: Message, i18n: I18nContext, command: CommandObjec
     await handle_start_command(message, i18n, state, command.args)
 
 @user_router.message(CommandStart())
-async def user_start(message: Message, i18n: I18nContext, state: FSMContext):
+async def user_start(message: Message, i18n: I18nContext, state: FSMContext, session, redis,
+                     user: Optional[UserView]):
+    # The user is talking to the bot again, so broadcasts can reach them
+    if user is None or not user.deliverable:
+        await RequestsRepo(session, redis).users.set_deliverable([message.from_user.id], True)
     await handle_start_command(message, i18n, state, is_first_start=False)
 
-async def notify_referrers(referral_chain: list, new_user_id: int, reward_amount: int, bot: Bot, i18n: I18nContext, repo: RequestsRepo):
+def referral_reward(level: int, reward_type: int, reward_amount: int) -> int:
+    if level == 0:
+        reward_percentage = 0.1 if reward_type == 1 else 0.15  # 10% for reward_type 1, 15% for reward_type 2
+    else:
+        reward_percentage = 0.05 if reward_type == 1 else 0.075  # 5% for reward_type 1, 7.5% for reward_type 2
+    return int(reward_amount * reward_percentage)
+
+
+def referral_credits(referral_chain: list, reward_amount: int) -> Dict[int, int]:
     """
-    Notify the referrer and referrer of the referrer if they exist, and apply referral rewards.
+    Calculates the rewards of every referrer in the chain, credited by `UserRepo.create_user`.
     """
+    credits = {}
     for level, referrer_info in enumerate(referral_chain):
-        if referrer_info and "referral" in referrer_info:
-            referral = referrer_info["referral"]
-            reward_type = referral.reward_type
-            language = referrer_info.get("language", "en")  # Fallback to "en" if language is not provided
-
-            # Set the i18n context to the referrer's language
-            await i18n.set_locale(language)
+        referral = referrer_info["referral"]
+        reward = referral_reward(level, referral.reward_type, reward_amount)
+        credits[referral.referral_id] = credits.get(referral.referral_id, 0) + reward
+    return credits
 
-            if level == 0:
-                message_key = "notification-referrer-first_level"
-                reward_percentage = 0.1 if reward_type == 1 else 0.15  # 10% for reward_type 1, 15% for reward_type 2
-            else:
-                message_key = "notification-referrer-second_level"
-                reward_percentage = 0.05 if reward_type == 1 else 0.075  # 5% for reward_type 1, 7.5% for reward_type 2
 
-            message_template = getattr(i18n, message_key)
-
-            # Calculate the reward and update the user's balance
-            reward = int(reward_amount * reward_percentage)
-            user = await repo.users.select_user(referral.referral_id)
-            if user:
-                await repo.users.update_user(user_id=referral.referral_id, balance=reward)
+def notify_referrers(referral_chain: list, credits: Dict[int, int], new_user_id: int, reward_amount: int,
+                     i18n: I18nContext):
+    """
+    Queues the notifications of the credited referrers, so the new user doesn't wait for the messages to be sent.
+    """
+    for level, referrer_info in enumerate(referral_chain):
+        referral = referrer_info["referral"]
+        # Nobody is notified about a reward that wasn't credited
+        if referral.referral_id not in credits:
+            continue
+        language = referrer_info.get("language", "en")  # Fallback to "en" if language is not provided
+        message_key = "notification-referrer-first_level" if level == 0 else "notification-referrer-second_level"
 
-            await bot.send_message(referral.referral_id, message_template(new_user=str(new_user_id), points=reward))
+        # Render the message in the referrer's language
+        reward = referral_reward(level, referral.reward_type, reward_amount)
+        notifications.notify(referral.referral_id, i18n.get(message_key, language,
+                                                            new_user=str(new_user_id), points=reward))
 
 
 async def handle_language_change(call: CallbackQuery, callback_data: Language, i18n: I18nContext, state: FSMContext,
@@ -108,22 +122,18 @@ async def handle_language_change(call: CallbackQuery, callback_data: Language, i
     repo = RequestsRepo(session, redis)
     data = await state.get_data()
     referred_by = int(data.get("referred_by")) if data.get("referred_by") else None
-    new_user = await repo.users.create_user(call.message.chat.id, callback_data.lang_code, referred_by)
-
-    if referred_by:
-        referrer_info = await repo.referrals.get_referral(referred_by)
-        if referrer_info:
-            referrer_of_referrer_info = await repo.referrals.get_referral(referrer_info["referral"].referred_by)
-        else:
-            referrer_of_referrer_info = None
-    else:
-        referrer_info = None
-        referrer_of_referrer_info = None
-
     reward_amount = config.misc.start_reward
 
-    # Notify referrers and apply referral rewards
-    await notify_referrers([referrer_info, referrer_of_referrer_info], new_user.user_id, reward_amount, bot, i18n, repo)
+    # Referrers of a new user are rewarded in the sign up transaction, so a referral is paid once
+    sign_up = await repo.users.create_user(
+        call.message.chat.id, callback_data.lang_code, referred_by,
+        rewards=lambda referral_chain: referral_credits(referral_chain, reward_amount),
+    )
+    # Every language keyboard sent by a repeated /start would otherwise carry the referrer again
+    await state.update_data(referred_by=None)
+
+    if sign_up and sign_up.credits:
+        notify_referrers(sign_up.referral_chain, sign_up.credits, sign_up.user.user_id, reward_amount, i18n)
 
     await i18n.set_locale(callback_data.lang_code)
     await call.message.edit_media(InputMediaPhoto(media=i18n.image.main(), caption=i18n.text.main()),
@@ -156,19 +166,19 @@ async def tasks_choice(call: CallbackQuery, state: FSMContext, i18n: I18nContext
     if task is None:
         await call.answer("Задание не найдено.", show_alert=True)
         return
-    text = f"<b>{task.titles}</b>\n\n{task.descriptions or ''}\n\n<i>{i18n.info.reward(reward=str(task.balance))}</i>"
+    text = f"<b>{task.title}</b>\n\n{task.description or ''}\n\n<i>{i18n.info.reward(reward=str(task.balance))}</i>"
     if task.cover:
         # If cover exists, send the task with the cover image
         await call.message.answer_photo(
             photo=task.cover,
             caption=text,
-            reply_markup=task_keyboard(i18n, task.link, task.titles)
+            reply_markup=task_keyboard(i18n, task.link, task.title)
         )
     else:
         # If cover does not exist, send the task as a text message
         await call.message.answer(
             text=text,
-            reply_markup=task_keyboard(i18n, task.link, task.titles)
+            reply_markup=task_keyboard(i18n, task.link, task.title)
         )
 
 
@@ -215,7 +225,7 @@ async def check_task(call: CallbackQuery, i18n: I18nContext, state: FSMContext,
     else:
         # Handle tasks with other sources if necessary
         await call.answer(i18n.notification.task.completed(), show_alert=True)
-    await repo.users.update_user(call.message.chat.id, balance=int(task.balance))
+    await repo.users.increment_balance(call.message.chat.id, int(task.balance))
     tasks = await repo.user_tasks.get_incomplete_tasks(call.message.chat.id, i18n.locale)
     try:
         await update_media(call, i18n, "tasks", "tasks", tasks_list_keyboard(tasks))
@@ -232,19 +242,19 @@ async def friends(call: CallbackQuery, i18n: I18nContext, session, redis):
                        first_referrals=referrals['first_referrals'], second_referrals=referrals['second_referrals'])
 
 @user_router.callback_query(F.data == "leaders")
-async def leaders(call: CallbackQuery, i18n: I18nContext, session, redis):
+@user_router.callback_query(Leaders.filter())
+async def leaders(call: CallbackQuery, i18n: I18nContext, session, redis, callback_data: Optional[Leaders] = None):
     repo = RequestsRepo(session, redis)
-    leaderboard_data = await repo.users.select_leaderboard(call.message.chat.id)
+    window = callback_data.window if callback_data else "all"
+    leaderboard_data = await repo.leaderboard.select_leaderboard(call.message.chat.id, window=window)
 
     formatted_leaderboard = "\n".join(f"{entry['place']}. {entry['user_id']} - {entry['balance']}" for entry in leaderboard_data["leaderboard"])
 
-    await update_media(call, i18n, "leaders", "leaders", back_keyboard(i18n), leaders=formatted_leaderboard,
-                       place=leaderboard_data['place'])
+    await update_media(call, i18n, "leaders", "leaders", leaders_keyboard(i18n, window), leaders=formatted_leaderboard,
+                       place=leaderboard_data['place'] or "—")
 
 @user_router.callback_query(F.data == "profile")
-async def user_profile(call: CallbackQuery, i18n: I18nContext, session, redis):
-    repo = RequestsRepo(session, redis)
-    user = await repo.users.select_user(call.message.chat.id)
+async def user_profile(call: CallbackQuery, i18n: I18nContext, user: UserView):
     await update_media(call, i18n, "profile", "profile", back_keyboard(i18n), balance=str(user.balance).replace(",", " "))
 
 
@@ -111,7 +111,7 @@ def mailing_tasks_choice(tasks):
     keyboard = InlineKeyboardBuilder()
     for task in tasks:
         keyboard.button(
-                text=task.titles,
+                text=task.title,
                 callback_data=f"task_selected:{task.task_id}"
         )
 
@@ -260,6 +260,21 @@ def back_keyboard(i18n):
     return keyboard
 
 
+class Leaders(CallbackData, prefix="leaders"):
+    window: str
+
+
+def leaders_keyboard(i18n, window: str = "all"):
+    keyboard = InlineKeyboardBuilder()
+    for option, text in (("all", i18n.button.leaders_all()),
+                         ("weekly", i18n.button.leaders_weekly()),
+                         ("daily", i18n.button.leaders_daily())):
+        keyboard.button(text=f"• {text} •" if option == window else text, callback_data=Leaders(window=option).pack())
+    keyboard.button(text=i18n.button.back(), callback_data="back")
+    keyboard.adjust(3, 1)
+    return keyboard.as_markup()
+
+
 def referral_keyboard(i18n, user_id):
     buttons = [
         [
@@ -57,6 +57,9 @@ text-language =
 button-tasks = Tasks
 button-friends = Friends
 button-leaders = Leaders
+button-leaders_all = All time
+button-leaders_weekly = Week
+button-leaders_daily = Today
 button-profile = Profile
 button-invite = Invite a friend
 button-back = 🔙Back
@@ -57,6 +57,9 @@ text-language =
 button-tasks = Задания
 button-friends = Друзья
 button-leaders = Лидеры
+button-leaders_all = За всё время
+button-leaders_weekly = Неделя
+button-leaders_daily = Сегодня
 button-profile = Профиль
 button-invite = Пригласить друга
 button-back = 🔙Назад
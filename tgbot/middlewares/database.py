@@ -3,7 +3,7 @@ from typing import Callable, Dict, Any, Awaitable
 from aiogram import BaseMiddleware
 from aiogram.types import Message
 
-from infrastructure.database.repo.requests import RequestsRepo
+from infrastructure.database.lazy_session import LazySession
 
 
 class DatabaseMiddleware(BaseMiddleware):
@@ -16,7 +16,9 @@ class DatabaseMiddleware(BaseMiddleware):
         event: Message,
         data: Dict[str, Any],
     ) -> Any:
-        async with self.session_pool() as session:
+        # The session is created by the first query, updates served from caches don't touch the pool
+        async with LazySession(self.session_pool) as session:
             data["session"] = session
+            data["session_pool"] = self.session_pool
             result = await handler(event, data)
         return result
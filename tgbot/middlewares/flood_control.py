@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Dict, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import GetUpdates, TelegramMethod, Response
+from aiogram.methods.base import TelegramType
+
+from tgbot.services.broadcaster import TokenBucket
+
+
+class FloodControlMiddleware(BaseRequestMiddleware):
+    """
+    Coordinates all outgoing Bot API requests of the process to keep them just below the flood limits.
+
+    Requests go through one adaptive (AIMD) rate limiter: every successful request raises the rate
+    by `increase` up to `rate_limit`, every flood error multiplies it by `decrease`. When any request
+    gets `retry_after`, all requests are paused globally and for that chat, then retried iteratively
+    with random jitter, so the senders don't wake up and hit the limit again at the same moment.
+
+    Attributes:
+        rate_limit (float): The maximum rate, requests per second.
+        min_rate (float): The rate never goes below this value.
+        increase (float): Rate added after every successful request.
+        decrease (float): Factor applied to the rate after a flood error.
+        max_retries (int): Retries of a request before the flood error is raised to the caller.
+        jitter (float): Maximum random delay added after a pause, seconds.
+    """
+
+    def __init__(self, rate_limit: float = 30, min_rate: float = 1, increase: float = 0.05,
+                 decrease: float = 0.5, max_retries: int = 5, jitter: float = 1.0) -> None:
+        self.rate_limit = rate_limit
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.max_retries = max_retries
+        self.jitter = jitter
+        self.limiter = TokenBucket(rate_limit)
+        self._paused_until = 0.0
+        self._chats_paused_until: Dict[Any, float] = {}
+        self.logger = logging.getLogger(__name__)
+
+    async def _wait(self, chat_id: Optional[Any]) -> None:
+        while (until := max(self._paused_until, self._chats_paused_until.get(chat_id, 0.0))) > time.monotonic():
+            await asyncio.sleep(until - time.monotonic() + random.uniform(0, self.jitter))
+        await self.limiter.acquire()
+
+    def _on_flood(self, chat_id: Optional[Any], retry_after: float) -> None:
+        now = time.monotonic()
+        until = now + retry_after
+        # Requests already in flight when the pause started report the same flood, back off only once
+        if self._paused_until <= now:
+            self.limiter.set_rate(max(self.min_rate, self.limiter.rate * self.decrease))
+        self._paused_until = max(self._paused_until, until)
+        if chat_id is not None:
+            self._chats_paused_until = {chat: t for chat, t in self._chats_paused_until.items() if t > now}
+            self._chats_paused_until[chat_id] = max(self._chats_paused_until.get(chat_id, 0.0), until)
+
+    def _on_success(self) -> None:
+        if self.limiter.rate < self.rate_limit:
+            self.limiter.set_rate(min(self.rate_limit, self.limiter.rate + self.increase))
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        # Long polling is not subject to flood limits and must not be delayed
+        if isinstance(method, GetUpdates):
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, "chat_id", None)
+        attempt = 0
+        while True:
+            await self._wait(chat_id)
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self._on_flood(chat_id, e.retry_after)
+                self.logger.warning(f"Flood control on {type(method).__name__} [chat {chat_id}]: "
+                                    f"pausing for {e.retry_after} s, rate lowered to {self.limiter.rate:.1f}/s")
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                continue
+
+            self._on_success()
+            return response
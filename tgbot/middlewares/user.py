@@ -0,0 +1,35 @@
+from typing import Callable, Dict, Any, Awaitable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from infrastructure.database.lazy_session import LazySession
+from infrastructure.database.repo.users import UserRepo
+
+
+class UserMiddleware(BaseMiddleware):
+    """
+    Resolves the user sending the update once and puts it into `data["user"]`, None for unknown users.
+
+    Runs on updates before i18n, so the locale manager, filters and handlers
+    all share the same lookup (process memory, Redis, then the database).
+    """
+
+    def __init__(self, session_pool, redis) -> None:
+        self.session_pool = session_pool
+        self.redis = redis
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        event_from_user = data.get("event_from_user")
+        user = None
+        if event_from_user is not None:
+            # The session is created only if the user isn't cached
+            async with LazySession(self.session_pool) as session:
+                user = await UserRepo(session, self.redis).select_user(event_from_user.id)
+        data["user"] = user
+        return await handler(event, data)
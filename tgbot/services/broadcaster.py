@@ -1,11 +1,186 @@
 import asyncio
 import logging
-from typing import Union
+import time
+from typing import Union, Optional, Iterable, Callable, Awaitable, Coroutine, Any, AsyncIterable
 
 from aiogram import Bot
 from aiogram import exceptions
 from aiogram.types import InlineKeyboardMarkup
 
+from infrastructure.database.redis_client import RedisClient
+
+# Telegram allows ~30 messages per second to different chats for a single bot
+DEFAULT_RATE_LIMIT = 30
+# Number of senders working concurrently within a single broadcast
+DEFAULT_CONCURRENCY = 10
+
+
+class TokenBucket:
+    """
+    Asynchronous token bucket rate limiter.
+
+    Tokens are refilled continuously at `rate` per second up to `capacity`.
+    Waiters are served in FIFO order, so the limiter may be shared by any
+    number of concurrent senders.
+
+    :param rate: tokens added per second.
+    :param capacity: maximum burst size, defaults to `rate`.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def set_rate(self, rate: float) -> None:
+        """
+        Changes the refill rate, the burst size follows the new rate.
+
+        :param rate: tokens added per second.
+        """
+        self._refill()
+        self.rate = self.capacity = rate
+        self._tokens = min(self._tokens, self.capacity)
+
+    async def acquire(self, tokens: float = 1) -> None:
+        """
+        Waits until the requested amount of tokens is available and takes it.
+
+        :param tokens: amount of tokens to take, at most `capacity` is taken.
+        """
+        tokens = min(tokens, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self._tokens < tokens:
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= tokens
+
+
+class RedisTokenBucket:
+    """
+    Token bucket rate limiter shared by all processes through Redis.
+
+    The bucket state lives in a Redis hash and is refilled and taken from atomically by a Lua script
+    using the Redis server clock, so any number of workers on any number of hosts share one limit.
+
+    :param redis: The Redis client.
+    :param key: The key of the bucket, use one key per bot.
+    :param rate: tokens added per second.
+    :param capacity: maximum burst size, defaults to `rate`.
+    """
+
+    SCRIPT = """
+    local rate = tonumber(ARGV[1])
+    local capacity = tonumber(ARGV[2])
+    local requested = tonumber(ARGV[3])
+    local time = redis.call('TIME')
+    local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+    local tokens = tonumber(state[1]) or capacity
+    local updated_at = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+    local wait = 0
+    if tokens >= requested then
+        tokens = tokens - requested
+    else
+        wait = (requested - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+    redis.call('EXPIRE', KEYS[1], 60)
+    return tostring(wait)
+    """
+
+    def __init__(self, redis: RedisClient, key: str, rate: float, capacity: Optional[float] = None):
+        self.redis = redis
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._script = None
+
+    async def acquire(self, tokens: float = 1) -> None:
+        """
+        Waits until the requested amount of tokens is available and takes it.
+
+        :param tokens: amount of tokens to take, at most `capacity` is taken.
+        """
+        tokens = min(tokens, self.capacity)
+        if self._script is None:
+            self._script = self.redis.redis.register_script(self.SCRIPT)
+        while wait := float(await self._script(keys=[self.key], args=[self.rate, self.capacity, tokens])):
+            await asyncio.sleep(wait)
+
+
+def is_unreachable(error: exceptions.TelegramAPIError) -> bool:
+    """
+    Tells whether the error means the chat can't receive messages anymore:
+    the bot was blocked, the user is deactivated or the chat doesn't exist.
+
+    :param error: The error raised by the Bot API call.
+    :return: True if further messages to the chat are pointless.
+    """
+    if isinstance(error, exceptions.TelegramForbiddenError):
+        return True
+    return isinstance(error, exceptions.TelegramBadRequest) and "chat not found" in error.message.lower()
+
+
+def error_label(error: Exception) -> str:
+    """
+    Describes the error for delivery statistics, grouping errors of the same kind together.
+
+    :param error: The error raised while sending.
+    :return: The Bot API description for client errors, the exception class name otherwise.
+    """
+    if isinstance(error, (exceptions.TelegramBadRequest, exceptions.TelegramForbiddenError)):
+        return error.message
+    return type(error).__name__
+
+
+def shared_rate_limiter(redis: RedisClient, bot_id: int, rate: float) -> RedisTokenBucket:
+    """
+    Creates the limiter of the bot shared by the bot process and every mailing worker.
+
+    :param redis: The Redis client.
+    :param bot_id: The ID of the bot.
+    :param rate: Messages per second allowed for the bot across all processes.
+    :return: The RedisTokenBucket.
+    """
+    return RedisTokenBucket(redis, f"broadcast:rate_limit:{bot_id}", rate)
+
+
+# Global limiter shared by every broadcast running in this process, replaced by the shared one on startup
+rate_limiter: Union[TokenBucket, RedisTokenBucket] = TokenBucket(DEFAULT_RATE_LIMIT)
+
+# Strong references to background broadcasts, so they are not garbage collected mid-flight
+_background_tasks: set[asyncio.Task] = set()
+
+
+def run_in_background(coro: Coroutine[Any, Any, Any]) -> asyncio.Task:
+    """
+    Schedules a coroutine as a background task and keeps a reference to it until it finishes.
+
+    :param coro: coroutine to run.
+    :return: the created task.
+    """
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    task.add_done_callback(_log_failure)
+    return task
+
+
+def _log_failure(task: asyncio.Task) -> None:
+    # Nobody awaits background tasks, so their errors would only surface on garbage collection
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f"Background task {task.get_name()} failed", exc_info=task.exception())
+
 
 async def send_message(
     bot: Bot,
@@ -36,13 +211,10 @@ async def send_message(
     except exceptions.TelegramForbiddenError:
         logging.error(f"Target [ID:{user_id}]: got TelegramForbiddenError")
     except exceptions.TelegramRetryAfter as e:
+        # Retries are done by FloodControlMiddleware, getting here means they are exhausted
         logging.error(
-            f"Target [ID:{user_id}]: Flood limit is exceeded. Sleep {e.retry_after} seconds."
+            f"Target [ID:{user_id}]: Flood limit is exceeded, retry after {e.retry_after} seconds."
         )
-        await asyncio.sleep(e.retry_after)
-        return await send_message(
-            bot, user_id, text, disable_notification, reply_markup
-        )  # Recursive call
     except exceptions.TelegramAPIError:
         logging.exception(f"Target [ID:{user_id}]: failed")
     else:
@@ -51,32 +223,84 @@ async def send_message(
     return False
 
 
+async def deliver(
+    recipients: Union[Iterable[Any], AsyncIterable[Any]],
+    send: Callable[[Any], Awaitable[bool]],
+    limiter: Union[TokenBucket, RedisTokenBucket, None] = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    cost: Optional[Callable[[Any], int]] = None,
+) -> int:
+    """
+    Concurrent delivery engine.
+
+    Recipients are fed through a bounded queue to a pool of `concurrency` senders.
+    Every send takes a token per Bot API request from the rate limiter first, so the overall
+    throughput never exceeds the limiter rate, while slow requests don't block other senders.
+
+    :param recipients: Iterable or async iterable (e.g. `UserRepo.iter_users`) of recipients.
+    :param send: Coroutine function delivering to a single recipient, returns success.
+    :param limiter: Rate limiter, defaults to the global one.
+    :param concurrency: Number of concurrent senders.
+    :param cost: Number of Bot API requests `send` makes for a recipient, defaults to one.
+    :return: Count of successful deliveries.
+    """
+    limiter = limiter or rate_limiter
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    count = 0
+
+    async def sender():
+        nonlocal count
+        while (recipient := await queue.get()) is not None:
+            await limiter.acquire(cost(recipient) if cost else 1)
+            try:
+                if await send(recipient):
+                    count += 1
+            except Exception:
+                logging.exception(f"Target [ID:{recipient}]: unexpected error")
+
+    senders = [asyncio.create_task(sender()) for _ in range(concurrency)]
+    try:
+        if isinstance(recipients, AsyncIterable):
+            async for recipient in recipients:
+                await queue.put(recipient)
+        else:
+            for recipient in recipients:
+                await queue.put(recipient)
+        for _ in senders:
+            await queue.put(None)
+        await asyncio.gather(*senders)
+    finally:
+        for task in senders:
+            task.cancel()
+
+    return count
+
+
 async def broadcast(
     bot: Bot,
-    users: list[Union[str, int]],
+    users: Union[Iterable[Union[str, int]], AsyncIterable[Union[str, int]]],
     text: str,
     disable_notification: bool = False,
     reply_markup: InlineKeyboardMarkup = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
 ) -> int:
     """
     Simple broadcaster.
     :param bot: Bot instance.
-    :param users: List of users.
+    :param users: Iterable or async iterable of user ids.
     :param text: Text of the message.
     :param disable_notification: Disable notification or not.
     :param reply_markup: Reply markup.
+    :param concurrency: Number of concurrent senders.
     :return: Count of messages.
     """
     count = 0
     try:
-        for user_id in users:
-            if await send_message(
-                bot, user_id, text, disable_notification, reply_markup
-            ):
-                count += 1
-            await asyncio.sleep(
-                0.05
-            )  # 20 messages per second (Limit: 30 messages per second)
+        count = await deliver(
+            users,
+            lambda user_id: send_message(bot, user_id, text, disable_notification, reply_markup),
+            concurrency=concurrency,
+        )
     finally:
         logging.info(f"{count} messages successful sent.")
 
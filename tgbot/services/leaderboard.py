@@ -0,0 +1,37 @@
+import asyncio
+import logging
+
+from infrastructure.database.redis_client import RedisClient
+from infrastructure.database.repo.leaderboard import LeaderboardRepo
+from tgbot.services import broadcaster
+
+# Seconds between two checks for closed leaderboard windows
+ARCHIVE_INTERVAL = 10 * 60
+
+
+async def archive_leaderboards(session_pool, redis: RedisClient, interval: float = ARCHIVE_INTERVAL) -> None:
+    """
+    Periodically archives closed daily and weekly leaderboards to Postgres.
+
+    :param session_pool: The database session pool.
+    :param redis: The Redis client.
+    :param interval: Seconds between two checks.
+    """
+    while True:
+        try:
+            async with session_pool() as session:
+                await LeaderboardRepo(session, redis).archive_closed_windows()
+        except Exception as e:
+            logging.error(f"Error archiving leaderboards: {e}")
+        await asyncio.sleep(interval)
+
+
+def start_archiving(session_pool, redis: RedisClient) -> asyncio.Task:
+    """
+    Starts archiving closed leaderboard windows in the background.
+
+    :param session_pool: The database session pool.
+    :param redis: The Redis client.
+    :return: The background task.
+    """
+    return broadcaster.run_in_background(archive_leaderboards(session_pool, redis))
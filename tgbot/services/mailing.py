@@ -0,0 +1,424 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import timedelta
+from types import MappingProxyType
+from typing import Tuple, Mapping, List, Callable, Awaitable, Dict
+
+from aiogram import Bot, exceptions
+from aiogram.methods import TelegramMethod, SendMessage, SendPhoto, SendVideo, SendMediaGroup
+from aiogram.types import InputMediaPhoto
+
+from infrastructure.database.models import User
+from infrastructure.database.redis_client import RedisClient
+from infrastructure.database.repo.broadcasts import BroadcastJob, BroadcastsRepo, BroadcastChunk
+from infrastructure.database.repo.requests import RequestsRepo
+from tgbot.config import BroadcastConfig
+from tgbot.keyboards.inline import mailing_keyboard
+from tgbot.services import broadcaster
+
+# Number of users processed between two checkpoints of a mailing job
+MAILING_BATCH_SIZE = 100
+# Number of users in a chunk of a distributed mailing
+STREAM_CHUNK_SIZE = 100
+# Milliseconds a chunk may stay unacknowledged before another worker takes it over
+STREAM_RECLAIM_IDLE = 5 * 60 * 1000
+# Seconds between two claim renewals of the chunk being delivered, well within STREAM_RECLAIM_IDLE
+STREAM_CLAIM_RENEWAL = STREAM_RECLAIM_IDLE / 1000 / 3
+# Seconds between two edits of the admin progress message
+PROGRESS_INTERVAL = 5
+# Weight of the latest measurement in the reported delivery rate
+PROGRESS_SMOOTHING = 0.3
+
+
+@dataclass(frozen=True)
+class CompiledMailing:
+    """
+    The broadcast compiled into ready-to-send Bot API requests, one sequence per language.
+
+    Requests are built once with a placeholder `chat_id`, so sending to a user only swaps
+    the `chat_id` in a shallow copy instead of rebuilding texts, keyboards and media.
+
+    Attributes:
+        requests (Mapping[str, Tuple[TelegramMethod, ...]]): The requests to send, by language.
+        default_language (str): The language used for users without a dedicated payload.
+    """
+
+    requests: Mapping[str, Tuple[TelegramMethod, ...]]
+    default_language: str = "en"
+
+    def for_language(self, language: str) -> Tuple[TelegramMethod, ...]:
+        return self.requests.get(language) or self.requests[self.default_language]
+
+    def request_count(self, language: str) -> int:
+        """
+        :return: The number of Bot API requests sending to a user of the language takes, the rate limiter cost.
+        """
+        return len(self.for_language(language))
+
+    def recipient_cost(self, user: Tuple[int, str]) -> int:
+        """
+        The `cost` of a (user_id, language) recipient for `broadcaster.deliver`.
+        """
+        return self.request_count(user[1])
+
+    async def send(self, bot: Bot, user_id: int, language: str) -> bool:
+        """
+        Sends the broadcast to a single user.
+
+        :param bot: Bot instance.
+        :param user_id: The ID of the recipient.
+        :param language: The recipient's language.
+        :return: True once the message is sent.
+        """
+        for request in self.for_language(language):
+            await bot(request.model_copy(update={"chat_id": user_id}))
+        return True
+
+
+def compile_mailing(broadcast_data: dict) -> CompiledMailing:
+    """
+    Compiles the broadcast assembled in the admin panel into per-language requests.
+
+    :param broadcast_data: The broadcast data collected in the FSM.
+    :return: The CompiledMailing.
+    """
+    button_text_ru = broadcast_data.get("button_text_ru")
+    button_text_en = broadcast_data.get("button_text_en")
+    button_url = broadcast_data.get("button_url")
+
+    # Check for task deeplink and set button text accordingly
+    if broadcast_data.get("task_deeplink"):
+        button_text_ru = broadcast_data.get("button_text_ru", "Перейти к заданию")
+        button_text_en = broadcast_data.get("button_text_en", "Go to the task")
+        button_url = broadcast_data.get("task_deeplink")
+
+    # Photos of the album are the same for every language
+    media = None
+    if broadcast_data.get("media_group"):
+        media = [InputMediaPhoto(media=media_id) for media_id in broadcast_data["media_group"]]
+
+    requests = {}
+    for language, text_to_send, button_text in (
+        ("ru", broadcast_data.get("text_ru", ''), button_text_ru),
+        ("en", broadcast_data.get("text_en", ''), button_text_en),
+    ):
+        # Create the button if the text and URL are provided
+        button = mailing_keyboard(button_text, button_url) if button_text and button_url else None
+
+        if broadcast_data.get("photo"):
+            requests[language] = (
+                SendPhoto(chat_id=0, photo=broadcast_data['photo'], caption=text_to_send, reply_markup=button),
+            )
+        elif broadcast_data.get("video"):
+            requests[language] = (
+                SendVideo(chat_id=0, video=broadcast_data['video'], caption=text_to_send, reply_markup=button),
+            )
+        elif media:
+            requests[language] = (SendMediaGroup(chat_id=0, media=media),)
+            if text_to_send:
+                requests[language] += (SendMessage(chat_id=0, text=text_to_send, reply_markup=button),)
+        else:
+            requests[language] = (SendMessage(chat_id=0, text=text_to_send, reply_markup=button),)
+
+    return CompiledMailing(requests=MappingProxyType(requests))
+
+
+@dataclass
+class DeliveryResults:
+    """
+    Delivery outcomes collected by a sender between two checkpoints.
+
+    Attributes:
+        unreachable (List[int]): IDs of users whose chats are blocked, deactivated or deleted.
+        errors (Counter): Counts of errors by description.
+    """
+
+    unreachable: List[int] = field(default_factory=list)
+    errors: Counter = field(default_factory=Counter)
+
+    def clear(self) -> None:
+        self.unreachable.clear()
+        self.errors.clear()
+
+
+def make_sender(bot: Bot, compiled: CompiledMailing,
+                results: DeliveryResults) -> Callable[[Tuple[int, str]], Awaitable[bool]]:
+    """
+    Creates the coroutine function delivering the compiled job to a single (user_id, language) recipient.
+    Errors are counted in `results` instead of being reported one by one.
+
+    :param bot: Bot instance.
+    :param compiled: The compiled payload of the job.
+    :param results: The collector of delivery outcomes.
+    :return: The sender for `broadcaster.deliver`.
+    """
+    async def send(user: Tuple[int, str]) -> bool:
+        user_id, language = user
+        try:
+            return await compiled.send(bot, user_id, language)
+        except Exception as e:
+            results.errors[broadcaster.error_label(e)] += 1
+            if isinstance(e, exceptions.TelegramAPIError) and broadcaster.is_unreachable(e):
+                # Dead chats are excluded from the following mailings
+                results.unreachable.append(user_id)
+            return False
+
+    return send
+
+
+async def run_mailing(bot: Bot, session_pool, redis: RedisClient, job: BroadcastJob) -> BroadcastJob:
+    """
+    Delivers the broadcast job to all deliverable users starting from its cursor.
+    Users whose chats turn out to be blocked or deleted are marked as undeliverable.
+
+    Users are processed in batches ordered by ID. After every batch the job is checkpointed in Redis,
+    so a restarted job continues from the last processed user instead of sending to everyone again.
+    Designed to be run in the background with `broadcaster.run_in_background`.
+
+    :param bot: Bot instance.
+    :param session_pool: The database session pool.
+    :param redis: The Redis client.
+    :param job: The BroadcastJob to run.
+    :return: The finished BroadcastJob.
+    """
+    jobs = BroadcastsRepo(redis)
+    results = DeliveryResults()
+    compiled = compile_mailing(job.payload)
+    send = make_sender(bot, compiled, results)
+
+    async with session_pool() as session:
+        users = RequestsRepo(session, redis).users
+        async for batch in users.iter_user_batches(MAILING_BATCH_SIZE, where=(User.deliverable,),
+                                                   after_user_id=job.cursor):
+            count = await broadcaster.deliver(batch, send, cost=compiled.recipient_cost)
+            await users.set_deliverable(results.unreachable, False)
+            blocked = len(results.unreachable)
+            await jobs.checkpoint(job, cursor=batch[-1].user_id, sent=count, failed=len(batch) - count - blocked,
+                                  blocked=blocked, errors=results.errors)
+            results.clear()
+
+    await jobs.finish_job(job)
+    logging.info(f"Mailing {job.job_id} finished: {job.sent} sent, {job.failed} failed, {job.blocked} blocked.")
+    return job
+
+
+async def publish_mailing(session_pool, redis: RedisClient, job: BroadcastJob) -> None:
+    """
+    Splits the recipients of the job into chunks and publishes them to the Redis Stream for the workers.
+    The job cursor moves with every published chunk, so a restarted publisher continues where it stopped.
+
+    :param session_pool: The database session pool.
+    :param redis: The Redis client.
+    :param job: The BroadcastJob to publish.
+    """
+    jobs = BroadcastsRepo(redis)
+
+    async with session_pool() as session:
+        users = RequestsRepo(session, redis).users
+        async for batch in users.iter_user_batches(STREAM_CHUNK_SIZE, where=(User.deliverable,),
+                                                   after_user_id=job.cursor):
+            await jobs.publish_chunk(job, batch)
+
+    # Workers may have delivered every chunk already, then nobody else is going to finish the job
+    if await jobs.mark_published(job):
+        await jobs.finish_job(job)
+
+
+async def keep_claimed(jobs: BroadcastsRepo, chunk: BroadcastChunk, consumer: str) -> None:
+    """
+    Renews the claim of the consumer on the chunk until cancelled,
+    so a slow chunk isn't reclaimed and delivered again by another worker.
+
+    :param jobs: The BroadcastsRepo.
+    :param chunk: The BroadcastChunk being delivered.
+    :param consumer: The name of the worker.
+    """
+    while True:
+        await asyncio.sleep(STREAM_CLAIM_RENEWAL)
+        if not await jobs.touch_chunk(chunk, consumer):
+            logging.warning(f"Chunk {chunk.entry_id} of broadcast {chunk.job_id} was reclaimed by another worker")
+            return
+
+
+async def run_worker(bot: Bot, session_pool, redis: RedisClient, consumer: str, rate_limit: int) -> None:
+    """
+    Delivers chunks of distributed mailings from the Redis Stream until cancelled.
+
+    Any number of workers may run on any number of hosts: chunks are shared through the consumer group,
+    chunks left unacknowledged by a dead worker are reclaimed after `STREAM_RECLAIM_IDLE` milliseconds
+    (a live worker renews the claim on the chunk it delivers),
+    and all workers take tokens from one rate limiter in Redis, shared with the bot process,
+    so the bot stays within Telegram limits.
+
+    :param bot: Bot instance.
+    :param session_pool: The database session pool.
+    :param redis: The Redis client.
+    :param consumer: The unique name of the worker within the consumer group.
+    :param rate_limit: Messages per second allowed for the bot across all workers.
+    """
+    jobs = BroadcastsRepo(redis)
+    await jobs.create_consumer_group()
+    limiter = broadcaster.shared_rate_limiter(redis, bot.id, rate_limit)
+    compiled_jobs: Dict[int, Tuple[BroadcastJob, CompiledMailing]] = {}
+
+    while True:
+        if compiled_jobs:
+            # Jobs finished by other workers or failed are never completed here
+            active = await jobs.get_active_job_ids()
+            for job_id in compiled_jobs.keys() - active:
+                del compiled_jobs[job_id]
+
+        chunks = (await jobs.claim_stale_chunks(consumer, STREAM_RECLAIM_IDLE)
+                  or await jobs.read_chunks(consumer))
+        for chunk in chunks:
+            if chunk.job_id not in compiled_jobs:
+                job = await jobs.get_job(chunk.job_id)
+                if job is None or job.status != "running":
+                    await jobs.skip_chunk(chunk)
+                    continue
+                compiled_jobs[chunk.job_id] = job, compile_mailing(job.payload)
+            job, compiled = compiled_jobs[chunk.job_id]
+
+            results = DeliveryResults()
+            renewal = asyncio.create_task(keep_claimed(jobs, chunk, consumer))
+            try:
+                count = await broadcaster.deliver(chunk.users, make_sender(bot, compiled, results), limiter=limiter,
+                                                  cost=compiled.recipient_cost)
+            finally:
+                renewal.cancel()
+            async with session_pool() as session:
+                await RequestsRepo(session, redis).users.set_deliverable(results.unreachable, False)
+
+            blocked = len(results.unreachable)
+            if await jobs.complete_chunk(chunk, sent=count, failed=len(chunk.users) - count - blocked,
+                                         blocked=blocked, errors=results.errors):
+                await jobs.finish_job(job)
+                del compiled_jobs[chunk.job_id]
+
+
+def format_progress(job: BroadcastJob, errors: Mapping[str, int]) -> str:
+    """
+    Formats the progress report of the job for the admin.
+
+    :param job: The BroadcastJob.
+    :param errors: The histogram of delivery errors.
+    :return: The report text.
+    """
+    if job.status == "finished":
+        lines = [f"Рассылка #{job.job_id} успешно завершена!"]
+    elif job.status == "failed":
+        lines = [f"Рассылка #{job.job_id} прервана из-за ошибки!"]
+    else:
+        lines = [f"Рассылка #{job.job_id} выполняется..."]
+    lines += [
+        f"Отправлено: {job.sent}",
+        f"Ошибок: {job.failed}",
+        f"Заблокировали бота: {job.blocked}",
+        f"Обработано: {job.processed} из {job.total}",
+    ]
+    if job.status == "running":
+        lines += [
+            f"Скорость: {job.rate:.1f} сообщ./с",
+            f"Осталось: ~{timedelta(seconds=round(job.eta))}",
+        ]
+    if errors:
+        lines.append("\nОшибки:")
+        lines += [f"{count} — {error}" for error, count in sorted(errors.items(), key=lambda item: -item[1])[:10]]
+    return "\n".join(lines)
+
+
+async def report_progress(bot: Bot, redis: RedisClient, job_id: int, sender: asyncio.Task = None) -> None:
+    """
+    Edits the admin message of the job with its progress every `PROGRESS_INTERVAL` seconds until the job finishes.
+    The measured rate and ETA are saved to the job, so they are also available as metrics.
+
+    :param bot: Bot instance.
+    :param redis: The Redis client.
+    :param job_id: The ID of the BroadcastJob.
+    :param sender: The task running the job, reporting stops if it's cancelled.
+    """
+    jobs = BroadcastsRepo(redis)
+    previous = None
+    rate = 0.0
+
+    while (job := await jobs.get_job(job_id)) is not None:
+        now = time.monotonic()
+        if previous is not None:
+            # Exponential moving average smooths the rate between checkpoints
+            measured = (job.processed - previous[1]) / (now - previous[0])
+            rate = measured if not rate else PROGRESS_SMOOTHING * measured + (1 - PROGRESS_SMOOTHING) * rate
+            eta = max(job.total - job.processed, 0) / rate if rate else 0.0
+            await jobs.set_progress(job, rate, eta)
+        previous = now, job.processed
+
+        try:
+            await bot.edit_message_text(format_progress(job, await jobs.get_errors(job_id)),
+                                        chat_id=job.chat_id, message_id=job.message_id)
+        except exceptions.TelegramBadRequest:
+            # The message is not modified when nothing changed since the last report
+            pass
+        except exceptions.TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+        except exceptions.TelegramAPIError as e:
+            # Network errors and Telegram outages are skipped until the next report
+            logging.warning(f"Progress report of mailing {job_id} failed: {e}")
+
+        if job.status != "running" or (sender is not None and sender.cancelled()):
+            return
+        await asyncio.sleep(PROGRESS_INTERVAL)
+
+
+async def fail_on_error(redis: RedisClient, job: BroadcastJob, coro: Awaitable) -> None:
+    """
+    Runs the sending or publishing of the job and marks the job as failed if it raises,
+    so it's not resumed again and its progress report stops. The error is re-raised to be logged.
+
+    :param redis: The Redis client.
+    :param job: The BroadcastJob.
+    :param coro: The coroutine running the job.
+    """
+    try:
+        await coro
+    except Exception:
+        await BroadcastsRepo(redis).finish_job(job, status="failed")
+        raise
+
+
+def start_mailing(bot: Bot, session_pool, redis: RedisClient, job: BroadcastJob,
+                  config: BroadcastConfig) -> asyncio.Task:
+    """
+    Starts the job in the background: sends it from this process,
+    or publishes it for the workers when the delivery is distributed.
+    The progress is reported to the admin message of the job in both cases.
+
+    :param bot: Bot instance.
+    :param session_pool: The database session pool.
+    :param redis: The Redis client.
+    :param job: The BroadcastJob to start.
+    :param config: The broadcast configuration.
+    :return: The background task.
+    """
+    if config.distributed:
+        coro = publish_mailing(session_pool, redis, job)
+    else:
+        coro = run_mailing(bot, session_pool, redis, job)
+    sender = broadcaster.run_in_background(fail_on_error(redis, job, coro))
+    broadcaster.run_in_background(report_progress(bot, redis, job.job_id, sender))
+    return sender
+
+
+async def resume_mailings(bot: Bot, session_pool, redis: RedisClient, config: BroadcastConfig) -> None:
+    """
+    Restarts unfinished broadcast jobs in the background from their last checkpoint.
+
+    :param bot: Bot instance.
+    :param session_pool: The database session pool.
+    :param redis: The Redis client.
+    :param config: The broadcast configuration.
+    """
+    for job in await BroadcastsRepo(redis).get_active_jobs():
+        logging.info(f"Resuming mailing {job.job_id} after user {job.cursor}")
+        start_mailing(bot, session_pool, redis, job, config)
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+from typing import AsyncIterator, Tuple
+
+from aiogram import Bot
+
+from tgbot.services import broadcaster
+
+# Notifications waiting to be sent, new ones are dropped once it's full
+QUEUE_SIZE = 10000
+# Number of notifications sent concurrently
+DEFAULT_CONCURRENCY = 5
+
+_queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+
+def notify(user_id: int, text: str) -> bool:
+    """
+    Queues a message to be sent in the background, so the handler doesn't wait for Telegram.
+
+    :param user_id: The ID of the recipient.
+    :param text: The text of the message.
+    :return: False if the queue is full and the message was dropped.
+    """
+    try:
+        _queue.put_nowait((user_id, text))
+    except asyncio.QueueFull:
+        logging.error(f"Target [ID:{user_id}]: notification queue is full, message dropped")
+        return False
+    return True
+
+
+async def _pending() -> AsyncIterator[Tuple[int, str]]:
+    while True:
+        yield await _queue.get()
+
+
+async def _send(bot: Bot, notification: Tuple[int, str]) -> bool:
+    try:
+        return await broadcaster.send_message(bot, *notification)
+    finally:
+        _queue.task_done()
+
+
+async def send_notifications(bot: Bot, concurrency: int = DEFAULT_CONCURRENCY) -> None:
+    """
+    Sends queued notifications forever, sharing the global rate limiter with broadcasts,
+    which is the limiter shared with the mailing workers through Redis once the bot is started.
+
+    :param bot: Bot instance.
+    :param concurrency: Number of concurrent senders.
+    """
+    await broadcaster.deliver(_pending(), lambda notification: _send(bot, notification), concurrency=concurrency)
+
+
+def start_sending(bot: Bot, concurrency: int = DEFAULT_CONCURRENCY) -> asyncio.Task:
+    """
+    Starts sending queued notifications in the background.
+
+    :param bot: Bot instance.
+    :param concurrency: Number of concurrent senders.
+    :return: The background task.
+    """
+    return broadcaster.run_in_background(send_notifications(bot, concurrency))
+
+
+async def drain(timeout: float = 10) -> None:
+    """
+    Waits until the queued notifications are sent, e.g. on shutdown.
+
+    :param timeout: Seconds to wait at most, the rest is dropped.
+    """
+    try:
+        await asyncio.wait_for(_queue.join(), timeout)
+    except asyncio.TimeoutError:
+        logging.error(f"{_queue.qsize()} notifications were not sent before shutdown")
@@ -0,0 +1,48 @@
+import asyncio
+import logging
+import os
+import socket
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+
+from bot import setup_logging
+from infrastructure.database.redis_client import RedisClient
+from infrastructure.database.setup import create_engine, create_session_pool
+from tgbot.config import load_config
+from tgbot.middlewares.flood_control import FloodControlMiddleware
+from tgbot.services import mailing
+
+
+async def main():
+    """
+    Runs a broadcast worker, delivering chunks of distributed mailings (BROADCAST_DISTRIBUTED=true).
+    Start as many workers as needed, e.g. `docker compose up --scale broadcast_worker=4`.
+    """
+    setup_logging()
+
+    config = load_config(".env")
+
+    bot = Bot(token=config.tg_bot.token, default=DefaultBotProperties(parse_mode='HTML'))
+    bot.session.middleware(FloodControlMiddleware(config.broadcast.rate_limit))
+
+    engine = create_engine(config.db)
+    session_pool = create_session_pool(engine)
+
+    redis = RedisClient(config.redis.dsn())
+    await redis.connect()
+
+    consumer = f"{socket.gethostname()}-{os.getpid()}"
+    logging.info(f"Starting broadcast worker {consumer}")
+    try:
+        await mailing.run_worker(bot, session_pool, redis, consumer, config.broadcast.rate_limit)
+    finally:
+        await bot.session.close()
+        await redis.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except (KeyboardInterrupt, SystemExit):
+        logging.error("Воркер рассылки был выключен!")